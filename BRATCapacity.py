@@ -0,0 +1,97 @@
+# -------------------------------------------------------------------------------
+# Name:        BRAT Capacity
+# Purpose:     The array calculations that turn FIS outputs into dam capacities and dam counts
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# These are the same steps the vegetation and combined FIS tools carry out on the network with cursors, done on
+# arrays holding every reach, so that the fused capacity tool, calibration and sensitivity analysis all treat FIS
+# outputs the same way. This module doesn't use arcpy, so it can be used in worker processes.
+
+import numpy as np
+
+
+def veg_inputs_in_range(riparian, streamside):
+    """
+    Puts vegetation FIS inputs in range the same way Veg_FIS does
+    :param riparian: Array of riparian (100 m buffer) vegetation values
+    :param streamside: Array of streamside (30 m buffer) vegetation values
+    :return: List of the two arrays, as copies
+    """
+    return [np.clip(np.asarray(values, np.float64), 0, 4) for values in [riparian, streamside]]
+
+
+def comb_inputs_in_range(ovc, sp2, splow, slope):
+    """
+    Puts combined FIS inputs in range the same way Comb_FIS does
+    :param ovc: Array of vegetation capacities (oVC_*)
+    :param sp2: Array of 2 year peak flow stream powers (iHyd_SP2)
+    :param splow: Array of baseflow stream powers (iHyd_SPLow)
+    :param slope: Array of reach slopes (iGeo_Slope)
+    :return: List of the four arrays, as copies
+    """
+    ovc = np.clip(np.asarray(ovc, np.float64), 0, 45)
+    sp2 = np.array(sp2, np.float64)
+    sp2[sp2 < 0] = 0.0001
+    sp2[sp2 > 10000] = 10000
+    splow = np.array(splow, np.float64)
+    splow[splow < 0] = 0.0001
+    splow[splow > 10000] = 10000
+    slope = np.array(slope, np.float64)
+    slope[slope > 1] = 1
+    return [ovc, sp2, splow, slope]
+
+
+def none_output(system):
+    """
+    The output of a system when only its 'none' output term fires
+    :param system: BatchFIS.MamdaniSystem
+    :return: Float
+    """
+    activation = np.zeros((1, len(system.output.term_names)))
+    activation[0, system.output.term_index('none')] = 1.0
+    return system.defuzzify(activation)[0]
+
+
+def limit_veg_capacity(veg_capacity, veg_system):
+    """
+    Sets vegetation capacity to 0 where the FIS output falls fully in 'none', as Veg_FIS does
+    :param veg_capacity: Array of vegetation FIS outputs
+    :param veg_system: The vegetation FIS
+    :return: Array of vegetation capacities (oVC_*)
+    """
+    veg_capacity = np.array(veg_capacity, np.float64)
+    veg_capacity[np.round(veg_capacity, 6) == round(none_output(veg_system), 6)] = 0.0
+    return veg_capacity
+
+
+def limit_comb_capacity(comb_capacity, veg_capacity, drainage_area, max_DA_thresh, comb_system):
+    """
+    Applies the limits Comb_FIS puts on combined FIS output: capacity can't be more than vegetation capacity, is 0
+    where the drainage area is at or above the threshold, and is 0 where the output falls fully in 'none'
+    :param comb_capacity: Array of combined FIS outputs
+    :param veg_capacity: Array of vegetation capacities (oVC_*)
+    :param drainage_area: Array of drainage areas (iGeo_DA)
+    :param max_DA_thresh: Drainage area above which beaver can't build dams
+    :param comb_system: The combined FIS
+    :return: Array of combined capacities (oCC_*)
+    """
+    comb_capacity = np.minimum(comb_capacity, veg_capacity)
+    comb_capacity[np.asarray(drainage_area) >= float(max_DA_thresh)] = 0.0
+    comb_capacity[np.round(comb_capacity, 6) == round(none_output(comb_system), 6)] = 0.0
+    return comb_capacity
+
+
+def dam_count(comb_capacity, length):
+    """
+    Finds the number of dams a reach can hold (mCC_*_CT). Reaches that can hold part of a dam are given one
+    :param comb_capacity: Array of combined capacities (dams/km)
+    :param length: Array of reach lengths (iGeo_Len, in meters)
+    :return: Integer array
+    """
+    raw_count = comb_capacity * np.asarray(length, np.float64) / 1000
+    # halves round away from zero, as python 2's round() does in Comb_FIS
+    count = np.where(raw_count < 0, np.ceil(raw_count - 0.5), np.floor(raw_count + 0.5))
+    count[(raw_count > 0) & (raw_count < 1)] = 1
+    return count.astype(np.int64)
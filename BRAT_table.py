@@ -15,9 +15,16 @@ import os
 import sys
 import datetime
 import time
+import numpy as np
 import FindBraidedNetwork
 import BRAT_Braid_Handler
-from SupportingFunctions import make_layer, make_folder, getUUID, find_relative_path, write_xml_element_with_path
+import ReachZonal
+import D8Flow
+import VectorDistance
+import CorridorDistance
+import NetworkGeometry
+from SupportingFunctions import make_layer, make_folder, getUUID, find_relative_path, write_xml_element_with_path, \
+    read_lines, read_feature_parts
 import XMLBuilder
 import SupportingFunctions
 
@@ -26,6 +33,11 @@ XMLBuilder = XMLBuilder.XMLBuilder
 
 reload(FindBraidedNetwork)
 reload(BRAT_Braid_Handler)
+reload(ReachZonal)
+reload(D8Flow)
+reload(VectorDistance)
+reload(CorridorDistance)
+reload(NetworkGeometry)
 
 
 def main(
@@ -45,11 +57,13 @@ def main(
     description,
     find_clusters,
     should_segment_network,
-    is_verbose):
+    is_verbose,
+    distance_mode=None):
 
     find_clusters = parse_input_bool(find_clusters)
     should_segment_network = parse_input_bool(should_segment_network)
     is_verbose = parse_input_bool(is_verbose)
+    distance_mode = parse_distance_mode(distance_mode)
 
     scratch = 'in_memory'
     #arcpy.env.workspace = scratch
@@ -114,7 +128,8 @@ def main(
     # run ipc attributes function if conflict layers are defined by user
     if road is not None and valley_bottom is not None:
         arcpy.AddMessage('Adding "iPC" attributes to network...')
-        ipc_attributes(seg_network_copy, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose)
+        ipc_attributes(seg_network_copy, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose,
+                       distance_mode=distance_mode)
 
     if perennial_network is not None:
         find_is_perennial(seg_network_copy, perennial_network)
@@ -139,24 +154,20 @@ def main(
     arcpy.CheckInExtension("spatial")
 
 
-def find_is_perennial(seg_network_copy, perennial_network):
+def find_is_perennial(seg_network_copy, perennial_network, tolerance=NetworkGeometry.NODE_TOLERANCE):
     """
-    Adds the IsPerennial attribute
+    Adds the IsPerennial attribute, which is 1 for reaches that share a line segment with the perennial network
     :param seg_network_copy: The BRAT Table output
     :param perennial_network: The input stream network that only contains perennial networks
+    :param tolerance: Distance within which vertices of the two networks are the same (see
+                      NetworkGeometry.shares_segment)
     :return:
     """
     arcpy.AddField_management(seg_network_copy, "IsPeren", "SHORT")
-    arcpy.CalculateField_management(seg_network_copy, "IsPeren", 0, "PYTHON")
 
-    seg_network_layer = "seg_network_lyr"
-    perennial_network_layer = "perennial_network_layer"
-    arcpy.MakeFeatureLayer_management(seg_network_copy, seg_network_layer)
-    arcpy.MakeFeatureLayer_management(perennial_network, perennial_network_layer)
-
-    arcpy.SelectLayerByLocation_management(seg_network_layer, "SHARE_A_LINE_SEGMENT_WITH", perennial_network_layer, '', "NEW_SELECTION")
-
-    arcpy.CalculateField_management(seg_network_layer,"IsPeren",1,"PYTHON")
+    reach_ids, lines = read_reach_lines(seg_network_copy)
+    is_perennial = NetworkGeometry.shares_segment(lines, read_feature_parts(perennial_network), tolerance)
+    write_reach_values(seg_network_copy, ["IsPeren"], reach_ids, [is_perennial.astype(np.float64)])
 
 
 def find_dr_ar(flow_acc, in_DEM):
@@ -206,7 +217,9 @@ def build_output_folder(proj_path, out_name, seg_network, road, should_segment_n
 
 def segment_by_roads(seg_network, seg_network_copy, roads, is_verbose):
     """
-    Segments the seg_network by roads, and puts segmented network at seg_network_copy
+    Segments the seg_network by roads, and puts segmented network at seg_network_copy. Reaches are split at every point
+    a road crosses them in one pass, and each new reach keeps its reach's fields, with the reach's ReachID (or FID, if
+    it has none) in a ParentID field
     :param seg_network: Path to the seg_network that we want to segment further
     :param seg_network_copy: Path to where we want the new network to go
     :param roads: The shape file we use to segment
@@ -214,158 +227,358 @@ def segment_by_roads(seg_network, seg_network_copy, roads, is_verbose):
     """
     arcpy.AddMessage("Segmenting network by roads...")
 
-    temp_network = os.path.join(os.path.dirname(seg_network_copy), "temp.shp")
-    temp_layer = "temp_lyr"
-    temp_seg_network_layer = "seg_network_lyr"
+    fields = [f.name for f in arcpy.ListFields(seg_network) if not f.required and f.type != 'Geometry']
+    copied_fields = [field for field in fields if field != 'ParentID']
+    rows, lines = read_lines(seg_network, ['OID@'] + copied_fields)
+    line_index, x, y, measures = NetworkGeometry.crossing_points(lines, read_feature_parts(roads))
+    parents, new_lines = NetworkGeometry.split_lines(lines, line_index, measures)
+
+    spatial_reference = arcpy.Describe(seg_network).spatialReference
+    arcpy.CreateFeatureclass_management(os.path.dirname(seg_network_copy), os.path.basename(seg_network_copy),
+                                        "POLYLINE", seg_network, spatial_reference=spatial_reference)
+    if 'ParentID' not in fields:
+        arcpy.AddField_management(seg_network_copy, 'ParentID', 'LONG')
+    with arcpy.da.InsertCursor(seg_network_copy, ['SHAPE@'] + copied_fields + ['ParentID']) as cursor:
+        for parent, parts in zip(parents.tolist(), new_lines):
+            row = rows[parent]
+            shape = None
+            if parts:
+                shape = arcpy.Polyline(arcpy.Array([arcpy.Array([arcpy.Point(point_x, point_y)
+                                                                 for point_x, point_y in part]) for part in parts]),
+                                       spatial_reference)
+            parent_id = row[1 + copied_fields.index('ReachID')] if 'ReachID' in copied_fields else row[0]
+            cursor.insertRow([shape] + list(row[1:]) + [parent_id])
+
+    add_reach_dist(seg_network_copy, is_verbose)
+
+
+def add_reach_dist(seg_network_copy, is_verbose):
+    """
+    Gives each reach a new ReachID from its FID, and finds its ReachDist, the distance from the start of its stream to
+    its midpoint, by chaining the reaches of each StreamID end to start (see NetworkGeometry.reach_distances)
+    :param seg_network_copy: The network, with a StreamID field
+    :return:
+    """
+    if is_verbose:
+        arcpy.AddMessage("Calculating ReachDist...")
 
-    arcpy.FeatureToLine_management([seg_network, roads], temp_network)
+    fields = [f.name for f in arcpy.ListFields(seg_network_copy)]
+    if 'ReachID' not in fields:
+        arcpy.AddField_management(seg_network_copy, 'ReachID', 'LONG')
+    with arcpy.da.UpdateCursor(seg_network_copy, ['FID', 'ReachID']) as cursor:
+        for row in cursor:
+            row[1] = row[0]
+            cursor.updateRow(row)
 
-    arcpy.MakeFeatureLayer_management(temp_network, temp_layer)
-    arcpy.MakeFeatureLayer_management(seg_network, temp_seg_network_layer)
+    reach_ids, lines = read_reach_lines(seg_network_copy)
+    with arcpy.da.SearchCursor(seg_network_copy, ['ReachID', 'StreamID']) as cursor:
+        stream_ids = dict((row[0], row[1]) for row in cursor)
+    reach_dist = NetworkGeometry.reach_distances([stream_ids[reach_id] for reach_id in reach_ids.tolist()], lines)
 
-    arcpy.SelectLayerByLocation_management(temp_layer, "WITHIN", temp_seg_network_layer)
-    arcpy.CopyFeatures_management(temp_layer, seg_network_copy)
+    arcpy.AddField_management(seg_network_copy, 'ReachDist', 'DOUBLE')
+    write_reach_values(seg_network_copy, ['ReachDist'], reach_ids, [reach_dist], "the reach has no line")
 
-    delete_with_arcpy([temp_layer, temp_seg_network_layer, temp_network])
-    add_reach_dist(seg_network, seg_network_copy, is_verbose)
 
+def find_road_crossings(network, road, out_fc):
+    """
+    Saves a point wherever a road crosses a reach, with the reach's ReachID, found from the reaches' and roads'
+    segments (see NetworkGeometry.crossing_points) rather than with Intersect_analysis
+    :param network: Lines with a ReachID field
+    :param road: Road lines
+    :param out_fc: Path of the point shapefile to make
+    :return:
+    """
+    reach_ids, lines = read_reach_lines(network)
+    line_index, x, y, measures = NetworkGeometry.crossing_points(lines, read_feature_parts(road))
+    arcpy.CreateFeatureclass_management(os.path.dirname(out_fc), os.path.basename(out_fc), "POINT",
+                                        spatial_reference=arcpy.Describe(network).spatialReference)
+    arcpy.AddField_management(out_fc, 'ReachID', 'LONG')
+    with arcpy.da.InsertCursor(out_fc, ['SHAPE@XY', 'ReachID']) as cursor:
+        for reach_id, point_x, point_y in zip(reach_ids[line_index].tolist(), x.tolist(), y.tolist()):
+            cursor.insertRow([(point_x, point_y), reach_id])
+
+
+ENDPOINT_RADIUS = 30  # meters around each end of a reach that its elevation is taken from
+ENDPOINT_STATISTIC = 'MINIMUM'
+DEM_SMOOTHING_SIZE = 3  # cells across the focal mean the dem is smoothed with before elevations are taken
+# 'CORRIDOR' finds distances to infrastructure from 5 m cells within each reach's 30 m buffer, for every kind of
+# infrastructure at once (see CorridorDistance), 'RASTER' from an EucDistance raster over the whole network for each
+# kind, and 'VECTOR' from points along each reach (see VectorDistance). 'CORRIDOR' and 'RASTER' give the same values
+DISTANCE_MODE = 'CORRIDOR'
+LANDUSE_CLASSES = ['VeryLow', 'Low', 'Moderate', 'High']  # values of the land use raster's LUI_Class field
+LANDUSE_CLASS_FIELDS = ['iPC_VLowLU', 'iPC_LowLU', 'iPC_ModLU', 'iPC_HighLU']  # percent of each buffer in each class
 
-def add_reach_dist(seg_network, seg_network_copy, is_verbose):
-    if is_verbose:
-        arcpy.AddMessage("Calculating ReachDist...")
 
-    fields = [f.name for f in arcpy.ListFields(seg_network_copy)]
-    if 'ReachID' in fields:
-        with arcpy.da.UpdateCursor(seg_network_copy, ['FID', 'ReachID']) as cursor:
-            for row in cursor:
-                row[1] = row[0]
-                cursor.updateRow(row)
+# zonal statistics within buffer function
+# dictionary join field function
+def zonalStatsWithinBuffer(buffer, ras, stat_type, out_fc, out_FC_field):
+    """
+    Finds a statistic of a raster's values within each reach's buffer and saves it to a field. Overlapping buffers
+    are handled in one pass (see ReachZonal)
+    :param buffer: Polygons with a ReachID field
+    :param ras: The raster to summarize
+    :param stat_type: One of ReachZonal.STATISTICS, or PERCENTILE_<n>
+    :param out_fc: The network to save values to
+    :param out_FC_field: The field to save values to, which should already exist
+    :return:
+    """
+    zonal_fields_within_buffer(buffer, [(out_FC_field, ras, stat_type)], out_fc)
 
-    # get distance along route (LineID) for segment midpoints
-    midpoints = arcpy.FeatureVerticesToPoints_management(seg_network_copy, 'in_memory/midpoints', "MID")
 
-    seg_network_dissolve = arcpy.Dissolve_management(seg_network, 'in_memory/seg_network_dissolve', 'StreamID', '',
-                                                     'SINGLE_PART', 'UNSPLIT_LINES')
+def zonal_fields_within_buffer(buffer, field_stats, out_fc):
+    """
+    Fills in several fields from statistics of rasters within each reach's buffer. The buffers are read once, the
+    cells in each buffer are found once for all the rasters on the same grid, and the fields are saved in one cursor
+    pass. Means weight each cell by the fraction of it inside the buffer
+    :param buffer: Polygons with a ReachID field
+    :param field_stats: List of (field name, raster, statistic) tuples. The fields should already exist
+    :param out_fc: The network to save values to
+    :return:
+    """
+    reach_ids, polygons = read_reach_polygons(buffer)
+    extent = arcpy.Describe(buffer).extent
+    groups = []  # (footprints, indexes into field_stats) for each grid, with and without coverage weights
+    for i, (field, ras, statistic) in enumerate(field_stats):
+        grid = raster_grid(ras).window(extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+        coverage = statistic.upper() in ReachZonal.WEIGHTED_STATISTICS
+        group = [members for footprints, members in groups
+                 if footprints.grid == grid and (footprints.weights is not None) == coverage]
+        if group:
+            group[0].append(i)
+        else:
+            groups.append((buffer_footprints(buffer, reach_ids, polygons, grid, coverage), [i]))
+
+    values = [None] * len(field_stats)
+    for footprints, members in groups:
+        rasters = []
+        for i in members:
+            if not any(field_stats[i][1] is ras for ras in rasters):
+                rasters.append(field_stats[i][1])
+        statistics = sorted(set(field_stats[i][2].upper() for i in members))
+        results = ReachZonal.zonal_statistics(footprints, [read_raster(ras, footprints.grid) for ras in rasters],
+                                              statistics)
+        for i in members:
+            field, ras, statistic = field_stats[i]
+            raster_index = [j for j, other in enumerate(rasters) if other is ras][0]
+            values[i] = results[raster_index][statistic.upper()]
+    write_reach_values(out_fc, [field for field, ras, statistic in field_stats], reach_ids, values,
+                       "no raster data was found within the buffer")
+
+
+def buffer_footprints(buffer, reach_ids, polygons, grid, coverage=False):
+    """
+    Finds the cells of a grid in each reach's buffer. The cells are saved in a Footprints folder next to the buffers
+    and reused while the buffers and grid stay the same. Buffers that aren't saved on disk, like in_memory ones, are
+    found every time
+    :param buffer: Polygons with a ReachID field
+    :param reach_ids: ReachIDs read from the buffers
+    :param polygons: Polygons read from the buffers
+    :param grid: ReachZonal.RasterGrid to find cells in
+    :param coverage: True to find the fraction of each cell inside the buffer as well
+    :return: ReachZonal.ReachFootprints
+    """
+    buffer_folder = os.path.dirname(str(buffer))
+    if not os.path.isdir(buffer_folder):
+        if coverage:
+            return ReachZonal.ReachFootprints.from_polygon_coverage(reach_ids, polygons, grid)
+        return ReachZonal.ReachFootprints.from_polygons(reach_ids, polygons, grid)
+    name = os.path.splitext(os.path.basename(str(buffer)))[0]
+    return ReachZonal.load_or_build_footprints(reach_ids, polygons, grid, os.path.join(buffer_folder, "Footprints"),
+                                               name, coverage)
 
-    arcpy.AddField_management(seg_network_dissolve, 'From_', 'DOUBLE')
-    arcpy.AddField_management(seg_network_dissolve, 'To_', 'DOUBLE')
-    with arcpy.da.UpdateCursor(seg_network_dissolve, ['SHAPE@Length', 'From_', 'To_']) as cursor:
-        for row in cursor:
-            row[1] = 0.0
-            row[2] = row[0]
-            cursor.updateRow(row)
 
-    arcpy.CreateRoutes_lr(seg_network_dissolve, 'StreamID', 'in_memory/flowline_route', 'TWO_FIELDS', 'From_', 'To_')
-    route_tbl = arcpy.LocateFeaturesAlongRoutes_lr(midpoints, 'in_memory/flowline_route', 'StreamID',
-                                                  1.0,
-                                                  os.path.join(os.path.dirname(seg_network_copy), 'tbl_Routes.dbf'),
-                                                  'RID POINT MEAS')
+def endpoint_values(network, ras, out_fields, radius=ENDPOINT_RADIUS, statistic=ENDPOINT_STATISTIC, smooth_size=None):
+    """
+    Finds a statistic of a raster's values within a radius of the start and end of each reach, using the cells whose
+    centers are within the radius, as a round buffer around each end point would. The raster is read a tile at a
+    time, and only tiles near reach ends are read
+    :param network: Lines with a ReachID field
+    :param ras: The raster to summarize
+    :param out_fields: The fields to save the start and end values to, which should already exist
+    :param radius: Distance from each end, in the raster's units
+    :param statistic: One of ReachZonal.STATISTICS, or PERCENTILE_<n>
+    :param smooth_size: Width in cells of a focal mean to smooth the raster with first, or None to use it as it is
+    :return: List with the ReachIDs that got no value for each field (see write_reach_values)
+    """
+    reach_ids, x, y = read_reach_endpoints(network)
+    num_reaches = len(reach_ids)
+    if num_reaches == 0:
+        return [[] for field in out_fields]
+    values = ReachZonal.tiled_point_statistic(lambda grid: read_raster(ras, grid), raster_grid(ras), x, y, radius,
+                                              statistic, smooth_size)
+    return write_reach_values(network, list(out_fields), reach_ids, [values[:num_reaches], values[num_reaches:]],
+                              "no raster data was found near the end of the reach")
 
-    dist_dict = {}
-    # add reach id distance values to dictionary
-    with arcpy.da.SearchCursor(route_tbl, ['ReachID', 'MEAS']) as cursor:
-        for row in cursor:
-            dist_dict[row[0]] = row[1]
 
-    # populate dictionary value to output field by ReachID
-    arcpy.AddField_management(seg_network_copy, 'ReachDist', 'DOUBLE')
-    with arcpy.da.UpdateCursor(seg_network_copy, ['ReachID', 'ReachDist']) as cursor:
-        for row in cursor:
-            aKey = row[0]
-            row[1] = dist_dict[aKey]
-            cursor.updateRow(row)
+def read_reach_endpoints(line_fc):
+    """
+    Reads the first and last point of every line with its ReachID
+    :param line_fc: Lines with a ReachID field
+    :return: Tuple of (array of ReachIDs, X coordinates, Y coordinates), with the start points of every line followed
+             by the end points
+    """
+    reach_ids = []
+    starts = []
+    ends = []
+    with arcpy.da.SearchCursor(line_fc, ['ReachID', 'SHAPE@']) as cursor:
+        for reach_id, shape in cursor:
+            if shape is None or shape.firstPoint is None:
+                continue
+            reach_ids.append(reach_id)
+            starts.append((shape.firstPoint.X, shape.firstPoint.Y))
+            ends.append((shape.lastPoint.X, shape.lastPoint.Y))
+    points = np.array(starts + ends, np.float64).reshape(-1, 2)
+    return np.array(reach_ids, np.int64), points[:, 0], points[:, 1]
+
+
+def vector_distance_fields(network, field_features, spacing=VectorDistance.DEFAULT_SPACING):
+    """
+    Fills in distance fields from the distance between points along each reach and the nearest of a set of features.
+    The reaches are read and sampled once for all the features, and the fields are saved in one cursor pass
+    :param network: Lines with a ReachID field
+    :param field_features: List of (field name, features, statistic) tuples. The fields should already exist
+    :param spacing: Distance between points along each reach
+    :return:
+    """
+    reach_ids, lines = read_reach_lines(network)
+    reach_index, x, y, weights = VectorDistance.sample_lines(lines, spacing)
+    values = []
+    for field, features, statistic in field_features:
+        index = VectorDistance.SegmentIndex(*VectorDistance.line_segments(read_feature_parts(features)))
+        distance = index.distance(x, y)
+        values.append(ReachZonal.summarize(distance, reach_index, len(reach_ids), [statistic.upper()],
+                                           weights)[statistic.upper()])
+    write_reach_values(network, [field for field, features, statistic in field_features], reach_ids, values,
+                       "no distance could be found from points along the reach")
+
+
+def corridor_distance_fields(buffer, network, field_features, cell_size=CorridorDistance.DEFAULT_CELL_SIZE):
+    """
+    Fills in distance fields from statistics of the distance to each set of features within each reach's buffer, as
+    EucDistance over the network's extent would give, but only finding distances for cells in the buffers. Every set of
+    features is burned into the grid once and measured from the same cells in one pass
+    :param buffer: Polygons with a ReachID field
+    :param network: The network, whose extent the distance grid covers
+    :param field_features: List of (field name, features, statistic) tuples. The fields should already exist
+    :param cell_size: Width of the distance grid's cells
+    :return:
+    """
+    extent = arcpy.Describe(network).extent
+    network_grid = ReachZonal.RasterGrid(extent.XMin, extent.YMax, cell_size,
+                                         max(int(np.ceil((extent.YMax - extent.YMin) / cell_size)), 1),
+                                         max(int(np.ceil((extent.XMax - extent.XMin) / cell_size)), 1))
+    reach_ids, polygons = read_reach_polygons(buffer)
+    buffer_extent = arcpy.Describe(buffer).extent
+    grid = network_grid.window(buffer_extent.XMin, buffer_extent.YMin, buffer_extent.XMax, buffer_extent.YMax)
+
+    feature_sets = []
+    sources = []
+    for field, features, statistic in field_features:
+        if features not in feature_sets:
+            feature_sets.append(features)
+            segments = VectorDistance.line_segments(read_feature_parts(features))
+            sources.append(CorridorDistance.burn_segments(*(segments + (network_grid,))))
+    footprints = {}
+    for field, features, statistic in field_features:
+        coverage = statistic.upper() in ReachZonal.WEIGHTED_STATISTICS
+        if coverage not in footprints:
+            footprints[coverage] = buffer_footprints(buffer, reach_ids, polygons, grid, coverage)
+    cells = CorridorDistance.corridor_cells(list(footprints.values()))
+    distances = CorridorDistance.labelled_distance(cells, grid, sources, network_grid)[0]
+
+    values = []
+    for field, features, statistic in field_features:
+        coverage = statistic.upper() in ReachZonal.WEIGHTED_STATISTICS
+        values.append(CorridorDistance.corridor_statistics(footprints[coverage], cells,
+                                                           distances[feature_sets.index(features)],
+                                                           [statistic])[statistic.upper()])
+    write_reach_values(network, [field for field, features, statistic in field_features], reach_ids, values,
+                       "no distance could be found within the buffer")
+
+
+def read_reach_lines(line_fc):
+    """
+    Reads the vertices of every line with its ReachID
+    :param line_fc: Lines with a ReachID field
+    :return: Tuple of (array of ReachIDs, list with a list of (x, y) vertex arrays for each line, one per part)
+    """
+    rows, lines = read_lines(line_fc, ['ReachID'])
+    return np.array([row[0] for row in rows], np.int64), lines
 
-    arcpy.Delete_management('in_memory')
 
+def read_reach_polygons(polygon_fc):
+    """
+    Reads the rings of every polygon with its ReachID
+    :param polygon_fc: Polygons with a ReachID field
+    :return: Tuple of (array of ReachIDs, list with a list of (x, y) vertex arrays for each polygon)
+    """
+    rows, polygons = read_lines(polygon_fc, ['ReachID'])
+    return np.array([row[0] for row in rows], np.int64), polygons
 
-# zonal statistics within buffer function
-# dictionary join field function
-def zonalStatsWithinBuffer(buffer, ras, stat_type, stat_field, out_fc, out_FC_field, scratch):
-    # get input raster stat value within each buffer
-    # note: zonal stats as table does not support overlapping polygons so we will check which
-    #       reach buffers output was produced for and which we need to run tool on again
-    stat_tbl = arcpy.sa.ZonalStatisticsAsTable(buffer, 'ReachID', ras, os.path.join(scratch, 'statTbl'), 'DATA', stat_type)
-
-    # get list of segment buffers where zonal stats tool produced output
-    have_stat_list = [row[0] for row in arcpy.da.SearchCursor(stat_tbl, 'ReachID')]
-    # create dictionary to hold all reach buffer min dem z values
-    stat_dict = {}
-    # add buffer raster stat values to dictionary
-    with arcpy.da.SearchCursor(stat_tbl, ['ReachID', stat_field]) as cursor:
-        for row in cursor:
-            stat_dict[row[0]] = row[1]
-    # create list of overlapping buffer reaches (i.e., where zonal stats tool did not produce output)
-    need_stat_list = []
-    with arcpy.da.SearchCursor(buffer, ['ReachID']) as cursor:
-        for row in cursor:
-            if row[0] not in have_stat_list:
-                need_stat_list.append(row[0])
-    # run zonal stats until we have output for each overlapping buffer segment
-    stat = None
-    tmp_buff_lyr = None
-    num_broken_repetitions = 0
-    BROKEN_REPS_ALLOWED = 5
-    while len(need_stat_list) > 0:
-        # create tuple of segment ids where still need raster values
-        need_stat = ()
-        for reach in need_stat_list:
-            if reach not in need_stat:
-                need_stat += (reach,)
-        # use the segment id tuple to create selection query and run zonal stats tool
-        if len(need_stat) == 1:
-            quer = '"ReachID" = ' + str(need_stat[0])
-        else:
-            quer = '"ReachID" IN ' + str(need_stat)
-        tmp_buff_lyr = arcpy.MakeFeatureLayer_management(buffer, 'tmp_buff_lyr')
-        arcpy.SelectLayerByAttribute_management(tmp_buff_lyr, 'NEW_SELECTION', quer)
-        stat = arcpy.sa.ZonalStatisticsAsTable(tmp_buff_lyr, 'ReachID', ras, os.path.join(scratch, 'stat'), 'DATA', stat_type)
-        # add segment stat values from zonal stats table to main dictionary
-        with arcpy.da.SearchCursor(stat, ['ReachID', stat_field]) as cursor:
-            for row in cursor:
-                stat_dict[row[0]] = row[1]
-        # create list of reaches that were run and remove from 'need to run' list
-        have_stat_list2 = [row[0] for row in arcpy.da.SearchCursor(stat, 'ReachID')]
-
-        if len(have_stat_list2) == 0:
-            num_broken_repetitions += 1
-            if num_broken_repetitions >= BROKEN_REPS_ALLOWED:
-                warning_message = "While calculating " + out_FC_field + ", the tool ran into an error. The following "
-                warning_message += "ReachIDs did not recieve correct values:\n"
-                for reach_id in need_stat_list:
-                    if reach_id == need_stat_list[-1]:
-                        warning_message += "and "
-                    warning_message += str(reach_id)
-                    if reach_id != need_stat_list[-1]:
-                        warning_message += ", "
-                warning_message += "\n"
-                arcpy.AddWarning(warning_message)
-                for reach_id in need_stat_list:
-                    stat_dict[reach_id] = 0
-                need_stat_list = []
-        for reach in have_stat_list2:
-            need_stat_list.remove(reach)
-
-    # populate dictionary value to output field by ReachID
-    with arcpy.da.UpdateCursor(out_fc, ['ReachID', out_FC_field]) as cursor:
+
+def raster_grid(ras):
+    """
+    :param ras: A raster, or the path to one
+    :return: ReachZonal.RasterGrid of the raster's cells
+    """
+    raster = ras if isinstance(ras, arcpy.Raster) else arcpy.Raster(ras)
+    return ReachZonal.RasterGrid(raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth, raster.height,
+                                 raster.width)
+
+
+def read_raster(ras, grid):
+    """
+    Reads the part of a raster covered by a grid
+    :param ras: A raster, or the path to one
+    :param grid: ReachZonal.RasterGrid lined up with the raster's cells
+    :return: 2d float array, with NaN for NoData
+    """
+    raster = ras if isinstance(ras, arcpy.Raster) else arcpy.Raster(ras)
+    lower_left = arcpy.Point(grid.left, grid.bottom)
+    if raster.noDataValue is None:
+        return arcpy.RasterToNumPyArray(raster, lower_left, grid.num_cols, grid.num_rows).astype(np.float64)
+    values = arcpy.RasterToNumPyArray(raster, lower_left, grid.num_cols, grid.num_rows, raster.noDataValue)
+    no_data = values == raster.noDataValue
+    values = values.astype(np.float64)
+    values[no_data] = np.nan
+    return values
+
+
+def write_reach_values(out_fc, out_fields, reach_ids, values, reason="no value could be found"):
+    """
+    Saves a value for each reach to each field in one cursor pass, and warns about reaches that didn't get one. Those
+    reaches' fields are left empty, which a shapefile stores as 0
+    :param out_fc: The network to save values to
+    :param out_fields: The fields to save values to, which should already exist
+    :param reach_ids: ReachID of each value
+    :param values: Array of values for each field, with NaN for reaches that have no value
+    :param reason: Why reaches have no value, to tell the user in the warning
+    :return: List with the ReachIDs that got no value for each field
+    """
+    value_dict = dict(zip(np.asarray(reach_ids).tolist(),
+                          np.column_stack([np.asarray(v, np.float64) for v in values]).tolist()))
+    missing = [[] for field in out_fields]
+    with arcpy.da.UpdateCursor(out_fc, ['ReachID'] + out_fields) as cursor:
         for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = stat_dict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    stat_dict.clear()
+            reach_values = value_dict.get(row[0])
+            for i in range(len(out_fields)):
+                if reach_values is None or np.isnan(reach_values[i]):
+                    missing[i].append(row[0])
+                else:
+                    row[i + 1] = reach_values[i]
+            cursor.updateRow(row)
+    for field, field_missing in zip(out_fields, missing):
+        if field_missing:
+            arcpy.AddWarning("While calculating " + field + ", " + reason + " for the following ReachIDs, so they "
+                             "weren't given values. A shapefile stores their " + field + " as 0, so check them "
+                             "before running the FIS tools:\n" + ", ".join(str(i) for i in field_missing))
+    return missing
 
-    # delete temp fcs, tbls, etc.
-    #items = [statTbl, haveStatList, haveStatList2, needStatList, stat, tmp_buff_lyr, needStat]
-    items = [stat_tbl, stat, tmp_buff_lyr]
-    for item in items:
-        if item is not None:
-            arcpy.Delete_management(item)
 
 # geo attributes function
 # calculates min and max elevation, length, slope, and drainage area for each flowline segment
-def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose):
+def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose,
+                    endpoint_radius=ENDPOINT_RADIUS, endpoint_statistic=ENDPOINT_STATISTIC):
     # if fields already exist, delete them
     fields = [f.name for f in arcpy.ListFields(out_network)]
     drop = ["iGeo_ElMax", "iGeo_ElMin", "iGeo_Len", "iGeo_Slope", "iGeo_DA"]
@@ -380,60 +593,59 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
             for row in cursor:
                 row[1] = row[0]
                 cursor.updateRow(row)
-    if is_verbose:
-        arcpy.AddMessage("Preprocessing DEM...")
-    #  --smooth input dem by 3x3 cell window--
     #  define raster environment settings
     desc = arcpy.Describe(in_DEM)
     arcpy.env.extent = desc.Extent
     arcpy.env.outputCoordinateSystem = desc.SpatialReference
     arcpy.env.cellSize = desc.meanCellWidth
-    # calculate mean z over 3x3 cell window
-    neighborhood = NbrRectangle(3, 3, "CELL")
-    tmp_dem = FocalStatistics(in_DEM, neighborhood, 'MEAN')
-    # clip smoothed dem to input dem
-    DEM = ExtractByMask(tmp_dem, in_DEM)
-
-    # function to attribute start/end elevation (dem z) to each flowline segment
-    def zSeg(vertex_type, out_field):
+    # without Spatial Analyst's tools, drainage area is found from the dem file a tile at a time (see D8Flow)
+    native_flow = flow_acc is None and D8Flow.HAVE_GDAL and os.path.isfile(in_DEM)
+    if flow_acc is None and not native_flow:
+        # drainage area is calculated from the whole smoothed dem, so smooth it all by a 3x3 cell window
         if is_verbose:
-            arcpy.AddMessage("Calculating values for " + out_field + "...")
-        # create start/end points for each flowline reach segment
-        tmp_pts = os.path.join(scratch, 'tmp_pts')
-        arcpy.FeatureVerticesToPoints_management(out_network, tmp_pts, vertex_type)
-        # create 30 meter buffer around each start/end point
-        tmp_buff = os.path.join(scratch, 'tmp_buff')
-        arcpy.Buffer_analysis(tmp_pts, tmp_buff, '30 Meters')
-        # get min dem z value within each buffer
-        arcpy.AddField_management(out_network, out_field, "DOUBLE")
-        zonalStatsWithinBuffer(tmp_buff, DEM, 'MINIMUM', 'MIN', out_network, out_field, scratch)
-
-        # delete temp fcs, tbls, etc.
-        items = [tmp_pts, tmp_buff]
-        for item in items:
-            arcpy.Delete_management(item)
-
-    # run zSeg function for start/end of each network segment
-    zSeg('START', 'iGeo_ElMax')
-    zSeg('END', 'iGeo_ElMin')
+            arcpy.AddMessage("Preprocessing DEM...")
+        neighborhood = NbrRectangle(3, 3, "CELL")
+        tmp_dem = FocalStatistics(in_DEM, neighborhood, 'MEAN')
+        # clip smoothed dem to input dem
+        DEM = ExtractByMask(tmp_dem, in_DEM)
+        endpoint_dem, smooth_size = DEM, None
+    else:
+        # only the dem near reach ends is needed, so smooth just the tiles around them (see FocalMean)
+        endpoint_dem, smooth_size = in_DEM, DEM_SMOOTHING_SIZE
+
+    # attribute start/end elevation (dem z) to each flowline segment, from the smoothed dem near each end
+    if is_verbose:
+        arcpy.AddMessage("Calculating values for iGeo_ElMax and iGeo_ElMin...")
+    arcpy.AddField_management(out_network, "iGeo_ElMax", "DOUBLE")
+    arcpy.AddField_management(out_network, "iGeo_ElMin", "DOUBLE")
+    missing_elevations = endpoint_values(out_network, endpoint_dem, ["iGeo_ElMax", "iGeo_ElMin"], endpoint_radius,
+                                         endpoint_statistic, smooth_size)
+    no_elevation = set(missing_elevations[0]) | set(missing_elevations[1])
 
     # calculate network reach slope
     arcpy.AddField_management(out_network, "iGeo_Len", "DOUBLE")
     arcpy.CalculateField_management(out_network, "iGeo_Len", '!shape.length@meters!', "PYTHON_9.3")
     arcpy.AddField_management(out_network, "iGeo_Slope", "DOUBLE")
-    with arcpy.da.UpdateCursor(out_network, ["iGeo_ElMax", "iGeo_ElMin", "iGeo_Len", "iGeo_Slope"]) as cursor:
+    slope_fields = ["iGeo_ElMax", "iGeo_ElMin", "iGeo_Len", "iGeo_Slope", "ReachID"]
+    with arcpy.da.UpdateCursor(out_network, slope_fields) as cursor:
         if is_verbose:
             arcpy.AddMessage("Calculating iGeo_Slope...")
         for row in cursor:
+            if row[4] in no_elevation:
+                continue  # a missing elevation reads as 0, which would give a made up slope
             row[3] = (abs(row[0] - row[1]))/row[2]
             if row[3] == 0.0:
                 row[3] = 0.0001
             cursor.updateRow(row)
+    if no_elevation:
+        arcpy.AddWarning("iGeo_Slope wasn't calculated for the following ReachIDs, because they have no elevation at "
+                         "one or both ends. A shapefile stores their iGeo_Slope as 0:\n" +
+                         ", ".join(str(i) for i in sorted(no_elevation)))
 
     # get DA values
     if flow_acc is None:
         arcpy.AddMessage("Calculating drainage area...")
-        calc_drain_area(DEM, in_DEM)
+        calc_drain_area(None if native_flow else DEM, in_DEM)
     elif not os.path.exists(os.path.dirname(in_DEM) + "/Flow"): # if there's no folder for the flow accumulation, make one
         os.mkdir(os.path.dirname(in_DEM) + "/Flow")
         if is_verbose:
@@ -448,7 +660,7 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     # get max drainage area within 100 m midpoint buffer
     if is_verbose:
         arcpy.AddMessage("Calculating iGeo_DA...")
-    zonalStatsWithinBuffer(midpoint_buffer, DrArea, "MAXIMUM", 'MAX', out_network, "iGeo_DA", scratch)
+    zonalStatsWithinBuffer(midpoint_buffer, DrArea, "MAXIMUM", out_network, "iGeo_DA")
 
     # replace '0' drainage area values with tiny value
     with arcpy.da.UpdateCursor(out_network, ["iGeo_DA"]) as cursor:
@@ -471,57 +683,33 @@ def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scrat
         if field in drop:
             arcpy.DeleteField_management(out_network, field)
 
-    # --existing vegetation values--
     if is_verbose:
-        arcpy.AddMessage("Creating current veg lookup raster...")
+        arcpy.AddMessage("Creating current and historic veg lookup rasters...")
     veg_lookup = Lookup(coded_veg, "VEG_CODE")
-    # add mean veg value 'iVeg100EX' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg100EX", "DOUBLE")
-    # get mean existing veg value within 100 m buffer
-    if is_verbose:
-        arcpy.AddMessage("Calculating iVeg100EX...")
-    zonalStatsWithinBuffer(buf_100m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg100EX", scratch)
-
-    # add mean veg value 'iVeg_VT30EX' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg_30EX", "DOUBLE")
-    # get mean existing veg value within 30 m buffer
-    if is_verbose:
-        arcpy.AddMessage("Calculating iVeg_30EX...")
-    zonalStatsWithinBuffer(buf_30m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30EX", scratch)
-
-    # delete temp fcs, tbls, etc.
-    items = [veg_lookup]
-    for item in items:
-        arcpy.Delete_management(item)
-
-    # --historic (i.e., potential) vegetation values--
-    if is_verbose:
-        arcpy.AddMessage("Creating historic veg lookup raster...")
     hist_veg_lookup = Lookup(coded_hist, "VEG_CODE")
+    for field in ["iVeg100EX", "iVeg_30EX", "iVeg100Hpe", "iVeg_30Hpe"]:
+        arcpy.AddField_management(out_network, field, "DOUBLE")
 
-    # add mean veg value 'iVeg100Hpe' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg100Hpe", "DOUBLE")
-    # get mean potential veg value within 100 m buffer
+    # get mean existing and potential veg values within the 100 m and 30 m buffers, finding each buffer's cells once
     if is_verbose:
-        arcpy.AddMessage("Calculating iVeg100Hpe...")
-    zonalStatsWithinBuffer(buf_100m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg100Hpe", scratch)
-
-    # add mean veg value 'iVeg_30Hpe' field to flowline network
-    arcpy.AddField_management(out_network, "iVeg_30Hpe", "DOUBLE")
-    # get mean potential veg value within 30 m buffer
+        arcpy.AddMessage("Calculating iVeg100EX and iVeg100Hpe...")
+    zonal_fields_within_buffer(buf_100m, [("iVeg100EX", veg_lookup, 'MEAN'), ("iVeg100Hpe", hist_veg_lookup, 'MEAN')],
+                               out_network)
     if is_verbose:
-        arcpy.AddMessage("Calculating iVeg_30Hpe...")
-    zonalStatsWithinBuffer(buf_30m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30Hpe", scratch)
+        arcpy.AddMessage("Calculating iVeg_30EX and iVeg_30Hpe...")
+    zonal_fields_within_buffer(buf_30m, [("iVeg_30EX", veg_lookup, 'MEAN'), ("iVeg_30Hpe", hist_veg_lookup, 'MEAN')],
+                               out_network)
 
     # delete temp fcs, tbls, etc.
-    items = [hist_veg_lookup]
+    items = [veg_lookup, hist_veg_lookup]
     for item in items:
         arcpy.Delete_management(item)
 
 
 # conflict potential function
 # calculates distances from road intersections, adjacent roads, railroads and canals for each flowline segment
-def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, projPath, is_verbose):
+def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, projPath, is_verbose,
+                   distance_mode=DISTANCE_MODE):
     # create temp directory
     if is_verbose:
         arcpy.AddMessage("Deleting and remaking temp dir...")
@@ -539,22 +727,39 @@ def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, b
             arcpy.DeleteField_management(out_network, field)
 
     # calculate mean distance from road-stream crossings ('iPC_RoadX'), roads ('iPC_Road') and roads clipped to the valley bottom ('iPC_RoadVB')
+    distance_fields = []
     if road is not None:
         road_crossings = temp_dir + "\\roadx.shp"
         # create points at road-stream intersections
-        arcpy.Intersect_analysis([out_network, road], road_crossings, "", "", "POINT")
-        find_distance_from_feature(out_network, road_crossings, valley_bottom, temp_dir, buf_30m, "roadx", "iPC_RoadX", scratch, is_verbose, clip_feature = False)
+        find_road_crossings(out_network, road, road_crossings)
+        distance_fields.append(find_distance_from_feature(out_network, road_crossings, valley_bottom, temp_dir, buf_30m, "roadx", "iPC_RoadX", scratch, is_verbose, clip_feature = False, distance_mode = distance_mode))
 
     if road is not None:
-        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "roadvb", "iPC_RoadVB", scratch, is_verbose, clip_feature = True)
-        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "road", "iPC_Road", scratch, is_verbose, clip_feature = False)
+        distance_fields.append(find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "roadvb", "iPC_RoadVB", scratch, is_verbose, clip_feature = True, distance_mode = distance_mode))
+        distance_fields.append(find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "road", "iPC_Road", scratch, is_verbose, clip_feature = False, distance_mode = distance_mode))
 
     if railroad is not None:
-        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroadvb", "iPC_RailVB", scratch, is_verbose, clip_feature = True)
-        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroad", "iPC_Rail", scratch, is_verbose, clip_feature = False)
+        distance_fields.append(find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroadvb", "iPC_RailVB", scratch, is_verbose, clip_feature = True, distance_mode = distance_mode))
+        distance_fields.append(find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroad", "iPC_Rail", scratch, is_verbose, clip_feature = False, distance_mode = distance_mode))
 
     if canal is not None:
-        find_distance_from_feature(out_network, canal, valley_bottom, temp_dir, buf_30m, "canal", "iPC_Canal", scratch, is_verbose, clip_feature=False)
+        distance_fields.append(find_distance_from_feature(out_network, canal, valley_bottom, temp_dir, buf_30m, "canal", "iPC_Canal", scratch, is_verbose, clip_feature=False, distance_mode = distance_mode))
+
+    # get the distances for every feature at once, sampling the reaches or finding the buffers' cells once
+    distance_fields = [field_stat for field_stat in distance_fields if field_stat is not None]
+    if distance_fields:
+        if distance_mode == 'VECTOR':
+            if is_verbose:
+                arcpy.AddMessage("Calculating distances along reaches...")
+            vector_distance_fields(out_network, distance_fields)
+        elif distance_mode == 'CORRIDOR':
+            if is_verbose:
+                arcpy.AddMessage("Calculating distances within buffers...")
+            corridor_distance_fields(buf_30m, out_network, distance_fields)
+        else:
+            if is_verbose:
+                arcpy.AddMessage("Calculating distances within buffers...")
+            zonal_fields_within_buffer(buf_30m, distance_fields, out_network)
 
     # calculate mean landuse value ('iPC_LU')
     if landuse is not None:
@@ -587,7 +792,7 @@ def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose):
     # create raster with just landuse code values
     lu_ras = Lookup(landuse, "LU_CODE")
     # calculate mean landuse value within 100 m buffer of each network segment
-    zonalStatsWithinBuffer(buf_100m, lu_ras, 'MEAN', 'MEAN', out_network, "iPC_LU", scratch)
+    zonalStatsWithinBuffer(buf_100m, lu_ras, 'MEAN', out_network, "iPC_LU")
     # get percentage of each land use class in 100 m buffer of stream segment
     fields = [f.name.upper() for f in arcpy.ListFields(landuse)]
 
@@ -596,80 +801,55 @@ def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose):
                          " with no typos if you wish to use the data from the land use raster")
         return
 
-    buf_fields = [f.name for f in arcpy.ListFields(buf_100m)]
-    if 'oArea' not in buf_fields:
-        arcpy.AddField_management(buf_100m, 'oArea', 'DOUBLE')
-        with arcpy.da.UpdateCursor(buf_100m, ['SHAPE@AREA', 'oArea']) as cursor:
-            for row in cursor:
-                row[1] = row[0]
-                cursor.updateRow(row)
-    landuse_poly = arcpy.RasterToPolygon_conversion(landuse, os.path.join(scratch, 'landuse_poly'), 'NO_SIMPLIFY', "LUI_Class")
-    landuse_int = arcpy.Intersect_analysis([landuse_poly, buf_100m], os.path.join(scratch, 'landuse_int'))
-    arcpy.AddField_management(landuse_int, 'propArea', 'DOUBLE')
-    with arcpy.da.UpdateCursor(landuse_int, ['SHAPE@AREA', 'oArea', 'propArea']) as cursor:
-        for row in cursor:
-            row[2] = row[0]/row[1]
-            cursor.updateRow(row)
-    area_tbl = arcpy.Statistics_analysis(landuse_int, os.path.join(scratch, 'areaTbl'), [['propArea', 'SUM']], ['ReachID', 'LUI_CLASS'])
-    area_piv_tbl = arcpy.PivotTable_management(area_tbl, ['ReachID'], 'LUI_CLASS', 'SUM_propArea', os.path.join(scratch, 'areaPivTbl'))
-
-    sanitize_area_piv_tbl(area_piv_tbl)
-    # create empty dictionary to hold input table field values
-    tbl_dict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(area_piv_tbl, ['ReachID', 'VeryLow', 'Low', 'Moderate', 'High']) as cursor:
-        for row in cursor:
-            tbl_dict[row[0]] = [row[1], row[2], row[3], row[4]]
-
     # populate flowline network out fields
-    arcpy.AddField_management(out_network, "iPC_VLowLU", 'DOUBLE')
-    arcpy.AddField_management(out_network, "iPC_LowLU", 'DOUBLE')
-    arcpy.AddField_management(out_network, "iPC_ModLU", 'DOUBLE')
-    arcpy.AddField_management(out_network, "iPC_HighLU", 'DOUBLE')
-
-    with arcpy.da.UpdateCursor(out_network, ['ReachID', 'iPC_VLowLU', 'iPC_LowLU', 'iPC_ModLU', 'iPC_HighLU']) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = round(100*tbl_dict[aKey][0], 2)
-                row[2] = round(100*tbl_dict[aKey][1], 2)
-                row[3] = round(100*tbl_dict[aKey][2], 2)
-                row[4] = round(100*tbl_dict[aKey][3], 2)
-                cursor.updateRow(row)
-            except:
-                pass
-    tbl_dict.clear()
+    for field in LANDUSE_CLASS_FIELDS:
+        arcpy.AddField_management(out_network, field, 'DOUBLE')
+    landuse_class_fields(landuse, buf_100m, out_network)
 
     arcpy.Delete_management(lu_ras)
 
 
-def sanitize_area_piv_tbl(area_piv_tbl):
+def landuse_class_fields(landuse, buffer, out_fc):
     """
-    Makes sure that the areaPivTbl has all the fields we need. If it doesn't, we'll add it.
-    :param area_piv_tbl:
+    Fills in the percent of each reach's buffer in each land use intensity class (LANDUSE_CLASSES), counting the land
+    use raster's cells in each buffer by class. Each cell counts by the fraction of it inside the buffer, so the areas
+    are the same as intersecting the raster's cells as polygons with the buffers. Reaches whose buffer has no land use
+    data are left empty
+    :param landuse: Land use raster with a LUI_Class field
+    :param buffer: Polygons with a ReachID field
+    :param out_fc: The network to save values to, with the LANDUSE_CLASS_FIELDS fields
     :return:
     """
-    fields = [f.name for f in arcpy.ListFields(area_piv_tbl)]
-    check_and_add_zero_fields(area_piv_tbl, fields, 'VeryLow')
-    check_and_add_zero_fields(area_piv_tbl, fields, 'Low')
-    check_and_add_zero_fields(area_piv_tbl, fields, 'Moderate')
-    check_and_add_zero_fields(area_piv_tbl, fields, 'High')
-
-
-def check_and_add_zero_fields(table, fields, field_name):
+    class_of_value = {}
+    with arcpy.da.SearchCursor(landuse, ['VALUE', 'LUI_Class']) as cursor:
+        for value, lui_class in cursor:
+            if lui_class in LANDUSE_CLASSES:
+                class_of_value[value] = LANDUSE_CLASSES.index(lui_class)
+
+    reach_ids, polygons = read_reach_polygons(buffer)
+    extent = arcpy.Describe(buffer).extent
+    grid = raster_grid(landuse).window(extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+    footprints = buffer_footprints(buffer, reach_ids, polygons, grid, coverage=True)
+    values = read_raster(landuse, grid)
+    # cells with data in none of the classes are counted in an extra class, so reaches with data can be told apart
+    classes = np.where(np.isnan(values), -1, len(LANDUSE_CLASSES))
+    for value, class_index in class_of_value.items():
+        classes[values == value] = class_index
+    areas = ReachZonal.class_histograms(footprints, classes, len(LANDUSE_CLASSES) + 1) * grid.cell_size ** 2
+    percents = np.round(100 * areas[:, :-1] / ReachZonal.polygon_areas(polygons)[:, None], 2)
+    percents[areas.sum(axis=1) == 0] = np.nan
+    write_reach_values(out_fc, LANDUSE_CLASS_FIELDS, reach_ids, list(percents.T),
+                       "no land use data was found within the buffer")
+
+
+def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, buf, temp_name, new_field_name, scratch, is_verbose, clip_feature = False,
+                               distance_mode = DISTANCE_MODE):
     """
-    Checks that a field is in the table. If it isn't, we add it and populate it with zeros
-    :param table: The table that we want to check
-    :param fields: All the fields in the table (more efficient if doing multiple checks)
-    :param field_name: The name of the field we want to check for
-    :return:
+    Adds a field for the distance from a feature, and finds the distance to it across the network
+    :return: A (field name, distance raster, statistic) tuple for zonal_fields_within_buffer, or with distance_mode
+             'VECTOR' or 'CORRIDOR' a (field name, features, statistic) tuple for vector_distance_fields or
+             corridor_distance_fields. None if there are no features and the field has already been set to 10000 m
     """
-    if field_name not in fields:
-        arcpy.AddField_management(table, field_name, "DOUBLE")
-        arcpy.CalculateField_management(table, field_name, 0, "PYTHON")
-
-
-def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, buf, temp_name, new_field_name, scratch, is_verbose, clip_feature = False):
     if is_verbose:
         arcpy.AddMessage("Calculating " + new_field_name + " values...")
     arcpy.AddField_management(out_network, new_field_name, "DOUBLE")
@@ -693,23 +873,35 @@ def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, bu
                 cursor.updateRow(row)
     # if there are features, calculate distance
     else:
+        # min distance from road crossings and mean distance from other features are found along or within the 30 m
+        # buffer of each network segment, once every feature has been prepared
+        statistic = 'MINIMUM' if new_field_name == 'iPC_RoadX' else 'MEAN'
+        if distance_mode in ['VECTOR', 'CORRIDOR']:
+            return new_field_name, str(feature_mts), statistic
         # set extent to the stream network
         arcpy.env.extent = out_network
         # calculate euclidean distance from input features
         ed_feature = EucDistance(feature_subset, cell_size = 5) # cell size of 5 m
-        # get min distance from feature in the within 30 m buffer of each network segment
-        if new_field_name == 'iPC_RoadX':
-            zonalStatsWithinBuffer(buf, ed_feature, 'MINIMUM', 'MIN', out_network, new_field_name, scratch)
-        else:
-            zonalStatsWithinBuffer(buf, ed_feature, 'MEAN', 'MEAN', out_network, new_field_name, scratch)
-
-        # delete temp fcs, tbls, etc.
-        items = []
-        for item in items:
-            arcpy.Delete_management(item)
+        return new_field_name, ed_feature, statistic
+    return None
 
 # calculate drainage area function
 def calc_drain_area(DEM, input_DEM):
+    """
+    Saves a drainage area raster in square kilometers as Flow/DrainArea_sqkm.tif next to the input DEM
+    :param DEM: The smoothed DEM, or None to smooth the input DEM, fill it and accumulate flow with D8Flow and GDAL
+    :param input_DEM: Path to the input DEM, in meters
+    :return:
+    """
+    if DEM is None:
+        flow_folder = os.path.dirname(input_DEM) + "/Flow"
+        if not os.path.exists(flow_folder):
+            os.mkdir(flow_folder)
+        if os.path.exists(flow_folder + "/DrainArea_sqkm.tif"):
+            arcpy.Delete_management(flow_folder + "/DrainArea_sqkm.tif")
+        D8Flow.drainage_area_file(input_DEM, flow_folder + "/DrainArea_sqkm.tif", smooth_size=DEM_SMOOTHING_SIZE,
+                                  report=arcpy.AddMessage)
+        return
 
     #  define raster environment settings
     desc = arcpy.Describe(DEM)
@@ -1016,6 +1208,20 @@ def parse_input_bool(given_input):
         return True
 
 
+def parse_distance_mode(given_input):
+    """
+    Turns the distance method given by the toolbox into one of the distance modes we use internally
+    :param given_input: The distance method given to the tool, or None to use DISTANCE_MODE
+    :return: String
+    """
+    if given_input is None:
+        return DISTANCE_MODE
+    for distance_mode in ['CORRIDOR', 'RASTER', 'VECTOR']:
+        if given_input.upper().startswith(distance_mode):
+            return distance_mode
+    raise Exception("Unknown distance method: " + str(given_input))
+
+
 def delete_with_arcpy(stuffToDelete):
     """
     Deletes everything in a list with arcpy.Delete_management()
@@ -0,0 +1,438 @@
+# -------------------------------------------------------------------------------
+# Name:        Batch FIS
+# Purpose:     Evaluates the BRAT Mamdani fuzzy inference systems for every reach at once with NumPy array operations,
+#              instead of pushing each reach through skfuzzy's ControlSystemSimulation one at a time
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# The batch evaluator follows the same inference steps as skfuzzy.control:
+#   membership  - input values are clamped to the sampled universe of each antecedent, then each term's trimf/trapmf
+#                 is evaluated directly (this is the same value skfuzzy gets by interpolating the sampled MF, because
+#                 every BRAT breakpoint falls on a universe sample)
+#   firing      - rule antecedents are AND-ed with min, and a negated term (~) uses 1 - membership. By default only
+#                 the rules that can be nonzero for a reach are fired (see MamdaniSystem.sparse_activations)
+#   aggregation - each output term is clipped (min) at the max firing strength of the rules that point to it, and the
+#                 clipped terms are combined with max
+#   defuzz      - centroid of the aggregated output MF. Every output term is a trapezoid (a triangle is a trapezoid
+#                 with b == c), so the aggregate is piecewise linear between a small set of breakpoints: the term
+#                 corners, the crossings of the sloped term edges, and the points where each edge reaches each
+#                 activation level. The centroid is integrated exactly over those pieces, without sampling the
+#                 output universe. When Numba is installed this step runs as a compiled loop (see FastKernels)
+#
+# Universes are only used for their bounds (inputs are clamped to the last universe sample, and the aggregate is cut
+# off there, as in skfuzzy), so no universe arrays are built when a system is evaluated.
+#
+# Tolerance: skfuzzy (0.3+) samples the aggregate on the output universe plus the clip points, so it cuts the corners
+# where two clipped terms cross between samples. The exact centroid differs from it by less than 0.005 dams/km, well
+# below the precision the capacity categories are reported at.
+
+import hashlib
+import numpy as np
+import FastKernels
+
+
+BATCH_TOLERANCE = 0.005  # maximum expected absolute difference (dams/km) from the skfuzzy result
+DEFAULT_CHUNK_SIZE = 2000  # number of reaches defuzzified together
+RULE_CHUNK_SIZE = 50000  # number of reaches whose rule activations are found together
+GAUSS_POINTS = (0.5 - 0.5 / np.sqrt(3.0), 0.5 + 0.5 / np.sqrt(3.0))  # two point Gauss-Legendre nodes on [0, 1]
+
+
+def trimf(x, abc):
+    """
+    Triangular membership function, matching skfuzzy.trimf but for an array of any shape
+    :param x: Array of values
+    :param abc: The three corners of the triangle (a <= b <= c)
+    :return: Array of memberships the same shape as x
+    """
+    a, b, c = [float(v) for v in abc]
+    return trapmf(x, [a, b, b, c])
+
+
+def trapmf(x, abcd):
+    """
+    Trapezoidal membership function, matching skfuzzy.trapmf but for an array of any shape
+    :param x: Array of values
+    :param abcd: The four corners of the trapezoid (a <= b <= c <= d)
+    :return: Array of memberships the same shape as x
+    """
+    a, b, c, d = [float(v) for v in abcd]
+    x = np.asarray(x, dtype=np.float64)
+    y = np.zeros(x.shape)
+
+    y[(x >= b) & (x <= c)] = 1.0
+    if a != b:
+        rising = (x > a) & (x < b)
+        y[rising] = (x[rising] - a) / (b - a)
+    if c != d:
+        falling = (x > c) & (x < d)
+        y[falling] = (d - x[falling]) / (d - c)
+    return y
+
+
+MEMBERSHIP_FUNCTIONS = {'trimf': trimf, 'trapmf': trapmf}
+
+
+class FuzzyVariable(object):
+    """
+    A fuzzy input or output variable: a sampled universe and a set of named terms
+    """
+    def __init__(self, name, universe, terms):
+        """
+        :param name: The name of the variable
+        :param universe: The sampled universe, given as (start, stop, step) like np.arange
+        :param terms: List of (term name, membership function name, parameters) tuples
+        """
+        self.name = name
+        self.universe_def = tuple(universe)
+        start, stop, step = [float(v) for v in universe]
+        # the first and last universe samples, the same values np.arange(*universe) would give
+        self.lower = start
+        self.upper = start + (int(np.ceil((stop - start) / step)) - 1) * step
+        self.term_names = [term[0] for term in terms]
+        self.mf_types = [term[1] for term in terms]
+        self.mf_params = [[float(p) for p in term[2]] for term in terms]
+
+    @property
+    def universe(self):
+        """
+        The sampled universe. Only needed to compare against sampled (skfuzzy style) evaluation
+        """
+        return np.arange(*self.universe_def)
+
+    def term_index(self, term_name):
+        return self.term_names.index(term_name)
+
+    def trapezoids(self):
+        """
+        Returns each term as trapezoid corners, with triangles given as trapezoids with a flat top of zero width
+        :return: Array of shape (number of terms, 4)
+        """
+        corners = np.empty((len(self.term_names), 4))
+        for i, params in enumerate(self.mf_params):
+            if self.mf_types[i] == 'trimf':
+                corners[i] = [params[0], params[1], params[1], params[2]]
+            else:
+                corners[i] = params
+        return corners
+
+    def clamp(self, values):
+        """
+        Clamps values to the sampled universe, the same way skfuzzy interpolation does
+        :param values: Array of input values
+        :return: Array of clamped values
+        """
+        return np.clip(values, self.lower, self.upper)
+
+    def memberships(self, values):
+        """
+        Returns the membership of each value in each term
+        :param values: 1d array of input values
+        :return: Array of shape (len(values), number of terms)
+        """
+        values = self.clamp(np.asarray(values, dtype=np.float64))
+        out = np.empty((len(values), len(self.term_names)))
+        for i in range(len(self.term_names)):
+            out[:, i] = MEMBERSHIP_FUNCTIONS[self.mf_types[i]](values, self.mf_params[i])
+        return out
+
+
+class MamdaniSystem(object):
+    """
+    A Mamdani fuzzy inference system with its rules stored as index arrays, so that firing strengths for every reach
+    can be found with a handful of array operations
+    """
+    def __init__(self, inputs, output, rules):
+        """
+        :param inputs: List of FuzzyVariable objects, in the order input values will be given
+        :param output: The output FuzzyVariable
+        :param rules: List of (antecedent, consequent) pairs. The antecedent is a list of (input name, term name,
+                      is negated) tuples that are AND-ed together, and the consequent is an output term name
+        """
+        self.inputs = inputs
+        self.output = output
+        self.rules = rules
+
+        input_names = [var.name for var in inputs]
+        # rule_terms[r, i] is the term of input i used by rule r, or -1 if rule r doesn't use input i
+        self.rule_terms = np.full((len(rules), len(inputs)), -1, dtype=np.int64)
+        self.rule_negated = np.zeros((len(rules), len(inputs)), dtype=bool)
+        self.rule_outputs = np.zeros(len(rules), dtype=np.int64)
+        for r, (antecedent, consequent) in enumerate(rules):
+            for input_name, term_name, is_negated in antecedent:
+                i = input_names.index(input_name)
+                self.rule_terms[r, i] = inputs[i].term_index(term_name)
+                self.rule_negated[r, i] = is_negated
+            self.rule_outputs[r] = output.term_index(consequent)
+
+        self.output_corners = output.trapezoids()
+        self.output_edges, self.output_breakpoints = output_geometry(self.output_corners, output.lower, output.upper)
+
+    def fingerprint(self):
+        """
+        Returns a string that changes whenever the universes, membership functions or rules of the system change
+        :return: String
+        """
+        variables = [(var.name, var.universe_def, var.term_names, var.mf_types, var.mf_params)
+                     for var in self.inputs + [self.output]]
+        return hashlib.md5(repr((variables, self.rules)).encode('utf-8')).hexdigest()
+
+    def input_memberships(self, input_arrays):
+        """
+        Finds the membership of every reach in every term of every input
+        :param input_arrays: List of 1d arrays, one per input
+        :return: List of arrays of shape (number of reaches, number of terms)
+        """
+        return [var.memberships(values) for var, values in zip(self.inputs, input_arrays)]
+
+    def firing_strengths(self, memberships):
+        """
+        Finds the firing strength of every rule for every reach
+        :param memberships: Output of input_memberships()
+        :return: Array of shape (number of reaches, number of rules)
+        """
+        num_reaches = memberships[0].shape[0]
+        firing = np.ones((num_reaches, len(self.rules)))
+        for i in range(len(self.inputs)):
+            used = self.rule_terms[:, i] >= 0
+            term_mu = memberships[i][:, self.rule_terms[used, i]]
+            negated = self.rule_negated[used, i]
+            term_mu[:, negated] = 1.0 - term_mu[:, negated]
+            firing[:, used] = np.minimum(firing[:, used], term_mu)
+        return firing
+
+    def activations(self, firing):
+        """
+        Accumulates rule firing strengths onto the output terms with max
+        :param firing: Output of firing_strengths()
+        :return: Array of shape (number of reaches, number of output terms)
+        """
+        activation = np.zeros((firing.shape[0], len(self.output.term_names)))
+        for t in range(len(self.output.term_names)):
+            term_rules = self.rule_outputs == t
+            if np.any(term_rules):
+                activation[:, t] = firing[:, term_rules].max(axis=1)
+        return activation
+
+    def aggregate(self, x, activation):
+        """
+        Clips each output term at its activation and aggregates with max
+        :param x: Array of shape (number of reaches, number of points) of output values
+        :param activation: Output of activations()
+        :return: Array of aggregated memberships, the same shape as x
+        """
+        aggregated = np.zeros(x.shape)
+        for t in range(len(self.output.term_names)):
+            np.maximum(aggregated, np.minimum(activation[:, t:t + 1], trapmf(x, self.output_corners[t])), aggregated)
+        return aggregated
+
+    def defuzzify(self, activation):
+        """
+        Clips each output term at its activation, aggregates with max and returns the exact centroid of the result
+        :param activation: Output of activations()
+        :return: 1d array of crisp outputs. Reaches where no rule fires get 0
+        """
+        slopes, intercepts = self.output_edges
+        if FastKernels.USE_NUMBA:
+            return FastKernels.centroid(activation, self.output_corners, slopes, intercepts, self.output_breakpoints,
+                                        self.output.lower, self.output.upper, GAUSS_POINTS)
+
+        num_reaches = activation.shape[0]
+        # x where each sloped edge reaches each activation level, shape (reaches, activations * edges)
+        crossings = (activation[:, :, np.newaxis] - intercepts) / slopes
+        crossings = np.clip(crossings.reshape(num_reaches, -1), self.output.lower, self.output.upper)
+        x = np.sort(np.hstack((np.tile(self.output_breakpoints, (num_reaches, 1)), crossings)), axis=1)
+
+        # the aggregate is linear between neighbouring breakpoints, so two point Gauss-Legendre quadrature gives the
+        # exact area and moment of each piece. The quadrature points are inside each piece, so vertical term edges
+        # (e.g. the left edge of 'none') don't need special handling
+        x1 = x[:, :-1]
+        width = x[:, 1:] - x1
+        area = np.zeros(num_reaches)
+        moment = np.zeros(num_reaches)
+        for offset in GAUSS_POINTS:
+            xq = x1 + offset * width
+            yq = self.aggregate(xq, activation) * width / 2.0
+            area += yq.sum(axis=1)
+            moment += (xq * yq).sum(axis=1)
+
+        out = np.zeros(num_reaches)
+        has_area = area > 0
+        out[has_area] = moment[has_area] / area[has_area]
+        return out
+
+    def defuzzify_sampled(self, activation):
+        """
+        Aggregates the output terms on the sampled output universe and takes the centroid, the way skfuzzy does
+        (without inserting clip points). Slower than defuzzify(), kept to check it against
+        :param activation: Output of activations()
+        :return: 1d array of crisp outputs. Reaches where no rule fires get 0
+        """
+        universe = self.output.universe
+        return piecewise_centroid(universe, self.aggregate(np.tile(universe, (activation.shape[0], 1)), activation))
+
+    def sparse_activations(self, memberships):
+        """
+        Same result as activations(firing_strengths(memberships)), but only fires the rules that can be nonzero.
+        Reaches are keyed by which terms of each input they have some membership in (and, for negated terms, full
+        membership in). The rules whose antecedents are all possible are found once per key, and each reach only fires
+        those. Adjacent terms overlap pairwise, so that's a few rules rather than all of them. Min and max are exact, so
+        the activations are bit for bit the same as full evaluation
+        :param memberships: Output of input_memberships()
+        :return: Array of shape (number of reaches, number of output terms)
+        """
+        num_reaches = memberships[0].shape[0]
+        activation = np.zeros((num_reaches, len(self.output.term_names)))
+        if num_reaches == 0:
+            return activation
+
+        # one bit per term for "membership above 0" and another for "membership of 1", for every input
+        nonzero = [mu > 0 for mu in memberships]
+        full = [mu >= 1 for mu in memberships]
+        masks = np.hstack(nonzero + full)
+        if masks.shape[1] > 62:
+            return self.activations(self.firing_strengths(memberships))
+        keys = masks.dot(np.left_shift(1, np.arange(masks.shape[1], dtype=np.int64)))
+        keys, key_reach, reach_key = np.unique(keys, return_index=True, return_inverse=True)
+        reach_key = reach_key.ravel()
+
+        # which rules can fire for each key
+        can_fire = np.ones((len(keys), len(self.rules)), dtype=bool)
+        for i in range(len(self.inputs)):
+            used = self.rule_terms[:, i] >= 0
+            terms = self.rule_terms[used, i]
+            can_fire[:, used] &= np.where(self.rule_negated[used, i], ~full[i][key_reach][:, terms],
+                                          nonzero[i][key_reach][:, terms])
+        # the rules each key can fire, listed first, followed by rules that can't
+        candidates = np.argsort(~can_fire, axis=1, kind='mergesort')
+        num_candidates = can_fire.sum(axis=1)[reach_key]
+
+        # a few keys can fire many rules, so reaches are handled in tiers by how many rules they can fire, and each
+        # tier only pads its rule lists out to the longest in the tier
+        tier_size = 1
+        while tier_size < 2 * len(self.rules):
+            tier = np.flatnonzero((num_candidates > tier_size // 2) & (num_candidates <= tier_size))
+            if len(tier) > 0:
+                width = min(tier_size, len(self.rules))
+                rules = candidates[reach_key[tier], :width]
+                rule_fires = np.arange(width) < num_candidates[tier][:, np.newaxis]
+                activation[tier] = self.candidate_activations(memberships, tier, rules, rule_fires)
+            tier_size *= 2
+        return activation
+
+    def candidate_activations(self, memberships, reaches, rules, rule_fires):
+        """
+        Fires a list of rules for each reach and accumulates them onto the output terms with max
+        :param memberships: Output of input_memberships()
+        :param reaches: 1d array of the reaches (rows of memberships) to fire rules for
+        :param rules: Array of shape (len(reaches), rules per reach) of rule indices
+        :param rule_fires: Boolean array the same shape as rules, False for padding that should be ignored
+        :return: Array of shape (len(reaches), number of output terms)
+        """
+        firing = np.ones(rules.shape)
+        for i in range(len(self.inputs)):
+            terms = self.rule_terms[rules, i]
+            used = terms >= 0
+            if not np.any(used):
+                continue
+            term_mu = memberships[i][reaches[:, np.newaxis], np.maximum(terms, 0)]
+            term_mu = np.where(self.rule_negated[rules, i], 1.0 - term_mu, term_mu)
+            firing = np.where(used, np.minimum(firing, term_mu), firing)
+        firing[~rule_fires] = 0.0
+
+        outputs = self.rule_outputs[rules]
+        activation = np.zeros((len(reaches), len(self.output.term_names)))
+        for t in range(len(self.output.term_names)):
+            activation[:, t] = np.where(outputs == t, firing, 0.0).max(axis=1)
+        return activation
+
+    def evaluate(self, input_arrays, chunk_size=DEFAULT_CHUNK_SIZE, sparse=True):
+        """
+        Runs the fuzzy inference system for every reach
+        :param input_arrays: List of 1d arrays, one per input, all the same length
+        :param chunk_size: How many reaches to defuzzify at a time
+        :param sparse: Fire only the rules that can be nonzero for each reach (see sparse_activations). The output is
+                       identical either way
+        :return: 1d array of defuzzified outputs
+        """
+        input_arrays = [np.asarray(values, dtype=np.float64) for values in input_arrays]
+        num_reaches = len(input_arrays[0])
+        out = np.zeros(num_reaches)
+        for rule_start in range(0, num_reaches, RULE_CHUNK_SIZE):
+            rule_stop = min(rule_start + RULE_CHUNK_SIZE, num_reaches)
+            memberships = self.input_memberships([values[rule_start:rule_stop] for values in input_arrays])
+            if sparse:
+                activation = self.sparse_activations(memberships)
+            else:
+                activation = self.activations(self.firing_strengths(memberships))
+            for start in range(0, rule_stop - rule_start, chunk_size):
+                stop = min(start + chunk_size, rule_stop - rule_start)
+                out[rule_start + start:rule_start + stop] = self.defuzzify(activation[start:stop])
+        return out
+
+
+def output_geometry(corners, lower, upper):
+    """
+    Finds the parts of the aggregated output MF that don't depend on the rule activations: the sloped term edges as
+    lines, and the breakpoints from the term corners and from crossings between sloped edges
+    :param corners: Array of trapezoid corners, shape (number of terms, 4)
+    :param lower: First output universe sample
+    :param upper: Last output universe sample
+    :return: Tuple of ((slopes, intercepts), breakpoints), with the line of each sloped edge as y = slope * x + intercept
+    """
+    slopes = []
+    intercepts = []
+    for a, b, c, d in corners:
+        if b > a:
+            slopes.append(1.0 / (b - a))
+            intercepts.append(-a / (b - a))
+        if d > c:
+            slopes.append(-1.0 / (d - c))
+            intercepts.append(d / (d - c))
+    slopes = np.array(slopes)
+    intercepts = np.array(intercepts)
+
+    breakpoints = [lower, upper] + list(corners.ravel())
+    for i in range(len(slopes)):
+        for j in range(i + 1, len(slopes)):
+            if slopes[i] != slopes[j]:
+                breakpoints.append((intercepts[j] - intercepts[i]) / (slopes[i] - slopes[j]))
+    breakpoints = np.unique(np.clip(breakpoints, lower, upper))
+    return (slopes, intercepts), breakpoints
+
+
+def piecewise_centroid(x, mfx):
+    """
+    Centroid of membership functions that are linear between the samples in x, the same rule skfuzzy.defuzz uses
+    :param x: 1d array of universe samples
+    :param mfx: Array of shape (number of reaches, len(x))
+    :return: 1d array of centroids, or 0 where the membership function has no area
+    """
+    x1 = x[:-1]
+    x2 = x[1:]
+    y1 = mfx[:, :-1]
+    y2 = mfx[:, 1:]
+    width = x2 - x1
+    area = (width * (y1 + y2) / 2.0).sum(axis=1)
+    moment = (width * (x1 * (2 * y1 + y2) + x2 * (y1 + 2 * y2)) / 6.0).sum(axis=1)
+
+    out = np.zeros(mfx.shape[0])
+    has_area = area > 0
+    out[has_area] = moment[has_area] / area[has_area]
+    return out
+
+
+def parse_fis_method(fis_method):
+    """
+    Turns the FIS method given by the toolbox into one of the method names we use internally
+    :param fis_method: The FIS method given to the tool, or None
+    :return: String
+    """
+    if fis_method is None or fis_method.lower().startswith('batch'):
+        return 'batch'
+    elif fis_method.lower().startswith('lookup') or fis_method.lower() == 'lut':
+        return 'lut'
+    elif fis_method.lower().startswith('skfuzzy'):
+        return 'skfuzzy'
+    else:
+        raise Exception("Unknown FIS method: " + str(fis_method))
@@ -0,0 +1,148 @@
+# -------------------------------------------------------------------------------
+# Name:        Calibrate FIS
+# Purpose:     Fits the membership function breakpoints of the vegetation or combined FIS to the dam densities observed
+#              in the output of Data Capture Validation
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import arcpy
+import numpy as np
+import BRATCapacity
+import FISCalibration
+import FISRuleTable
+from SupportingFunctions import find_folder, make_folder, find_available_num_suffix
+reload(BRATCapacity)
+reload(FISCalibration)
+reload(FISRuleTable)
+
+
+def main(in_network, fis_to_calibrate, max_DA_thresh, inputs_to_calibrate=None, rule_table=None,
+         population_size=None, generations=None, search_range=None, num_workers=None, seed=None):
+    """
+    Calibrates one of the FIS models against observed dam densities, and saves the fitted rule table and a convergence
+    log in a new Calibration folder in 02_Analyses
+    :param in_network: The output of Data Capture Validation, with e_DamDens for surveyed reaches
+    :param fis_to_calibrate: "Combined FIS" or "Vegetation FIS"
+    :param max_DA_thresh: The maximum drainage area threshold used for the combined FIS
+    :param inputs_to_calibrate: Semicolon separated names of the inputs whose breakpoints can move. Defaults to all
+    :param rule_table: Rule table to start from. Defaults to the standard model
+    :param population_size: Number of candidates in each generation
+    :param generations: Number of generations to run
+    :param search_range: How far breakpoints can move, as a fraction of their starting value
+    :param num_workers: Number of processes to score candidates in. 0 uses one per CPU core
+    :param seed: Seed for the search, so that runs are repeatable
+    :return:
+    """
+    arcpy.env.overwriteOutput = True
+    calibrate_veg = fis_to_calibrate is not None and fis_to_calibrate.lower().startswith('veg')
+    fis_name = 'veg_fis' if calibrate_veg else 'comb_fis'
+    if rule_table is None:
+        rule_table = FISRuleTable.default_rule_table(fis_name)
+    population_size = int(population_size) if population_size else FISCalibration.DEFAULT_POPULATION_SIZE
+    generations = int(generations) if generations else FISCalibration.DEFAULT_GENERATIONS
+    search_range = float(search_range) if search_range else FISCalibration.DEFAULT_SEARCH_RANGE
+    seed = int(seed) if seed else 0
+
+    system = FISRuleTable.load_system(rule_table)
+    if inputs_to_calibrate:
+        input_names = [name.strip().strip("'") for name in inputs_to_calibrate.split(';')]
+        unknown = [name for name in input_names if name not in [var.name for var in system.inputs]]
+        if unknown:
+            raise Exception(rule_table + " has no inputs called " + ", ".join(unknown))
+    else:
+        input_names = None
+    breakpoints = FISCalibration.BreakpointSet(system, input_names)
+
+    model, observed = read_surveyed_reaches(in_network, max_DA_thresh, calibrate_veg, system)
+    arcpy.AddMessage("Calibrating " + str(len(breakpoints.initial)) + " breakpoints against " + str(len(observed)) +
+                     " surveyed reaches with dams...")
+
+    fitted, fitted_rmse, log = FISCalibration.calibrate(model, breakpoints, calibrate_veg, observed, population_size,
+                                                        generations, search_range, num_workers, seed,
+                                                        arcpy.AddMessage)
+    start_rmse = FISCalibration.candidate_loss(model, breakpoints, calibrate_veg, observed, breakpoints.initial)
+    arcpy.AddMessage("RMSE went from " + str(round(start_rmse, 4)) + " to " + str(round(fitted_rmse, 4)) + " dams/km")
+    for label, value in zip(breakpoints.labels(), fitted):
+        arcpy.AddMessage("    " + label + " -> " + str(round(value, 6)))
+
+    output_folder = make_calibration_folder(in_network)
+    FISRuleTable.write_rule_table(breakpoints.apply(fitted), os.path.join(output_folder, fis_name + '.csv'),
+                                  "Calibrated from " + rule_table + "\n" +
+                                  "against e_DamDens in " + in_network + "\n" +
+                                  "RMSE " + str(round(start_rmse, 4)) + " -> " + str(round(fitted_rmse, 4)) +
+                                  " dams/km over " + str(len(observed)) + " surveyed reaches with dams")
+    write_convergence_log(os.path.join(output_folder, "Convergence_Log.csv"), breakpoints, log)
+    arcpy.AddMessage("Calibrated rule table and convergence log saved in " + output_folder)
+
+
+def read_surveyed_reaches(in_network, max_DA_thresh, calibrate_veg, system):
+    """
+    Reads the FIS inputs and observed dam density of every reach with observed dams, the same reaches Data Capture
+    Validation compares predicted and observed dams for
+    :param in_network: The output of Data Capture Validation
+    :param max_DA_thresh: The maximum drainage area threshold used for the combined FIS
+    :param calibrate_veg: True if the vegetation FIS is being calibrated
+    :param system: The FIS being calibrated
+    :return: Tuple of (FISCalibration.CapacityModel, observed dam densities)
+    """
+    fields = ['e_DamDens', 'oVC_EX', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope', 'iGeo_DA']
+    if calibrate_veg:
+        fields += ['iVeg100EX', 'iVeg_30EX']
+    network_fields = [f.name for f in arcpy.ListFields(in_network)]
+    missing = [field for field in fields if field not in network_fields]
+    if missing:
+        raise Exception(in_network + " is missing the fields " + ", ".join(missing) +
+                        ". Calibration needs the output of Data Capture Validation")
+
+    data = arcpy.da.FeatureClassToNumPyArray(in_network, fields, skip_nulls=True)
+    observed = np.asarray(data['e_DamDens'], np.float64)
+    surveyed = observed > 0
+    if not np.any(surveyed):
+        raise Exception("No reaches in " + in_network + " have observed dams")
+    observed = observed[surveyed]
+
+    # put inputs in range the same way Veg_FIS and Comb_FIS do
+    comb_inputs = BRATCapacity.comb_inputs_in_range(*[np.asarray(data[field], np.float64)[surveyed] for field in
+                                                      ['oVC_EX', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope']])
+    drainage_area = np.asarray(data['iGeo_DA'], np.float64)[surveyed]
+
+    if calibrate_veg:
+        veg_inputs = BRATCapacity.veg_inputs_in_range(data['iVeg100EX'][surveyed], data['iVeg_30EX'][surveyed])
+        comb_system = FISRuleTable.load_system(FISRuleTable.default_rule_table('comb_fis'))
+        model = FISCalibration.CapacityModel(comb_system, comb_inputs, drainage_area, max_DA_thresh,
+                                             system, veg_inputs)
+    else:
+        model = FISCalibration.CapacityModel(system, comb_inputs, drainage_area, max_DA_thresh)
+    return model, observed
+
+
+def make_calibration_folder(in_network):
+    """
+    Makes a new numbered folder for this calibration run in 02_Analyses
+    :param in_network: The output of Data Capture Validation
+    :return: Path to the new folder
+    """
+    analysis_folder = os.path.join(os.path.dirname(os.path.dirname(in_network)), "02_Analyses")
+    if not os.path.exists(analysis_folder):
+        analysis_folder = os.path.dirname(in_network)
+    calibration_folder = find_folder(analysis_folder, "FIS_Calibration")
+    if calibration_folder is None:
+        calibration_folder = make_folder(analysis_folder, "04_FIS_Calibration")
+    return make_folder(calibration_folder, "Calibration" + find_available_num_suffix(calibration_folder))
+
+
+def write_convergence_log(log_file, breakpoints, log):
+    """
+    Writes the best and mean RMSE of each generation, and the best breakpoints found so far
+    :param log_file: Path to the CSV file to write
+    :param breakpoints: FISCalibration.BreakpointSet
+    :param log: The convergence log returned by FISCalibration.calibrate
+    :return:
+    """
+    with open(log_file, 'w') as f:
+        f.write(','.join(['Generation', 'Best_RMSE', 'Mean_RMSE'] + breakpoints.labels()) + '\n')
+        for generation, best_rmse, mean_rmse, best in log:
+            f.write(','.join([str(generation), repr(float(best_rmse)), repr(float(mean_rmse))] +
+                             [repr(float(v)) for v in best]) + '\n')
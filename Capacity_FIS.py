@@ -0,0 +1,193 @@
+# -------------------------------------------------------------------------------
+# Name:        Capacity FIS
+# Purpose:     Runs the vegetation and combined FIS for the BRAT input table in one pass
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Running Veg_FIS and then Comb_FIS reads each input field separately, writes oVC_* to the network, copies it, reads
+# oVC_* back and then makes a cursor pass over the copy for each limit and count. This tool reads every field it needs
+# in one go, runs both FIS for historic and existing vegetation and works out the limits, dam counts and historic
+# departure on arrays (see BRATCapacity), then writes the results with one cursor pass over each network. The fields
+# and values are the same as running the two tools one after the other.
+
+import arcpy
+import numpy as np
+import os
+import sys
+import BatchFIS
+import BRATCapacity
+import FISCache
+import FISLookup
+import FISRuleTable
+import ParallelFIS
+import Veg_FIS
+import Comb_FIS
+from SupportingFunctions import make_folder
+reload(BatchFIS)
+reload(BRATCapacity)
+reload(FISCache)
+reload(FISLookup)
+reload(FISRuleTable)
+reload(ParallelFIS)
+reload(Veg_FIS)
+reload(Comb_FIS)
+
+
+INPUT_FIELDS = ['ReachID', 'iVeg100Hpe', 'iVeg_30Hpe', 'iVeg100EX', 'iVeg_30EX', 'iHyd_SP2', 'iHyd_SPLow',
+                'iGeo_Slope', 'iGeo_DA', 'iGeo_Len']
+
+
+def main(
+    projPath,
+    in_network,
+    max_DA_thresh,
+    out_name,
+    fis_method=None,
+    lut_resolution=None,
+    veg_rule_table=None,
+    comb_rule_table=None,
+    num_workers=None,
+    use_cache=None):
+    """
+    Runs the vegetation and combined FIS for historic and existing vegetation, and saves the combined capacity output
+    network in 02_Analyses
+    :param projPath: The project folder
+    :param in_network: The output of the BRAT table tool, with iHyd attributes
+    :param max_DA_thresh: Drainage area above which beaver can't build dams
+    :param out_name: Name of the output feature class
+    :param fis_method: "batch" (the default), "lut" or "skfuzzy" (see BatchFIS.parse_fis_method)
+    :param lut_resolution: Number of lookup table cells between neighbouring membership function corners
+    :param veg_rule_table: FIS rule table file to use instead of FISRules/veg_fis.csv
+    :param comb_rule_table: FIS rule table file to use instead of FISRules/comb_fis.csv
+    :param num_workers: Number of processes to split batch evaluation across. None or 1 runs in this process, and 0
+                        uses one process per CPU core
+    :param use_cache: True to look up batch results in the FISCache before evaluating
+    :return:
+    """
+    arcpy.env.overwriteOutput = True
+    fis_method = BatchFIS.parse_fis_method(fis_method)
+    if lut_resolution is None:
+        lut_resolution = FISLookup.DEFAULT_SUBDIVISIONS
+    lut_resolution = int(lut_resolution)
+    if veg_rule_table is None:
+        veg_rule_table = FISRuleTable.default_rule_table('veg_fis')
+    elif fis_method == 'skfuzzy':
+        arcpy.AddWarning("The skfuzzy reference runs the standard vegetation FIS, not " + veg_rule_table)
+    if comb_rule_table is None:
+        comb_rule_table = FISRuleTable.default_rule_table('comb_fis')
+    elif fis_method == 'skfuzzy':
+        arcpy.AddWarning("The skfuzzy reference runs the standard combined FIS, not " + comb_rule_table)
+    num_workers = ParallelFIS.resolve_num_workers(num_workers)
+    use_cache = FISCache.parse_use_cache(use_cache)
+
+    output_folder = os.path.dirname(os.path.dirname(in_network))
+    analyses_folder = make_folder(output_folder, "02_Analyses")
+    if out_name.endswith('.shp'):
+        out_network = os.path.join(analyses_folder, out_name)
+    else:
+        out_network = os.path.join(analyses_folder, out_name + ".shp")
+
+    arcpy.AddMessage("Reading FIS inputs...")
+    data = read_inputs(in_network)
+
+    arcpy.AddMessage("Running vegetation and combined FIS...")
+    veg_fields, comb_fields = run_capacity(data, max_DA_thresh, fis_method, lut_resolution, veg_rule_table,
+                                           comb_rule_table, num_workers, use_cache)
+
+    arcpy.AddMessage("Writing capacity fields...")
+    write_fields(in_network, data['ReachID'], veg_fields)
+    if os.path.exists(out_network):
+        arcpy.Delete_management(out_network)
+    arcpy.CopyFeatures_management(in_network, out_network)
+    write_fields(out_network, data['ReachID'], comb_fields)
+
+    Veg_FIS.makeLayers(in_network)
+    Comb_FIS.make_layers(out_network)
+    Comb_FIS.add_xml_output(in_network, out_network)
+
+
+def read_inputs(in_network):
+    """
+    Reads every field the vegetation and combined FIS need in one go
+    :param in_network: The output of the BRAT table tool, with iHyd attributes
+    :return: Structured array with a column for each of INPUT_FIELDS
+    """
+    network_fields = [f.name.lower() for f in arcpy.ListFields(in_network)]
+    missing = [field for field in INPUT_FIELDS if field.lower() not in network_fields]
+    if missing:
+        raise Exception(in_network + " is missing the fields " + ", ".join(missing) +
+                        ". Run the BRAT table and iHyd tools first")
+    return arcpy.da.FeatureClassToNumPyArray(in_network, INPUT_FIELDS)
+
+
+def run_capacity(data, max_DA_thresh, fis_method, lut_resolution, veg_rule_table, comb_rule_table, num_workers,
+                 use_cache=False):
+    """
+    Runs the vegetation and combined FIS for historic and existing vegetation, and finds dam counts and the historic
+    departure, all on arrays
+    :param data: Structured array from read_inputs()
+    :param max_DA_thresh: Drainage area above which beaver can't build dams
+    :param fis_method: "batch", "lut" or "skfuzzy"
+    :param lut_resolution: Number of lookup table cells between neighbouring membership function corners
+    :param veg_rule_table: The FISRuleTable file that defines the vegetation FIS
+    :param comb_rule_table: The FISRuleTable file that defines the combined FIS
+    :param num_workers: Number of processes to split batch evaluation across
+    :param use_cache: True to look up batch results in the FISCache before evaluating
+    :return: Tuple of (vegetation fields, combined fields), each a list of (field name, field type, array) tuples
+    """
+    veg_system = FISRuleTable.load_system(veg_rule_table)
+    comb_system = FISRuleTable.load_system(comb_rule_table)
+    veg_fields = []
+    comb_fields = []
+    counts = {}
+    for model_run in ['Hpe', 'EX']:
+        veg_inputs = BRATCapacity.veg_inputs_in_range(data['iVeg100' + model_run], data['iVeg_30' + model_run])
+        ovc = BRATCapacity.limit_veg_capacity(
+            Veg_FIS.evaluate_veg_fis(veg_system, veg_rule_table, veg_inputs, fis_method, num_workers, use_cache),
+            veg_system)
+
+        comb_inputs = BRATCapacity.comb_inputs_in_range(ovc, data['iHyd_SP2'], data['iHyd_SPLow'], data['iGeo_Slope'])
+        occ = BRATCapacity.limit_comb_capacity(
+            Comb_FIS.evaluate_comb_fis(comb_system, comb_rule_table, comb_inputs, fis_method, lut_resolution,
+                                       num_workers, use_cache),
+            ovc, data['iGeo_DA'], max_DA_thresh, comb_system)
+        counts[model_run] = BRATCapacity.dam_count(occ, data['iGeo_Len'])
+
+        veg_fields.append(('oVC_' + model_run, 'DOUBLE', ovc))
+        comb_fields.append(('oCC_' + model_run.upper(), 'DOUBLE', occ))
+        comb_fields.append(('mCC_' + model_run.upper() + '_CT', 'SHORT', counts[model_run]))
+
+    comb_fields.append(('mCC_HisDep', 'SHORT', counts['Hpe'] - counts['EX']))
+    return veg_fields, comb_fields
+
+
+def write_fields(network, reach_ids, fields):
+    """
+    Adds fields to a network, replacing any with the same names, and fills them in with one cursor pass
+    :param network: The network to write to
+    :param reach_ids: ReachID of each value in the arrays
+    :param fields: List of (field name, field type, array) tuples
+    :return:
+    """
+    field_names = [name for name, field_type, values in fields]
+    existing = [f.name for f in arcpy.ListFields(network) if f.name.lower() in [name.lower() for name in field_names]]
+    if existing:
+        arcpy.DeleteField_management(network, existing)
+    for name, field_type, values in fields:
+        arcpy.AddField_management(network, name, field_type)
+
+    rows = dict(zip(np.asarray(reach_ids).tolist(), zip(*[values.tolist() for name, field_type, values in fields])))
+    with arcpy.da.UpdateCursor(network, ['ReachID'] + field_names) as cursor:
+        for row in cursor:
+            values = rows.get(row[0])
+            if values is not None:
+                cursor.updateRow([row[0]] + list(values))
+
+
+if __name__ == '__main__':
+    main(
+        sys.argv[1],
+        sys.argv[2],
+        sys.argv[3],
+        sys.argv[4])
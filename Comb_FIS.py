@@ -15,18 +15,45 @@ from skfuzzy import control as ctrl
 import numpy as np
 import os
 import sys
+import BatchFIS
+import BRATCapacity
+import FISCache
+import FISLookup
+import FISRuleTable
+import ParallelFIS
 from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, getUUID, find_relative_path, write_xml_element_with_path
 import XMLBuilder
 reload(XMLBuilder)
 XMLBuilder = XMLBuilder.XMLBuilder
+reload(BatchFIS)
+reload(BRATCapacity)
+reload(FISCache)
+reload(FISLookup)
+reload(FISRuleTable)
+reload(ParallelFIS)
 
 def main(
     projPath,
     in_network,
     max_DA_thresh,
-    out_name):
+    out_name,
+    fis_method=None,
+    lut_resolution=None,
+    rule_table=None,
+    num_workers=None,
+    use_cache=None):
 
     scratch = 'in_memory'
+    fis_method = BatchFIS.parse_fis_method(fis_method)
+    use_cache = FISCache.parse_use_cache(use_cache)
+    if lut_resolution is None:
+        lut_resolution = FISLookup.DEFAULT_SUBDIVISIONS
+    lut_resolution = int(lut_resolution)
+    if rule_table is None:
+        rule_table = FISRuleTable.default_rule_table('comb_fis')
+    elif fis_method == 'skfuzzy':
+        arcpy.AddWarning("The skfuzzy reference runs the standard combined FIS, not " + rule_table)
+    num_workers = ParallelFIS.resolve_num_workers(num_workers)
 
     output_folder = os.path.dirname(os.path.dirname(in_network))
     analyses_folder = make_folder(output_folder, "02_Analyses")
@@ -40,15 +67,22 @@ def main(
     arcpy.CopyFeatures_management(in_network, out_network)
 
     # run the combined fis function for both potential and existing
-    combFIS(out_network, 'hpe', scratch, max_DA_thresh)
-    combFIS(out_network, 'ex', scratch, max_DA_thresh)
+    combFIS(out_network, 'hpe', scratch, max_DA_thresh, fis_method, lut_resolution, rule_table, num_workers,
+            use_cache)
+    combFIS(out_network, 'ex', scratch, max_DA_thresh, fis_method, lut_resolution, rule_table, num_workers,
+            use_cache)
 
     make_layers(out_network)
 
     add_xml_output(in_network, out_network)
 
 # combined fis function
-def combFIS(in_network, model_run, scratch, max_DA_thresh):
+# fis_method is "batch", "lut" or "skfuzzy" (see BatchFIS.parse_fis_method), lut_resolution is the number of
+# lookup table cells between neighbouring membership function corners, and rule_table is the FISRuleTable file that
+# defines the model (FISRules/comb_fis.csv unless a regional variant is given). Batch evaluation is split across
+# num_workers processes when it's more than 1, and looks results up in the FISCache first if use_cache is True
+def combFIS(in_network, model_run, scratch, max_DA_thresh, fis_method='batch', lut_resolution=None, rule_table=None,
+            num_workers=1, use_cache=False):
     arcpy.env.overwriteOutput = True
 
     # get list of all fields in the flowline network
@@ -83,19 +117,168 @@ def combFIS(in_network, model_run, scratch, max_DA_thresh):
 
     # check that inputs are within range of fis
     # if not, re-assign the value to just within range
-    ovc_array[ovc_array < 0] = 0
-    ovc_array[ovc_array > 45] = 45
-    ihydsp2_array[ihydsp2_array < 0] = 0.0001
-    ihydsp2_array[ihydsp2_array > 10000] = 10000
-    ihydsplow_array[ihydsplow_array < 0] = 0.0001
-    ihydsplow_array[ihydsplow_array > 10000] = 10000
-    igeoslope_array[igeoslope_array > 1] = 1
+    ovc_array, ihydsp2_array, ihydsplow_array, igeoslope_array = BRATCapacity.comb_inputs_in_range(
+        ovc_array, ihydsp2_array, ihydsplow_array, igeoslope_array)
 
     # delete temp arrays
     items = [segid_np, ovc_np, ihydsp2_np, ihydsplow_np, igeoslope_np]
     for item in items:
         del item
 
+    # run fuzzy inference system on inputs and defuzzify output
+    if rule_table is None:
+        rule_table = FISRuleTable.default_rule_table('comb_fis')
+    comb_system = FISRuleTable.load_system(rule_table)
+    out = evaluate_comb_fis(comb_system, rule_table, [ovc_array, ihydsp2_array, ihydsplow_array, igeoslope_array],
+                            fis_method, lut_resolution, num_workers, use_cache)
+
+    # save fuzzy inference system output as table
+    columns = np.column_stack((segid_array, out))
+    out_table = os.path.dirname(in_network) + "/" + out_field + "_Table.txt"  # todo: see if possible to skip this step
+    np.savetxt(out_table, columns, delimiter = ",", header = "ReachID, " + out_field, comments = "")
+    occ_table = scratch + "/" + out_field + "Tbl"
+    arcpy.CopyRows_management(out_table, occ_table)
+
+    # join the fuzzy inference system output to the flowline network
+    # create empty dictionary to hold input table field values
+    tblDict = {}
+    # add values to dictionary
+    with arcpy.da.SearchCursor(occ_table, ['ReachID', out_field]) as cursor:
+        for row in cursor:
+            tblDict[row[0]] = row[1]
+    # populate flowline network out field
+    arcpy.AddField_management(in_network, out_field, 'DOUBLE')
+    with arcpy.da.UpdateCursor(in_network, ['ReachID', out_field]) as cursor:
+        for row in cursor:
+            try:
+                aKey = row[0]
+                row[1] = tblDict[aKey]
+                cursor.updateRow(row)
+            except:
+                pass
+    tblDict.clear()
+
+    # calculate defuzzified centroid value for density 'none' MF group
+    # this will be used to re-classify output values that fall in this group
+    # important: will need to update the array (x) and MF values (mfx) if the
+    #            density 'none' values are changed in the model
+    x = np.arange(0, 45, 0.01)
+    mfx = fuzz.trimf(x, [0, 0, 0.1])
+    defuzz_centroid = round(fuzz.defuzz(x, mfx, 'centroid'), 6)
+
+    # update combined capacity (occ_*) values in stream network
+    # correct for occ_* greater than ovc_* as vegetation is most limiting factor in model
+    # (i.e., combined fis value should not be greater than the vegetation capacity)
+    # set occ_* to 0 if the drainage area is greater than the user defined threshold
+    # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
+    # set occ_* to 0 if output falls fully in 'none' category
+
+    with arcpy.da.UpdateCursor(in_network, [out_field, veg_field, 'iGeo_DA', 'iGeo_Slope']) as cursor:
+        for row in cursor:
+            if row[0] > row[1]:
+                row[0] = row[1]
+            if row[2] >= float(max_DA_thresh):
+                row[0] = 0.0
+            if round(row[0], 6) == defuzz_centroid:
+                row[0] = 0.0
+            cursor.updateRow(row)
+
+    # delete temporary tables and arrays
+    arcpy.Delete_management(out_table)
+    arcpy.Delete_management(occ_table)
+    items = [columns, out, x, mfx, defuzz_centroid]
+    for item in items:
+        del item
+
+    # calculate dam count (mCC_**_CT) for each reach as number of dams * reach length (in km)
+    arcpy.AddField_management(in_network, mcc_field, 'SHORT')
+    with arcpy.da.UpdateCursor(in_network, [mcc_field, out_field, 'iGeo_Len']) as cursor:
+        for row in cursor:
+            len_km = row[2] / 1000
+            raw_ct = row[1] * len_km
+            if raw_ct > 0 and raw_ct < 1:
+                row[0] = 1
+            else:
+                row[0] = round(raw_ct)
+            cursor.updateRow(row)
+
+    # calculate dam count historic departure as difference between potential count and existing count
+    if model_run == 'ex':
+        arcpy.AddField_management(in_network, 'mCC_HisDep', 'SHORT')
+        with arcpy.da.UpdateCursor(in_network, ['mCC_HisDep', 'mCC_EX_CT', 'mCC_HPE_CT']) as cursor:
+            for row in cursor:
+                row[0] = row[2] - row[1]
+                cursor.updateRow(row)
+
+
+def evaluate_comb_fis(comb_system, rule_table, input_arrays, fis_method='batch', lut_resolution=None, num_workers=1,
+                      use_cache=False):
+    """
+    Runs the combined FIS for every reach with the chosen evaluation method
+    :param comb_system: The BatchFIS.MamdaniSystem compiled from the rule table
+    :param rule_table: The FISRuleTable file that defines the model
+    :param input_arrays: oVC, iHyd_SP2, iHyd_SPLow and iGeo_Slope arrays, already put in range
+    :param fis_method: "batch", "lut" or "skfuzzy" (see BatchFIS.parse_fis_method)
+    :param lut_resolution: Number of lookup table cells between neighbouring membership function corners
+    :param num_workers: Number of processes to split batch evaluation across
+    :param use_cache: True to look up batch results in the FISCache, and only evaluate inputs that aren't in it
+    :return: Array of defuzzified combined capacities
+    """
+    if fis_method == 'skfuzzy':
+        return run_skfuzzy_fis(*input_arrays)
+    elif fis_method == 'lut':
+        if lut_resolution is None:
+            lut_resolution = FISLookup.DEFAULT_SUBDIVISIONS
+        surface_name = os.path.splitext(os.path.basename(rule_table))[0]
+        surface = FISLookup.get_surface(comb_system, surface_name, FISLookup.corner_axes(comb_system, lut_resolution))
+        out = surface.evaluate(input_arrays, comb_system)
+        report_surface_error(comb_system, surface, input_arrays)
+        return out
+
+    def evaluate(arrays):
+        if num_workers > 1:
+            return ParallelFIS.evaluate(rule_table, arrays, num_workers)
+        return comb_system.evaluate(arrays)
+
+    if use_cache:
+        cache = FISCache.FISCache(comb_system, os.path.splitext(os.path.basename(rule_table))[0])
+        out = cache.evaluate(input_arrays, evaluate)
+        cache.save()
+        arcpy.AddMessage("Combined FIS cache: " + cache.summary())
+        return out
+    return evaluate(input_arrays)
+
+
+def report_surface_error(comb_system, surface, input_arrays):
+    """
+    Reports how closely the lookup table matches direct evaluation, both over the whole grid and for this network
+    :param comb_system: The BatchFIS.MamdaniSystem the surface was built from
+    :param surface: FISLookup.ResponseSurface
+    :param input_arrays: The FIS inputs for every reach in the network
+    :return:
+    """
+    max_error, mean_error = FISLookup.compare_to_direct(comb_system, surface, input_arrays)
+    arcpy.AddMessage("Combined FIS lookup table error compared with direct evaluation:")
+    arcpy.AddMessage("    Grid check points: max " + str(round(surface.max_error, 4)) + ", mean " +
+                     str(round(surface.mean_error, 4)) + " dams/km")
+    arcpy.AddMessage("    Sampled reaches: max " + str(round(max_error, 4)) + ", mean " + str(round(mean_error, 4)) +
+                     " dams/km")
+    arcpy.AddMessage("    " + str(round(100.0 * surface.direct.mean(), 1)) +
+                     "% of grid cells are too steep to interpolate and are evaluated directly")
+    if max_error > FISLookup.CELL_TOLERANCE:
+        arcpy.AddWarning("The combined FIS lookup table was off by up to " + str(round(max_error, 4)) +
+                         " dams/km for the sampled reaches. Use a higher lookup table resolution or the batch method")
+
+
+def run_skfuzzy_fis(ovc_array, ihydsp2_array, ihydsplow_array, igeoslope_array):
+    """
+    Runs the combined FIS one reach at a time with skfuzzy. Kept as the reference the batch evaluator is checked against
+    :param ovc_array: Array of vegetation capacities (oVC_*)
+    :param ihydsp2_array: Array of 2 year peak flow stream powers (iHyd_SP2)
+    :param ihydsplow_array: Array of baseflow stream powers (iHyd_SPLow)
+    :param igeoslope_array: Array of reach slopes (iGeo_Slope)
+    :return: Array of defuzzified combined capacities
+    """
     # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
     ovc = ctrl.Antecedent(np.arange(0, 45, 0.01), 'input1')
     sp2 = ctrl.Antecedent(np.arange(0, 10000, 1), 'input2')
@@ -217,83 +400,7 @@ def combFIS(in_network, model_run, scratch, max_DA_thresh):
         comb_fis.compute()
         out[i] = comb_fis.output['result']
 
-    # save fuzzy inference system output as table
-    columns = np.column_stack((segid_array, out))
-    out_table = os.path.dirname(in_network) + "/" + out_field + "_Table.txt"  # todo: see if possible to skip this step
-    np.savetxt(out_table, columns, delimiter = ",", header = "ReachID, " + out_field, comments = "")
-    occ_table = scratch + "/" + out_field + "Tbl"
-    arcpy.CopyRows_management(out_table, occ_table)
-
-    # join the fuzzy inference system output to the flowline network
-    # create empty dictionary to hold input table field values
-    tblDict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(occ_table, ['ReachID', out_field]) as cursor:
-        for row in cursor:
-            tblDict[row[0]] = row[1]
-    # populate flowline network out field
-    arcpy.AddField_management(in_network, out_field, 'DOUBLE')
-    with arcpy.da.UpdateCursor(in_network, ['ReachID', out_field]) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = tblDict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    tblDict.clear()
-
-    # calculate defuzzified centroid value for density 'none' MF group
-    # this will be used to re-classify output values that fall in this group
-    # important: will need to update the array (x) and MF values (mfx) if the
-    #            density 'none' values are changed in the model
-    x = np.arange(0, 45, 0.01)
-    mfx = fuzz.trimf(x, [0, 0, 0.1])
-    defuzz_centroid = round(fuzz.defuzz(x, mfx, 'centroid'), 6)
-
-    # update combined capacity (occ_*) values in stream network
-    # correct for occ_* greater than ovc_* as vegetation is most limiting factor in model
-    # (i.e., combined fis value should not be greater than the vegetation capacity)
-    # set occ_* to 0 if the drainage area is greater than the user defined threshold
-    # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
-    # set occ_* to 0 if output falls fully in 'none' category
-
-    with arcpy.da.UpdateCursor(in_network, [out_field, veg_field, 'iGeo_DA', 'iGeo_Slope']) as cursor:
-        for row in cursor:
-            if row[0] > row[1]:
-                row[0] = row[1]
-            if row[2] >= float(max_DA_thresh):
-                row[0] = 0.0
-            if round(row[0], 6) == defuzz_centroid:
-                row[0] = 0.0
-            cursor.updateRow(row)
-
-    # delete temporary tables and arrays
-    arcpy.Delete_management(out_table)
-    arcpy.Delete_management(occ_table)
-    items = [columns, out, x, mfx, defuzz_centroid]
-    for item in items:
-        del item
-
-    # calculate dam count (mCC_**_CT) for each reach as number of dams * reach length (in km)
-    arcpy.AddField_management(in_network, mcc_field, 'SHORT')
-    with arcpy.da.UpdateCursor(in_network, [mcc_field, out_field, 'iGeo_Len']) as cursor:
-        for row in cursor:
-            len_km = row[2] / 1000
-            raw_ct = row[1] * len_km
-            if raw_ct > 0 and raw_ct < 1:
-                row[0] = 1
-            else:
-                row[0] = round(raw_ct)
-            cursor.updateRow(row)
-
-    # calculate dam count historic departure as difference between potential count and existing count
-    if model_run == 'ex':
-        arcpy.AddField_management(in_network, 'mCC_HisDep', 'SHORT')
-        with arcpy.da.UpdateCursor(in_network, ['mCC_HisDep', 'mCC_EX_CT', 'mCC_HPE_CT']) as cursor:
-            for row in cursor:
-                row[0] = row[2] - row[1]
-                cursor.updateRow(row)
+    return out
 
 
 def add_xml_output(in_network, out_network):
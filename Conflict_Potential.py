@@ -14,6 +14,7 @@ import numpy as np
 import os
 import sys
 import projectxml
+import FastKernels
 from SupportingFunctions import getUUID
 
 
@@ -70,18 +71,9 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
     if "iPC_RoadX" in fields:
         roadx_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_RoadX")
         roadx = np.asarray(roadx_array, np.float64)
-        roadx_pc = np.empty_like(roadx)
         m = slopeInt(CrossingLow, CrossingHigh)[0]
         b = slopeInt(CrossingLow, CrossingHigh)[1]
-        for i in range(len(roadx)):
-            if roadx[i] >= 0 and roadx[i] <= CrossingLow:
-                roadx_pc[i] = 0.99
-            elif roadx[i] > CrossingLow and roadx[i] <= CrossingHigh:
-                roadx_pc[i] = m * roadx[i] + b
-            elif roadx[i] > CrossingHigh:
-                roadx_pc[i] = 0.01
-            else:
-                roadx_pc[i] = 0.01
+        roadx_pc = FastKernels.conflict_score(roadx, CrossingLow, CrossingHigh, m, b)
 
         del roadx_array, roadx, m, b
     else:
@@ -92,18 +84,9 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
         roadad_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_RoadAd")
         roadad = np.asarray(roadad_array, np.float64)
         #roadad_pc = np.zeros_like(roadad)
-        roadad_pc = np.empty_like(roadad)
         m = slopeInt(AdjLow, AdjHigh)[0]
         b = slopeInt(AdjLow, AdjHigh)[1]
-        for i in range(len(roadad)):
-            if roadad[i] >= 0 and roadad[i] <= AdjLow:
-                roadad_pc[i] = 0.99
-            elif roadad[i] > AdjLow and roadad[i] <= AdjHigh:
-                roadad_pc[i] = m * roadad[i] + b
-            elif roadad[i] > AdjHigh:
-                roadad_pc[i] = 0.01
-            else:
-                roadad_pc[i] = 0.01
+        roadad_pc = FastKernels.conflict_score(roadad, AdjLow, AdjHigh, m, b)
 
         del roadad_array, roadad, m, b
     else:
@@ -114,18 +97,9 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
         canal_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_Canal")
         canal = np.asarray(canal_array, np.float64)
         #canal_pc = np.zeros_like(canal)
-        canal_pc = np.empty_like(canal)
         m = slopeInt(CanalLow, CanalHigh)[0]
         b = slopeInt(CanalLow, CanalHigh)[1]
-        for i in range(len(canal)):
-            if canal[i] >= 0 and canal[i] <= CanalLow:
-                canal_pc[i] = 0.99
-            elif canal[i] > CanalLow and canal[i] <= CanalHigh:
-                canal_pc[i] = m * canal[i] + b
-            elif canal[i] > CanalHigh:
-                canal_pc[i] = 0.01
-            else:
-                canal_pc[i] = 0.01
+        canal_pc = FastKernels.conflict_score(canal, CanalLow, CanalHigh, m, b)
 
         del canal_array, canal, m, b
     else:
@@ -136,18 +110,9 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
         rr_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_RR")
         rr = np.asarray(rr_array, np.float64)
         #rr_pc = np.zeros_like(rr)
-        rr_pc = np.empty_like(rr)
         m = slopeInt(RRLow, RRHigh)[0]
         b = slopeInt(RRLow, RRHigh)[1]
-        for i in range(len(rr)):
-            if rr[i] >= 0 and rr[i] <= RRLow:
-                rr_pc[i] = 0.99
-            elif rr[i] > RRLow and rr[i] <= RRHigh:
-                rr_pc[i] = m * rr[i] + b
-            elif rr[i] > RRHigh:
-                rr_pc[i] = 0.01
-            else:
-                rr_pc[i] = 0.01
+        rr_pc = FastKernels.conflict_score(rr, RRLow, RRHigh, m, b)
 
         del rr_array, rr, m, b
     else:
@@ -157,7 +122,6 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
     if "iPC_LU" in fields:
         lu_array = arcpy.da.FeatureClassToNumPyArray(out_network, "iPC_LU")
         lu = np.asarray(lu_array, np.float64)
-        lu_pc = np.empty_like(lu)
 
         # for i in range(len(lu)):
         #     if lu[i] >= 2:
@@ -169,17 +133,7 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
         #     else:
         #         lu_pc[i] = 0.01
 
-        for i in range(len(lu)):
-            if lu[i] >= 1.0:
-                lu_pc[i] = 0.99
-            elif lu[i] >= 0.66 and lu[i] < 1.0:
-                lu_pc[i] = 0.75
-            elif lu[i] >= 0.33 and lu[i] < 0.66:
-                lu_pc[i] = 0.5
-            elif lu[i] > 0 and lu[i] < 0.33:
-                lu_pc[i] = 0.25
-            else:
-                lu_pc[i] = 0.01
+        lu_pc = FastKernels.land_use_score(lu)
     else:
         lu_pc = np.zeros_like(segid_array)
 
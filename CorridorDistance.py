@@ -0,0 +1,128 @@
+# -------------------------------------------------------------------------------
+# Name:        Corridor Distance
+# Purpose:     Finds raster distances to every kind of infrastructure at once, only for the cells in the buffers around
+#              the network
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# EucDistance makes a full raster over the network's extent for each kind of infrastructure, and only the cells in
+# the 30 m buffers are ever read from it. Here the roads, railroads, canals and crossings are burned into the same
+# grid EucDistance used once, as lists of source cells labelled with their kind, and distances are only found for the
+# corridor of cells in the buffers.
+#
+# The distance from a corridor cell to a kind of infrastructure is the exact distance between its center and the
+# center of the nearest source cell of that kind, as EucDistance measures it, found with VectorDistance.SegmentIndex.
+# All of the kinds are measured from the same corridor cells in one call, which also gives each cell's nearest kind of
+# infrastructure and the distance to it.
+#
+# Lines are burned into every cell they pass through: each segment is cut where it crosses the grid's row and column
+# lines, and the middle of each piece is in a cell it passes through.
+#
+# This module doesn't use arcpy. BRAT_table reads the features and buffers and writes the results.
+
+import numpy as np
+import ReachZonal
+import VectorDistance
+
+
+DEFAULT_CELL_SIZE = 5.0  # meters, the cell size EucDistance was run with
+
+
+def burn_segments(x0, y0, x1, y1, grid):
+    """
+    Finds the cells segments pass through. Segments of length 0 burn the cell they are in
+    :param x0: X coordinate of the start of each segment
+    :param y0: Y coordinate of the start of each segment
+    :param x1: X coordinate of the end of each segment
+    :param y1: Y coordinate of the end of each segment
+    :param grid: ReachZonal.RasterGrid to burn the segments into
+    :return: Sorted array of flat cell indexes (row * number of columns + column), without repeats
+    """
+    col0, row0 = grid.grid_coordinates(x0, y0)
+    col1, row1 = grid.grid_coordinates(x1, y1)
+    segments = [np.arange(len(col0))] * 2
+    cuts = [np.zeros(len(col0)), np.ones(len(col0))]
+    for start, end in [(col0, col1), (row0, row1)]:
+        # where each segment crosses the grid lines between its ends
+        first_line = np.floor(np.minimum(start, end)) + 1
+        num_lines = np.maximum(np.ceil(np.maximum(start, end)) - first_line, 0).astype(np.int64)
+        segment = np.repeat(np.arange(len(start)), num_lines)
+        line = first_line[segment] + np.arange(len(segment)) - (np.cumsum(num_lines) - num_lines)[segment]
+        segments.append(segment)
+        cuts.append((line - start[segment]) / (end - start)[segment])
+    segment = np.concatenate(segments)
+    cut = np.concatenate(cuts)
+    order = np.lexsort((cut, segment))
+    segment, cut = segment[order], cut[order]
+    # every segment has cuts at its start and end, so each has at least one piece
+    same = segment[1:] == segment[:-1]
+    segment = segment[:-1][same]
+    t = (cut[:-1] + cut[1:])[same] / 2.0
+    col = np.floor(col0[segment] + t * (col1 - col0)[segment]).astype(np.int64)
+    row = np.floor(row0[segment] + t * (row1 - row0)[segment]).astype(np.int64)
+    on_grid = (col >= 0) & (col < grid.num_cols) & (row >= 0) & (row < grid.num_rows)
+    return np.unique(row[on_grid] * grid.num_cols + col[on_grid])
+
+
+def cell_centers(cells, grid):
+    """
+    :param cells: Flat cell indexes into grid
+    :param grid: ReachZonal.RasterGrid
+    :return: Tuple of (X, Y) arrays of the cells' centers
+    """
+    cells = np.asarray(cells, np.int64)
+    return (grid.left + (cells % grid.num_cols + 0.5) * grid.cell_size,
+            grid.top - (cells // grid.num_cols + 0.5) * grid.cell_size)
+
+
+def labelled_distance(cells, grid, sources, source_grid=None):
+    """
+    Finds the distance from each cell to the nearest source cell of each label
+    :param cells: Flat cell indexes into grid to find distances for
+    :param grid: ReachZonal.RasterGrid of cells
+    :param sources: List with an array of flat source cell indexes for each label
+    :param source_grid: ReachZonal.RasterGrid of the sources, lined up with grid. Defaults to grid
+    :return: Tuple of (2d array with the distance to each label for each cell, distance to the nearest source, label of
+             the nearest source). Distances are infinity and the label is -1 where there are no sources
+    """
+    if source_grid is None:
+        source_grid = grid
+    x, y = cell_centers(cells, grid)
+    distances = np.full((len(sources), len(x)), np.inf)
+    for label, source_cells in enumerate(sources):
+        source_x, source_y = cell_centers(source_cells, source_grid)
+        distances[label] = VectorDistance.SegmentIndex(source_x, source_y, source_x, source_y).distance(x, y)
+    if len(sources) == 0:
+        return distances, np.full(len(x), np.inf), np.full(len(x), -1, np.int64)
+    nearest_label = np.argmin(distances, axis=0)
+    nearest = distances[nearest_label, np.arange(len(x))]
+    nearest_label[np.isinf(nearest)] = -1
+    return distances, nearest, nearest_label
+
+
+def corridor_cells(footprints_list):
+    """
+    :param footprints_list: List of ReachZonal.ReachFootprints on the same grid
+    :return: Sorted array of every cell in any of the footprints
+    """
+    return np.unique(np.concatenate([footprints.cells for footprints in footprints_list]))
+
+
+def corridor_statistics(footprints, cells, values, statistics):
+    """
+    Finds statistics of values known only at corridor cells within each footprint
+    :param footprints: ReachZonal.ReachFootprints, whose cells are all in cells
+    :param cells: Sorted array of corridor cells, from corridor_cells()
+    :param values: Value at each corridor cell, with NaN or infinity for no data
+    :param statistics: List of statistic names, as for ReachZonal.zonal_statistics()
+    :return: Dictionary from upper case statistic name to an array with a value for each footprint
+    """
+    statistics = [statistic.upper() for statistic in statistics]
+    for statistic in statistics:
+        ReachZonal.percentile_value(statistic)  # raises an exception for unknown statistics
+    footprint_values = np.asarray(values, np.float64)[np.searchsorted(cells, footprints.cells)]
+    valid = np.isfinite(footprint_values)
+    weights = None if footprints.weights is None else footprints.weights[valid]
+    return ReachZonal.summarize(footprint_values[valid], footprints.reach_index()[valid], len(footprints.reach_ids),
+                                statistics, weights)
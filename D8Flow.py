@@ -0,0 +1,611 @@
+# -------------------------------------------------------------------------------
+# Name:        D8 Flow
+# Purpose:     Fills depressions in a DEM, finds D8 flow directions and accumulates flow without Spatial Analyst, one
+#              tile at a time so that large DEMs don't have to fit in memory
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Filling uses the priority flood (Barnes et al. 2014): water spreads inwards from the cells it can leave the DEM
+# from (cells on the edge or next to NoData), always from the lowest cell reached so far, and every cell is raised to
+# the level it was reached at. To do this a tile at a time (Barnes 2016):
+#   1. Each tile is flooded from its own edge cells, each with its own label. Wherever two labels meet, the level at
+#      which water could spill from one to the other is kept, along with the levels between edge cells of touching
+#      tiles. These spill levels form a small graph with a node for each tile edge cell.
+#   2. Flooding the graph from the cells water leaves the DEM from gives the filled level of every tile edge cell.
+#   3. Each tile is flooded again from its edge cells at those levels, which fills its inside exactly as flooding
+#      the whole DEM at once would.
+#
+# Each cell flows to the neighbor with the steepest drop, as FlowDirection does. Cells on flats have no lower
+# neighbor, and flow back towards the cell the flood reached them from instead, which always leads off the flat.
+# Where a flat crosses tiles, the second flood spreads from edge cells in the order the graph was flooded, so that
+# flow across tile edges can't go round in a loop.
+#
+# Flow is accumulated in topological order: cells with nothing flowing into them first, then the cells they flow to
+# once all of those cells' inflows are known. Each tile's flow is first accumulated on its own, the flow between tile
+# edge cells is then passed through a graph of the tile edges, and each tile is accumulated again with its inflows
+# from other tiles. Like FlowAccumulation, each cell's value is the number of cells upstream of it, not counting
+# itself.
+#
+# Flow directions can use the ESRI (1, 2, 4, ... 128) or TauDEM (1-8) encoding, the same values as
+# BDSWEA.FLOW_DIR_ESRI and BDSWEA.FLOW_DIR_TAUDEM. GDAL is only needed to read and write raster files
+# (drainage_area_file); d8_flow() works on any raster that can be read and written in blocks.
+
+import os
+import heapq
+import numpy as np
+import FastKernels
+import FocalMean
+
+try:
+    from osgeo import gdal
+    HAVE_GDAL = True
+except ImportError:
+    gdal = None
+    HAVE_GDAL = False
+
+
+# each direction is the index of a cell in the 3x3 window around a cell, in the same order as BDSWEA
+FLOW_DIR_ESRI = np.array([32, 64, 128, 16, 0, 1, 8, 4, 2])
+FLOW_DIR_TAUDEM = np.array([4, 3, 2, 5, 0, 1, 6, 7, 8])
+ROW_OFFSET = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+COL_OFFSET = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+DISTANCE = np.sqrt(ROW_OFFSET ** 2 + COL_OFFSET ** 2)
+NO_DIRECTION = 255  # flow direction NoData
+NO_DATA = -9999.0
+DEFAULT_TILE_SIZE = FocalMean.DEFAULT_TILE_SIZE
+
+
+class ArrayRaster(object):
+    """
+    A raster held in a NumPy array, read and written in blocks like a raster file
+    """
+    def __init__(self, values, no_data=None):
+        """
+        :param values: 2d array
+        :param no_data: Value stored for NoData, or None if NoData is stored as NaN
+        """
+        self.values = values
+        self.no_data = no_data
+
+    def read(self, first_row, last_row, first_col, last_col):
+        """
+        :return: 2d float array of the block, with NaN for NoData
+        """
+        values = self.values[first_row:last_row, first_col:last_col].astype(np.float64)
+        if self.no_data is not None:
+            values[values == self.no_data] = np.nan
+        return values
+
+    def write(self, first_row, first_col, values):
+        """
+        :param values: 2d array of the block, with NaN for NoData
+        """
+        if self.no_data is not None:
+            values = np.where(np.isnan(values), self.no_data, values)
+        self.values[first_row:first_row + values.shape[0], first_col:first_col + values.shape[1]] = values
+
+
+class GDALRaster(object):
+    """
+    A band of a raster file open in GDAL, read and written in blocks
+    """
+    def __init__(self, band):
+        """
+        :param band: gdal.Band
+        """
+        self.band = band
+        self.no_data = band.GetNoDataValue()
+
+    def read(self, first_row, last_row, first_col, last_col):
+        """
+        :return: 2d float array of the block, with NaN for NoData
+        """
+        values = self.band.ReadAsArray(first_col, first_row, last_col - first_col,
+                                       last_row - first_row).astype(np.float64)
+        if self.no_data is not None:
+            values[values == self.no_data] = np.nan
+        return values
+
+    def write(self, first_row, first_col, values):
+        """
+        :param values: 2d array of the block, with NaN for NoData
+        """
+        if self.no_data is not None:
+            values = np.where(np.isnan(values), self.no_data, values)
+        self.band.WriteArray(values, first_col, first_row)
+
+
+def flow_dir_codes(encoding):
+    """
+    :param encoding: "ESRI" or "TauDEM"
+    :return: The flow direction value of each cell of the 3x3 window
+    """
+    if str(encoding).upper() == 'ESRI':
+        return FLOW_DIR_ESRI
+    if str(encoding).upper() == 'TAUDEM':
+        return FLOW_DIR_TAUDEM
+    raise Exception("Unknown flow direction encoding " + str(encoding) + ". Use ESRI or TauDEM")
+
+
+def d8_flow(read_dem, num_rows, num_cols, flow_dir, accumulation=None, encoding='ESRI',
+            tile_size=DEFAULT_TILE_SIZE, report=None):
+    """
+    Fills depressions, then saves D8 flow directions and, optionally, flow accumulation, a tile at a time
+    :param read_dem: Function taking (first row, last row + 1, first column, last column + 1) and returning a 2d
+                     float array of the DEM, with NaN for NoData
+    :param num_rows: Rows in the DEM
+    :param num_cols: Columns in the DEM
+    :param flow_dir: ArrayRaster or GDALRaster to save flow directions in. It is read back to accumulate flow
+    :param accumulation: ArrayRaster or GDALRaster to save the number of upstream cells in, or None
+    :param encoding: "ESRI" or "TauDEM"
+    :param tile_size: Rows and columns in each tile
+    :param report: Function that progress messages are passed to, e.g. arcpy.AddMessage
+    :return:
+    """
+    codes = flow_dir_codes(encoding)
+    tiles = FocalMean.tile_ranges(num_rows, num_cols, tile_size)
+    if report:
+        report("Finding spill levels between " + str(len(tiles)) + " tiles...")
+    spill_edges = [tile_spill_edges(read_dem, tile, num_rows, num_cols) for tile in tiles]
+    graph = SpillGraph(*[np.concatenate(column) for column in zip(*spill_edges)])
+
+    if report:
+        report("Filling depressions and finding flow directions...")
+    for tile in tiles:
+        directions = tile_flow_directions(read_dem, tile, num_rows, num_cols, graph)
+        encoded = np.where(directions < 0, NO_DIRECTION, codes[np.maximum(directions, 0)])
+        flow_dir.write(tile[0], tile[2], encoded.astype(np.uint8))
+
+    if accumulation is not None:
+        if report:
+            report("Accumulating flow...")
+        accumulate_tiles(flow_dir, accumulation, num_rows, num_cols, tiles, codes)
+
+
+def drainage_area(dem, cell_size, encoding='ESRI', tile_size=DEFAULT_TILE_SIZE):
+    """
+    Finds flow directions and drainage area for a DEM held in memory
+    :param dem: 2d array, with NaN for NoData
+    :param cell_size: Width of each cell, in meters
+    :param encoding: "ESRI" or "TauDEM"
+    :param tile_size: Rows and columns in each tile
+    :return: Tuple of (flow direction array with NO_DIRECTION for NoData, drainage area array in square kilometers
+             with NaN for NoData)
+    """
+    dem = np.asarray(dem, np.float64)
+    flow_dir = ArrayRaster(np.full(dem.shape, NO_DIRECTION, np.uint8))
+    accumulation = ArrayRaster(np.full(dem.shape, np.nan))
+    d8_flow(lambda r0, r1, c0, c1: dem[r0:r1, c0:c1].copy(), dem.shape[0], dem.shape[1], flow_dir, accumulation,
+            encoding, tile_size)
+    return flow_dir.values, accumulation.values * (cell_size * cell_size) / 1000000.0
+
+
+def drainage_area_file(dem_path, drain_area_path, flow_dir_path=None, encoding='ESRI', smooth_size=None,
+                       tile_size=DEFAULT_TILE_SIZE, report=None):
+    """
+    Makes a drainage area raster in square kilometers from a DEM file with GDAL, streaming tiles from disk
+    :param dem_path: The DEM, in meters
+    :param drain_area_path: Where to save the drainage area GeoTIFF, e.g. Flow/DrainArea_sqkm.tif
+    :param flow_dir_path: Where to save the flow direction GeoTIFF, or None to only keep it while running
+    :param encoding: "ESRI" or "TauDEM"
+    :param smooth_size: Width in cells of a focal mean to smooth the DEM with first (see FocalMean), or None
+    :param tile_size: Rows and columns in each tile
+    :param report: Function that progress messages are passed to, e.g. arcpy.AddMessage
+    :return:
+    """
+    if not HAVE_GDAL:
+        raise Exception("GDAL is needed to find drainage area from a DEM file")
+    dem_ds = gdal.Open(dem_path)
+    if dem_ds is None:
+        raise Exception("GDAL couldn't open " + str(dem_path))
+    dem = GDALRaster(dem_ds.GetRasterBand(1))
+    num_rows, num_cols = dem_ds.RasterYSize, dem_ds.RasterXSize
+    transform = dem_ds.GetGeoTransform()
+    read_dem = dem.read
+    if smooth_size:
+        read_dem = FocalMean.smoothed_reader(dem.read, num_rows, num_cols, smooth_size)
+
+    keep_flow_dir = flow_dir_path is not None
+    if not keep_flow_dir:
+        flow_dir_path = os.path.splitext(drain_area_path)[0] + "_flowdir_temp.tif"
+    driver = gdal.GetDriverByName("GTiff")
+    options = ["TILED=YES", "COMPRESS=LZW", "BIGTIFF=IF_SAFER"]
+    outputs = []
+    for path, data_type, no_data in [(flow_dir_path, gdal.GDT_Byte, NO_DIRECTION),
+                                     (drain_area_path, gdal.GDT_Float32, NO_DATA)]:
+        ds = driver.Create(path, num_cols, num_rows, 1, data_type, options)
+        ds.SetGeoTransform(transform)
+        ds.SetProjection(dem_ds.GetProjection())
+        ds.GetRasterBand(1).SetNoDataValue(no_data)
+        outputs.append(ds)
+    flow_dir = GDALRaster(outputs[0].GetRasterBand(1))
+    area = GDALRaster(outputs[1].GetRasterBand(1))
+    cell_area_sqkm = abs(transform[1] * transform[5]) / 1000000.0
+
+    class DrainArea(object):
+        # writes accumulation as drainage area, and reads nothing back
+        def write(self, first_row, first_col, values):
+            area.write(first_row, first_col, (values * cell_area_sqkm).astype(np.float32))
+
+    d8_flow(read_dem, num_rows, num_cols, flow_dir, DrainArea(), encoding, tile_size, report)
+    outputs = None
+    flow_dir = None
+    area = None
+    dem_ds = None
+    if not keep_flow_dir:
+        driver.Delete(flow_dir_path)
+
+
+def halo_block(read_block, tile, num_rows, num_cols):
+    """
+    Reads a tile with a 1 cell halo, padding with NaN beyond the edges of the raster
+    :return: Tuple of (the tile, the tile with its halo)
+    """
+    block, inner = FocalMean.read_with_halo(read_block, tile, 1, num_rows, num_cols)
+    first_row, last_row, first_col, last_col = tile
+    padded = np.full((last_row - first_row + 2, last_col - first_col + 2), np.nan)
+    top = 1 - (first_row - max(first_row - 1, 0))
+    left = 1 - (first_col - max(first_col - 1, 0))
+    padded[top:top + block.shape[0], left:left + block.shape[1]] = block
+    return padded[1:-1, 1:-1].copy(), padded
+
+
+def neighbors(padded, k):
+    """
+    :param padded: A tile with a 1 cell halo
+    :param k: Index of a cell of the 3x3 window
+    :return: The value of each cell's neighbor in direction k
+    """
+    num_rows = padded.shape[0] - 2
+    num_cols = padded.shape[1] - 2
+    return padded[1 + ROW_OFFSET[k]:1 + ROW_OFFSET[k] + num_rows, 1 + COL_OFFSET[k]:1 + COL_OFFSET[k] + num_cols]
+
+
+def tile_cells(tile, num_cols):
+    """
+    :return: Tuple of (global flat index of every cell of a tile, mask of the tile's edge cells)
+    """
+    first_row, last_row, first_col, last_col = tile
+    rows = np.arange(first_row, last_row)[:, None]
+    cols = np.arange(first_col, last_col)[None, :]
+    edge = np.zeros((last_row - first_row, last_col - first_col), bool)
+    edge[0, :] = edge[-1, :] = edge[:, 0] = edge[:, -1] = True
+    return rows * num_cols + cols, edge
+
+
+def outlet_cells(dem, padded):
+    """
+    :return: Mask of the cells water can leave the DEM from: cells with data next to NoData or the DEM's edge
+    """
+    outlets = np.zeros(dem.shape, bool)
+    for k in range(9):
+        if k != 4:
+            outlets |= np.isnan(neighbors(padded, k))
+    return outlets & ~np.isnan(dem)
+
+
+def tile_spill_edges(read_dem, tile, num_rows, num_cols):
+    """
+    Floods a tile from its edge cells, each with its own label, and finds the level water could spill at between
+    each pair of labels that touch, and between the tile's edge cells and their neighbors in other tiles
+    :return: Tuple of (label arrays a and b, spill level array). Labels are global flat cell indexes + 1, and 0 for
+             the outside of the DEM
+    """
+    dem, padded = halo_block(read_dem, tile, num_rows, num_cols)
+    valid = ~np.isnan(dem)
+    cells, edge = tile_cells(tile, num_cols)
+    edge &= valid
+    outlets = outlet_cells(dem, padded)
+
+    label = np.zeros(dem.shape, np.int64)
+    label[edge] = cells[edge] + 1
+    level = np.full(dem.shape, np.nan)
+    seeds = np.flatnonzero(edge | outlets)
+    level.flat[seeds] = dem.flat[seeds]
+    FastKernels.priority_flood(dem, level, label, np.zeros(dem.shape, np.int8), seeds)
+
+    a = [cells[edge & outlets] + 1]
+    b = [np.zeros(np.count_nonzero(edge & outlets), np.int64)]
+    w = [dem[edge & outlets]]
+    # labels meeting inside the tile, looking right, down and along both diagonals down
+    label_padded = np.pad(label, 1, mode='constant', constant_values=-1)
+    level_padded = np.pad(level, 1, mode='constant', constant_values=np.nan)
+    for k in [5, 6, 7, 8]:
+        other_label = neighbors(label_padded, k)
+        other_level = neighbors(level_padded, k)
+        meet = valid & ~np.isnan(other_level) & (other_label != label) & (other_label >= 0)
+        a.append(label[meet])
+        b.append(other_label[meet])
+        w.append(np.maximum(level[meet], other_level[meet]))
+    # edge cells next to cells of other tiles, which are edge cells of those tiles
+    global_padded = np.full(padded.shape, -1, np.int64)
+    first_row, last_row, first_col, last_col = tile
+    rows = np.arange(first_row - 1, last_row + 1)[:, None]
+    cols = np.arange(first_col - 1, last_col + 1)[None, :]
+    global_padded[:] = rows * num_cols + cols
+    global_padded[1:-1, 1:-1] = -1
+    for k in range(9):
+        if k == 4:
+            continue
+        other = neighbors(global_padded, k)
+        other_dem = neighbors(padded, k)
+        meet = edge & (other >= 0) & ~np.isnan(other_dem)
+        a.append(cells[meet] + 1)
+        b.append(other[meet] + 1)
+        w.append(np.maximum(dem[meet], other_dem[meet]))
+    return lowest_edges(np.concatenate(a), np.concatenate(b), np.concatenate(w))
+
+
+def lowest_edges(a, b, w):
+    """
+    Keeps the lowest spill level between each pair of labels
+    :return: Tuple of (label arrays a and b with a < b, spill level array)
+    """
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    order = np.lexsort((w, b, a))
+    a, b, w = a[order], b[order], w[order]
+    first = np.concatenate([[True], (a[1:] != a[:-1]) | (b[1:] != b[:-1])]) if len(a) else np.zeros(0, bool)
+    return a[first], b[first], w[first]
+
+
+class SpillGraph(object):
+    """
+    The filled levels of tile edge cells, from flooding the graph of spill levels between them
+    """
+    def __init__(self, a, b, w):
+        """
+        :param a: Label of one end of each edge (global flat cell index + 1, or 0 for the outside of the DEM)
+        :param b: Label of the other end
+        :param w: Level water spills between the ends at
+        """
+        a, b, w = lowest_edges(a, b, w)
+        self.labels, ends = np.unique(np.concatenate([a, b, [0]]), return_inverse=True)
+        ends = ends.ravel()
+        num_edges = len(a)
+        ends_a, ends_b = ends[:num_edges], ends[num_edges:2 * num_edges]
+        num_nodes = len(self.labels)
+
+        # each edge listed from both ends
+        source = np.concatenate([ends_a, ends_b])
+        target = np.concatenate([ends_b, ends_a])
+        weight = np.concatenate([w, w])
+        order = np.argsort(source, kind='mergesort')
+        target = target[order].tolist()
+        weight = weight[order].tolist()
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(source, minlength=num_nodes))]).tolist()
+
+        level = [np.inf] * num_nodes
+        parent = [-1] * num_nodes
+        rank = [-1] * num_nodes
+        done = [False] * num_nodes
+        ocean = int(np.searchsorted(self.labels, 0))
+        level[ocean] = -np.inf
+        heap = [(-np.inf, ocean)]
+        popped = 0
+        while heap:
+            node_level, node = heapq.heappop(heap)
+            if done[node]:
+                continue
+            done[node] = True
+            rank[node] = popped
+            popped += 1
+            for i in range(offsets[node], offsets[node + 1]):
+                other = target[i]
+                other_level = max(weight[i], node_level)
+                if not done[other] and other_level < level[other]:
+                    level[other] = other_level
+                    parent[other] = node
+                    heapq.heappush(heap, (other_level, other))
+        self.level = np.array(level)
+        self.rank = np.array(rank, np.int64)
+        self.parent_label = np.where(np.array(parent) >= 0, self.labels[np.maximum(parent, 0)], -1)
+
+    def lookup(self, cells):
+        """
+        :param cells: Global flat indexes of tile edge cells
+        :return: Tuple of (filled level, rank in the order the graph was flooded, label of the node it was reached
+                 from) arrays
+        """
+        index = np.searchsorted(self.labels, np.asarray(cells, np.int64) + 1)
+        return self.level[index], self.rank[index], self.parent_label[index]
+
+
+def tile_flow_directions(read_dem, tile, num_rows, num_cols, graph):
+    """
+    Fills a tile from its edge cells at their levels in the spill graph, and finds each cell's flow direction
+    :return: 2d int array with the index of the 3x3 window cell each cell flows to, -1 for NoData
+    """
+    dem, padded = halo_block(read_dem, tile, num_rows, num_cols)
+    valid = ~np.isnan(dem)
+    cells, edge = tile_cells(tile, num_cols)
+    edge &= valid
+    outlets = outlet_cells(dem, padded)
+    first_row, last_row, first_col, last_col = tile
+
+    # edge cells are filled from outside the tile if the graph reached them from another tile or they are outlets
+    edge_level, edge_rank, edge_parent = graph.lookup(cells[edge])
+    parent_cell = edge_parent - 1
+    parent_row, parent_col = parent_cell // num_cols, parent_cell % num_cols
+    from_outside = (edge_parent > 0) & ((parent_row < first_row) | (parent_row >= last_row) |
+                                        (parent_col < first_col) | (parent_col >= last_col))
+    seeded = np.zeros(dem.shape, bool)
+    seeded[edge] = from_outside
+    seeded |= outlets
+    level = np.full(dem.shape, np.nan)
+    label = np.full(dem.shape, -1, np.int64)
+    level[outlets] = dem[outlets]
+    edge_seeded = seeded[edge]
+    level_edge = level[edge]
+    label_edge = label[edge]
+    level_edge[edge_seeded & ~outlets[edge]] = edge_level[edge_seeded & ~outlets[edge]]
+    label_edge[edge_seeded] = edge_rank[edge_seeded]
+    level[edge] = level_edge
+    label[edge] = label_edge
+    parent = np.full(dem.shape, -1, np.int8)
+    FastKernels.priority_flood(dem, level, label, parent, np.flatnonzero(seeded))
+
+    # filled levels around the tile come from the graph, since they are edge cells of other tiles
+    filled = np.full(padded.shape, np.nan)
+    filled[1:-1, 1:-1] = level
+    halo = np.ones(padded.shape, bool)
+    halo[1:-1, 1:-1] = False
+    halo &= ~np.isnan(padded)
+    halo_rows, halo_cols = np.nonzero(halo)
+    filled[halo] = graph.lookup((halo_rows + first_row - 1) * num_cols + halo_cols + first_col - 1)[0]
+
+    steepest = np.zeros(dem.shape)
+    direction = np.full(dem.shape, -1, np.int64)
+    for k in range(9):
+        if k == 4:
+            continue
+        drop = (level - neighbors(filled, k)) / DISTANCE[k]
+        steeper = drop > steepest
+        steepest[steeper] = drop[steeper]
+        direction[steeper] = k
+
+    flat = valid & (direction < 0)
+    direction[flat & ~seeded] = parent[flat & ~seeded]
+    # flat edge cells filled from another tile flow to the cell the graph reached them from
+    to_parent = np.zeros(dem.shape, bool)
+    to_parent[edge] = from_outside
+    to_parent &= flat & ~outlets
+    if np.any(to_parent):
+        edge_index = np.zeros(dem.shape, np.int64)
+        edge_index[edge] = np.arange(np.count_nonzero(edge))
+        i = edge_index[to_parent]
+        rows, cols = np.nonzero(to_parent)
+        k = (parent_row[i] - rows - first_row + 1) * 3 + (parent_col[i] - cols - first_col + 1)
+        direction[to_parent] = k
+    # flat outlets flow off the DEM
+    off_dem = flat & outlets
+    for k in [8, 7, 6, 5, 3, 2, 1, 0]:
+        leaves = off_dem & np.isnan(neighbors(padded, k))
+        direction[leaves] = k
+    return direction
+
+
+def tile_downstream(flow_dir, tile, num_rows, num_cols, codes):
+    """
+    Reads a tile of flow directions and finds where each cell flows to
+    :return: Tuple of (mask of cells with data, local flat index of the downstream cell or -1 if it is outside the
+             tile or off the DEM, global flat index of the downstream cell if it is in another tile or -1)
+    """
+    decode = np.full(256, -1, np.int64)
+    decode[codes[codes > 0]] = np.flatnonzero(codes > 0)
+    values, padded = halo_block(flow_dir.read, tile, num_rows, num_cols)
+    valid = ~np.isnan(values)
+    direction = np.full(values.shape, -1, np.int64)
+    direction[valid] = decode[values[valid].astype(np.int64)]
+    valid &= direction >= 0
+    first_row, last_row, first_col, last_col = tile
+    tile_rows, tile_cols = values.shape
+    rows, cols = np.nonzero(valid)
+    k = direction[valid]
+    target_row = rows + ROW_OFFSET[k]
+    target_col = cols + COL_OFFSET[k]
+    target_valid = ~np.isnan(padded[target_row + 1, target_col + 1])
+    in_tile = (target_row >= 0) & (target_row < tile_rows) & (target_col >= 0) & (target_col < tile_cols)
+
+    down = np.full(values.size, -1, np.int64)
+    exits = np.full(values.size, -1, np.int64)
+    index = rows * tile_cols + cols
+    down[index[in_tile & target_valid]] = (target_row * tile_cols + target_col)[in_tile & target_valid]
+    leaves = ~in_tile & target_valid
+    exits[index[leaves]] = (target_row + first_row)[leaves] * num_cols + (target_col + first_col)[leaves]
+    return valid, down, exits
+
+
+def accumulate(down, weights):
+    """
+    Adds up weights downstream, in topological order
+    :param down: Flat index of the cell each cell flows to, or -1
+    :param weights: Weight of each cell
+    :return: Tuple of (accumulated weights including each cell's own, list of arrays of cells in topological order,
+             each array only flowing to later ones)
+    """
+    total = np.array(weights, np.float64)
+    indegree = np.bincount(down[down >= 0], minlength=len(down))
+    frontier = np.flatnonzero(indegree == 0)
+    layers = []
+    processed = 0
+    while len(frontier) > 0:
+        layers.append(frontier)
+        processed += len(frontier)
+        targets = down[frontier]
+        flows = targets >= 0
+        sources = frontier[flows]
+        targets = targets[flows]
+        np.add.at(total, targets, total[sources])
+        np.subtract.at(indegree, targets, 1)
+        targets = np.unique(targets)
+        frontier = targets[indegree[targets] == 0]
+    if processed < len(down):
+        raise Exception("The flow directions go round in a loop")
+    return total, layers
+
+
+def accumulate_tiles(flow_dir, accumulation, num_rows, num_cols, tiles, codes):
+    """
+    Accumulates flow a tile at a time, passing flow between tiles through a graph of tile edge cells
+    :return:
+    """
+    # flow from each tile edge cell goes to the next edge cell downstream in the same tile, or to another tile
+    sources = []
+    targets = []
+    crosses = []
+    local_flow = []
+    for tile in tiles:
+        valid, down, exits = tile_downstream(flow_dir, tile, num_rows, num_cols, codes)
+        total, layers = accumulate(down, valid.ravel().astype(np.float64))
+        cells, edge = tile_cells(tile, num_cols)
+        edge = edge.ravel() & valid.ravel()
+        next_edge = np.full(len(down), -1, np.int64)
+        for layer in reversed(layers):
+            flows = down[layer] >= 0
+            target = down[layer][flows]
+            next_edge[layer[flows]] = np.where(edge[target], target, next_edge[target])
+        edge_cells = np.flatnonzero(edge)
+        leaves = exits[edge_cells] >= 0
+        stays = ~leaves & (next_edge[edge_cells] >= 0)
+        sources.append(cells.ravel()[edge_cells[leaves | stays]])
+        targets.append(np.where(leaves, exits[edge_cells], cells.ravel()[np.maximum(next_edge[edge_cells], 0)])
+                       [leaves | stays])
+        crosses.append(leaves[leaves | stays])
+        local_flow.append(total[edge_cells[leaves | stays]])
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    crosses, local_flow = np.concatenate(crosses), np.concatenate(local_flow)
+
+    # pass flow from other tiles along the graph: all of it carries on downstream, and when a cell flows into another
+    # tile, the flow from its own tile goes too
+    nodes, ends = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+    ends = ends.ravel()
+    source_node, target_node = ends[:len(sources)], ends[len(sources):]
+    next_node = np.full(len(nodes), -1, np.int64)
+    next_node[source_node] = target_node
+    cross = np.zeros(len(nodes), bool)
+    cross[source_node] = crosses
+    own = np.zeros(len(nodes))
+    own[source_node] = local_flow
+    passing = np.zeros(len(nodes))
+    inflow = np.zeros(len(nodes))
+    total, layers = accumulate(next_node, np.zeros(len(nodes)))
+    for layer in layers:
+        flows = next_node[layer] >= 0
+        layer = layer[flows]
+        sent = passing[layer] + np.where(cross[layer], own[layer], 0)
+        np.add.at(passing, next_node[layer], sent)
+        np.add.at(inflow, next_node[layer][cross[layer]], sent[cross[layer]])
+
+    for tile in tiles:
+        valid, down, exits = tile_downstream(flow_dir, tile, num_rows, num_cols, codes)
+        weights = valid.ravel().astype(np.float64)
+        cells, edge = tile_cells(tile, num_cols)
+        edge_cells = np.flatnonzero(edge.ravel() & valid.ravel())
+        index = np.searchsorted(nodes, cells.ravel()[edge_cells])
+        known = index < len(nodes)
+        known[known] = nodes[index[known]] == cells.ravel()[edge_cells[known]]
+        weights[edge_cells[known]] += inflow[index[known]]
+        total, layers = accumulate(down, weights)
+        upstream = np.where(valid.ravel(), total - 1, np.nan).reshape(valid.shape)
+        accumulation.write(tile[0], tile[2], upstream)
@@ -0,0 +1,215 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Cache
+# Purpose:     Keeps the FIS outputs for inputs that have been seen before on disk, so that re-runs and projects that
+#              share vegetation classes don't have to evaluate them again
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Each input is quantized to QUANTUM_FRACTION of its universe step, and the quantized inputs are the key. On a miss the
+# FIS is evaluated at the quantized inputs rather than the raw ones, so a reach gets the same output whether or not
+# its inputs were already in the cache. The shift is at most half a quantum, but near the edge of a term the output can
+# change fast enough for that to matter: at 1e-4 of the step, cached outputs of the combined FIS differed from uncached
+# batch outputs by up to 0.095 dams/km, and the difference shrinks in proportion to the quantum. At QUANTUM_FRACTION
+# the largest difference found, on inputs clustered around every membership function corner, was 1e-4 dams/km, a
+# fiftieth of BatchFIS.BATCH_TOLERANCE.
+#
+# The cache for each FIS is a .npz file in the FISCache folder next to the toolbox, named after the rule table and a
+# hash of the FIS definition and quantum, so editing the model starts a new cache instead of reusing stale outputs.
+# Every lookup stamps the entries it uses. When a cache grows past its maximum size, the entries that were used
+# least recently are dropped, and only the most recently used cache files are kept.
+
+import os
+import re
+import hashlib
+import numpy as np
+
+
+CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FISCache')
+QUANTUM_FRACTION = 1e-7  # inputs are quantized to this fraction of their universe step (see above)
+DEFAULT_MAX_ENTRIES = 2000000  # entries kept in each cache file
+MAX_CACHE_FILES = 10  # cache files kept in the folder, for different FIS definitions
+
+
+class FISCache(object):
+    """
+    An on-disk cache of FIS outputs keyed by quantized inputs, with least recently used eviction
+    """
+    def __init__(self, system, name, folder=CACHE_FOLDER, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param system: The BatchFIS.MamdaniSystem whose outputs are cached
+        :param name: Name used for the cache file, e.g. "veg_fis"
+        :param folder: Where cache files are saved
+        :param max_entries: Most entries to keep in the cache file
+        """
+        self.system = system
+        self.folder = folder
+        self.max_entries = int(max_entries)
+        self.quanta = np.array([var.universe_def[2] * QUANTUM_FRACTION for var in system.inputs])
+        self.key = cache_key(system, self.quanta)
+        self.path = os.path.join(folder, name + "_" + self.key[:12] + ".npz")
+
+        self.lookups = 0
+        self.hits = 0
+        self.evaluated = 0
+        self.clock = 0
+        num_inputs = len(system.inputs)
+        self.keys = np.zeros((0, num_inputs), dtype=np.int64)
+        self.values = np.zeros(0)
+        self.stamps = np.zeros(0, dtype=np.int64)
+        if os.path.exists(self.path):
+            try:
+                data = np.load(self.path)
+                if str(data['key']) == self.key:
+                    self.keys = data['keys']
+                    self.values = data['values']
+                    self.stamps = data['stamps']
+                    self.clock = int(data['clock'])
+            except (IOError, OSError, KeyError, ValueError):
+                pass  # an unreadable cache is started again
+        self.sorted_keys = row_view(self.keys)
+        if len(self.values) > self.max_entries:
+            self.add(self.keys[:0], self.values[:0])
+
+    def quantize(self, input_arrays):
+        """
+        :param input_arrays: List of 1d arrays, one per input
+        :return: Integer array with one row per reach
+        """
+        return np.column_stack([np.round(np.asarray(values, dtype=np.float64) / quantum).astype(np.int64)
+                                for values, quantum in zip(input_arrays, self.quanta)])
+
+    def evaluate(self, input_arrays, evaluate=None):
+        """
+        Returns the FIS output for every reach, looking up inputs in the cache and only evaluating the distinct ones
+        that aren't in it
+        :param input_arrays: List of 1d arrays, one per input
+        :param evaluate: Function that evaluates a list of input arrays, e.g. to run misses in parallel. Defaults to
+                         the system's evaluate method
+        :return: 1d array of outputs
+        """
+        if evaluate is None:
+            evaluate = self.system.evaluate
+        num_reaches = len(input_arrays[0])
+        if num_reaches == 0:
+            return np.zeros(0)
+        self.clock += 1
+
+        query, inverse = np.unique(row_view(self.quantize(input_arrays)), return_inverse=True)
+        inverse = inverse.ravel()
+        position = np.searchsorted(self.sorted_keys, query)
+        found = position < len(self.sorted_keys)
+        found[found] = self.sorted_keys[position[found]] == query[found]
+
+        out = np.empty(len(query))
+        out[found] = self.values[position[found]]
+        self.stamps[position[found]] = self.clock
+
+        missing = np.flatnonzero(~found)
+        if len(missing) > 0:
+            new_keys = row_array(query[missing], len(self.quanta))
+            out[missing] = evaluate([new_keys[:, i] * quantum for i, quantum in enumerate(self.quanta)])
+            self.add(new_keys, out[missing])
+
+        self.lookups += num_reaches
+        self.hits += int(np.sum(found[inverse]))
+        self.evaluated += len(missing)
+        return out[inverse]
+
+    def add(self, new_keys, new_values):
+        """
+        Adds entries to the cache, then drops the least recently used entries if it is too big
+        :param new_keys: Integer array of quantized inputs, one row per entry
+        :param new_values: Output for each entry
+        :return:
+        """
+        keys = np.concatenate([self.keys, new_keys])
+        values = np.concatenate([self.values, new_values])
+        stamps = np.concatenate([self.stamps, np.full(len(new_values), self.clock, dtype=np.int64)])
+        if len(values) > self.max_entries:
+            keep = np.argsort(-stamps, kind='mergesort')[:self.max_entries]
+            keys, values, stamps = keys[keep], values[keep], stamps[keep]
+
+        order = np.argsort(row_view(keys), kind='mergesort')
+        self.keys, self.values, self.stamps = keys[order], values[order], stamps[order]
+        self.sorted_keys = row_view(self.keys)
+
+    def hit_rate(self):
+        """
+        :return: The fraction of reaches looked up whose output was already in the cache
+        """
+        return float(self.hits) / self.lookups if self.lookups > 0 else 0.0
+
+    def summary(self):
+        """
+        :return: A message describing how much the cache was used, e.g. for arcpy.AddMessage
+        """
+        return (str(round(100.0 * self.hit_rate(), 1)) + "% of " + str(self.lookups) + " reaches found in the cache, " +
+                str(self.evaluated) + " new input combinations evaluated")
+
+    def save(self):
+        """
+        Writes the cache to disk, and removes the least recently used cache files if there are too many
+        :return:
+        """
+        try:
+            if not os.path.exists(self.folder):
+                os.mkdir(self.folder)
+            temp_path = self.path[:-len(".npz")] + "_temp.npz"
+            np.savez(temp_path, key=np.array(self.key), keys=self.keys, values=self.values, stamps=self.stamps,
+                     clock=np.array(self.clock))
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+
+            # only files named like the ones this class writes, <name>_<12 hex digits>.npz, are counted or removed
+            cache_files = [os.path.join(self.folder, f) for f in os.listdir(self.folder)
+                           if re.search(r"_[0-9a-f]{12}\.npz$", f)]
+            cache_files.sort(key=os.path.getmtime, reverse=True)
+            for old_file in cache_files[MAX_CACHE_FILES:]:
+                os.remove(old_file)
+        except (IOError, OSError):
+            pass  # if the toolbox folder isn't writable, the outputs are still right, they just aren't kept
+
+
+def parse_use_cache(use_cache):
+    """
+    Turns the value given to a tool into whether to use the cache
+    :param use_cache: True/False, "true"/"false" from a GPBoolean parameter, or None for False
+    :return: Boolean
+    """
+    if use_cache is None:
+        return False
+    return str(use_cache).strip().lower() not in ('', 'false', '0', 'no')
+
+
+def cache_key(system, quanta):
+    """
+    Hashes a FIS definition together with the input quanta
+    :param system: BatchFIS.MamdaniSystem
+    :param quanta: Quantum of each input
+    :return: String
+    """
+    md5 = hashlib.md5(system.fingerprint().encode('utf-8'))
+    md5.update(np.ascontiguousarray(quanta, dtype=np.float64).tobytes())
+    return md5.hexdigest()
+
+
+def row_view(rows):
+    """
+    Views each row of an integer array as a single value, so that rows can be sorted, searched and compared at once
+    :param rows: 2d integer array
+    :return: 1d array with one value per row
+    """
+    rows = np.ascontiguousarray(rows, dtype=np.int64)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def row_array(row_values, num_columns):
+    """
+    Turns values from row_view() back into an integer array
+    :param row_values: 1d array from row_view()
+    :param num_columns: Number of columns in each row
+    :return: 2d integer array
+    """
+    return np.frombuffer(np.ascontiguousarray(row_values).tobytes(), dtype=np.int64).reshape(-1, num_columns)
@@ -0,0 +1,271 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Calibration
+# Purpose:     Fits the membership function breakpoints of the vegetation or combined FIS to observed dam densities
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# The breakpoints of an input are the distinct membership function corners inside its universe. Moving a breakpoint
+# moves every corner at that value, so terms that share a corner (e.g. the end of 'persists' and the peak of 'breach')
+# stay joined, and keeping each input's breakpoints in order keeps the shape of the model.
+#
+# The search is differential evolution. Each generation's candidates are scored in a pool of worker processes, and
+# each score runs the batch FIS over every surveyed reach at once. All random numbers are drawn in the main process, so
+# a run is repeatable for a given seed whatever the number of workers.
+#
+# This module doesn't use arcpy, so worker processes start quickly and don't take a license. Calibrate_FIS.py reads the
+# network and writes the results.
+
+import multiprocessing
+import numpy as np
+import BatchFIS
+import BRATCapacity
+import FISRuleTable
+import ParallelFIS
+
+
+DEFAULT_POPULATION_SIZE = 20
+DEFAULT_GENERATIONS = 40
+DEFAULT_SEARCH_RANGE = 0.5  # breakpoints can move by up to this fraction of their starting value
+DIFFERENTIAL_WEIGHT = 0.7  # differential evolution F
+CROSSOVER_PROBABILITY = 0.9  # differential evolution CR
+
+_worker_data = {}  # set in each worker process by _init_worker()
+
+
+class BreakpointSet(object):
+    """
+    The breakpoints of some of the inputs of a FIS, as one vector of parameters
+    """
+    def __init__(self, system, input_names=None):
+        """
+        :param system: The BatchFIS.MamdaniSystem to take breakpoints from
+        :param input_names: Names of the inputs to include. Defaults to every input
+        """
+        self.system = system
+        if input_names is None:
+            input_names = [var.name for var in system.inputs]
+
+        self.input_indexes = []
+        self.groups = []  # slice of the parameter vector for each input
+        values = []
+        for name in input_names:
+            i = [var.name for var in system.inputs].index(name)
+            var = system.inputs[i]
+            corners = np.unique([p for params in var.mf_params for p in params])
+            interior = corners[(corners > var.lower) & (corners < var.upper)]
+            self.input_indexes.append(i)
+            self.groups.append(slice(len(values), len(values) + len(interior)))
+            values.extend(interior)
+        self.initial = np.array(values)
+
+    def labels(self):
+        """
+        :return: A label for each parameter, e.g. "iHyd_SP2 1200"
+        """
+        labels = []
+        for i, group in zip(self.input_indexes, self.groups):
+            labels.extend([self.system.inputs[i].name + " " + FISRuleTable.format_number(value)
+                           for value in self.initial[group]])
+        return labels
+
+    def bounds(self, search_range=DEFAULT_SEARCH_RANGE):
+        """
+        Finds how far each breakpoint can move, as a fraction of its starting value, without leaving the universe
+        :param search_range: Fraction of the starting value
+        :return: Tuple of (lower bounds, upper bounds) arrays
+        """
+        lower = self.initial * (1.0 - search_range)
+        upper = self.initial * (1.0 + search_range)
+        for i, group in zip(self.input_indexes, self.groups):
+            var = self.system.inputs[i]
+            lower[group] = np.clip(lower[group], var.lower, var.upper)
+            upper[group] = np.clip(upper[group], var.lower, var.upper)
+        return lower, upper
+
+    def repair(self, values, lower, upper):
+        """
+        Clips parameters to their bounds and puts each input's breakpoints back in order
+        :param values: Parameter vector
+        :param lower: Lower bounds
+        :param upper: Upper bounds
+        :return: Parameter vector
+        """
+        values = np.clip(values, lower, upper)
+        for group in self.groups:
+            values[group] = np.sort(values[group])
+        return values
+
+    def apply(self, values):
+        """
+        Builds a copy of the system with its breakpoints moved
+        :param values: Parameter vector
+        :return: BatchFIS.MamdaniSystem
+        """
+        inputs = list(self.system.inputs)
+        for i, group in zip(self.input_indexes, self.groups):
+            var = inputs[i]
+            moved = dict(zip(self.initial[group], values[group]))
+            terms = [(term_name, mf_type, [moved.get(p, p) for p in params])
+                     for term_name, mf_type, params in zip(var.term_names, var.mf_types, var.mf_params)]
+            inputs[i] = BatchFIS.FuzzyVariable(var.name, var.universe_def, terms)
+        return BatchFIS.MamdaniSystem(inputs, self.system.output, self.system.rules)
+
+
+class CapacityModel(object):
+    """
+    Runs reaches through the combined FIS (and optionally the vegetation FIS before it), then applies the same limits
+    as Veg_FIS and Comb_FIS (see BRATCapacity)
+    """
+    def __init__(self, comb_system, comb_inputs, drainage_area, max_DA_thresh, veg_system=None, veg_inputs=None):
+        """
+        :param comb_system: The combined FIS
+        :param comb_inputs: List of oVC, iHyd_SP2, iHyd_SPLow and iGeo_Slope arrays, already put in range as Comb_FIS
+                            does. The oVC array is ignored when vegetation inputs are given
+        :param drainage_area: Array of iGeo_DA
+        :param max_DA_thresh: Drainage area above which beaver can't build dams
+        :param veg_system: The vegetation FIS, to run it before the combined FIS
+        :param veg_inputs: List of riparian and streamside vegetation arrays, already put in range as Veg_FIS does
+        """
+        self.comb_system = comb_system
+        self.comb_inputs = [np.asarray(values, dtype=np.float64) for values in comb_inputs]
+        self.drainage_area = np.asarray(drainage_area, dtype=np.float64)
+        self.max_DA_thresh = float(max_DA_thresh)
+        self.veg_system = veg_system
+        self.veg_inputs = veg_inputs
+
+    def subset(self, reaches):
+        """
+        Makes a model of some of the reaches
+        :param reaches: Slice, boolean mask or index array selecting the reaches
+        :return: CapacityModel
+        """
+        veg_inputs = None if self.veg_inputs is None else [values[reaches] for values in self.veg_inputs]
+        return CapacityModel(self.comb_system, [values[reaches] for values in self.comb_inputs],
+                             self.drainage_area[reaches], self.max_DA_thresh, self.veg_system, veg_inputs)
+
+    def capacity(self, veg_system=None, comb_system=None):
+        """
+        Finds combined capacity (dams/km) for every reach
+        :param veg_system: Vegetation FIS to use instead of the model's own
+        :param comb_system: Combined FIS to use instead of the model's own
+        :return: 1d array
+        """
+        if veg_system is None:
+            veg_system = self.veg_system
+        if comb_system is None:
+            comb_system = self.comb_system
+
+        if veg_system is not None and self.veg_inputs is not None:
+            veg_capacity = BRATCapacity.limit_veg_capacity(veg_system.evaluate(self.veg_inputs), veg_system)
+        else:
+            veg_capacity = self.comb_inputs[0]
+        capacity = comb_system.evaluate([veg_capacity] + self.comb_inputs[1:])
+        return BRATCapacity.limit_comb_capacity(capacity, veg_capacity, self.drainage_area, self.max_DA_thresh,
+                                                comb_system)
+
+
+def rmse(predicted, observed):
+    return float(np.sqrt(np.mean((predicted - observed) ** 2)))
+
+
+def candidate_loss(model, breakpoints, calibrate_veg, observed, values):
+    """
+    Scores one set of breakpoints
+    :param model: CapacityModel for the surveyed reaches
+    :param breakpoints: BreakpointSet of the FIS being calibrated
+    :param calibrate_veg: True if the breakpoints belong to the vegetation FIS, False for the combined FIS
+    :param observed: Observed dam densities (e_DamDens) for the surveyed reaches
+    :param values: Parameter vector
+    :return: RMSE between predicted capacity and observed dam density
+    """
+    system = breakpoints.apply(values)
+    if calibrate_veg:
+        capacity = model.capacity(veg_system=system)
+    else:
+        capacity = model.capacity(comb_system=system)
+    return rmse(capacity, observed)
+
+
+def calibrate(model, breakpoints, calibrate_veg, observed, population_size=DEFAULT_POPULATION_SIZE,
+              generations=DEFAULT_GENERATIONS, search_range=DEFAULT_SEARCH_RANGE, num_workers=1, seed=0,
+              report=None):
+    """
+    Searches for the breakpoints that give the closest agreement between predicted capacity and observed dam density
+    :param model: CapacityModel for the surveyed reaches
+    :param breakpoints: BreakpointSet of the FIS being calibrated
+    :param calibrate_veg: True if the breakpoints belong to the vegetation FIS, False for the combined FIS
+    :param observed: Observed dam densities (e_DamDens) for the surveyed reaches
+    :param population_size: Number of candidates in each generation
+    :param generations: Number of generations to run
+    :param search_range: How far breakpoints can move, as a fraction of their starting value
+    :param num_workers: Number of processes to score candidates in (see ParallelFIS.resolve_num_workers)
+    :param seed: Seed for the search, so that runs are repeatable
+    :param report: Function called with a message after each generation, e.g. arcpy.AddMessage
+    :return: Tuple of (best parameter vector, its RMSE, convergence log). The log is a list of (generation, best RMSE,
+             mean RMSE, best parameter vector) tuples, starting with generation 0 for the starting population
+    """
+    rng = np.random.RandomState(seed)
+    lower, upper = breakpoints.bounds(search_range)
+    num_params = len(breakpoints.initial)
+    population_size = max(int(population_size), 4)
+
+    # the starting breakpoints are always in the first generation, so calibration can't do worse than the current model
+    population = [breakpoints.initial.copy()]
+    for k in range(population_size - 1):
+        population.append(breakpoints.repair(rng.uniform(lower, upper), lower, upper))
+    population = np.array(population)
+
+    num_workers = ParallelFIS.resolve_num_workers(num_workers)
+    pool = None
+    if num_workers > 1:
+        ParallelFIS.set_worker_executable()
+        pool = multiprocessing.Pool(num_workers, _init_worker, (model, breakpoints, calibrate_veg, observed))
+
+    def score(candidates):
+        if pool is not None:
+            return np.array(pool.map(_candidate_loss, list(candidates), chunksize=1))
+        return np.array([candidate_loss(model, breakpoints, calibrate_veg, observed, values)
+                         for values in candidates])
+
+    try:
+        losses = score(population)
+        log = [(0, float(losses.min()), float(losses.mean()), population[np.argmin(losses)].copy())]
+        for generation in range(1, int(generations) + 1):
+            trials = np.empty(population.shape)
+            for k in range(population_size):
+                a, b, c = rng.choice([j for j in range(population_size) if j != k], 3, replace=False)
+                mutant = population[a] + DIFFERENTIAL_WEIGHT * (population[b] - population[c])
+                crossover = rng.uniform(size=num_params) < CROSSOVER_PROBABILITY
+                crossover[rng.randint(num_params)] = True
+                trials[k] = breakpoints.repair(np.where(crossover, mutant, population[k]), lower, upper)
+
+            trial_losses = score(trials)
+            improved = trial_losses <= losses
+            population[improved] = trials[improved]
+            losses[improved] = trial_losses[improved]
+
+            log.append((generation, float(losses.min()), float(losses.mean()), population[np.argmin(losses)].copy()))
+            if report is not None:
+                report("Generation " + str(generation) + ": best RMSE " + str(round(losses.min(), 4)) +
+                       " dams/km, mean " + str(round(losses.mean(), 4)))
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+    best = np.argmin(losses)
+    return population[best], float(losses[best]), log
+
+
+def _init_worker(model, breakpoints, calibrate_veg, observed):
+    _worker_data['args'] = (model, breakpoints, calibrate_veg, observed)
+
+
+def _candidate_loss(values):
+    return candidate_loss(*(_worker_data['args'] + (values,)))
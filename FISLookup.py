@@ -0,0 +1,297 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Lookup
+# Purpose:     Precomputes the response surface of a BRAT fuzzy inference system on a grid, so that it can be
+#              evaluated for any number of reaches by multilinear interpolation
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Surfaces are saved as .npz files in the FISLookup folder next to the toolbox. Each file is keyed by a hash of the
+# FIS definition (membership functions, universes and rules) and the grid, so changing the model or the grid builds
+# a new surface instead of reusing a stale one.
+#
+# Near the edge of a term, where its activation approaches 0, the centroid can swing by several dams/km over a very
+# short distance, and where one rule takes over from another the surface has kinks inside a cell. When a surface is
+# built, each grid cell is checked against direct evaluation at its midpoint and at a point near the middle of each of
+# its faces, and cells that miss CHECK_MARGIN * CELL_TOLERANCE anywhere are marked so that reaches falling in them are
+# run through the FIS directly. Checking a midpoint alone misses cells whose error peaks away from the middle, and on
+# real networks let through errors of twice CELL_TOLERANCE. The margin covers the parts of each cell between the check
+# points; the error actually reached on a network is measured with compare_to_direct() each time the surface is used.
+
+import os
+import re
+import hashlib
+import numpy as np
+
+
+LOOKUP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FISLookup')
+NUM_CHECK_POINTS = 20000  # random points used to measure interpolation error when a surface is built
+DEFAULT_SUBDIVISIONS = 6  # grid cells between neighbouring membership function corners in corner_axes()
+CELL_TOLERANCE = 0.1  # largest interpolation error (dams/km) a reach should get from the surface
+CHECK_MARGIN = 0.5  # cells missing this fraction of CELL_TOLERANCE at any check point are evaluated directly
+FACE_CHECK_OFFSET = 0.15  # how far in from each face of a cell, as a fraction of its width, the face check points are
+
+
+class ResponseSurface(object):
+    """
+    A FIS output sampled on a rectilinear grid, evaluated by multilinear interpolation
+    """
+    def __init__(self, axes, values, key, max_error=None, mean_error=None, direct=None):
+        """
+        :param axes: List of increasing 1d arrays, the grid nodes along each input
+        :param values: Array of FIS outputs at every grid node, with one dimension per axis
+        :param key: The hash of the FIS definition and grid this surface was built from
+        :param max_error: The largest difference from direct evaluation found when the surface was built
+        :param mean_error: The mean difference from direct evaluation found when the surface was built
+        :param direct: Boolean array with one entry per grid cell, True for cells where interpolation isn't accurate
+                       enough and points should be evaluated directly
+        """
+        self.axes = [np.asarray(axis, dtype=np.float64) for axis in axes]
+        self.values = np.asarray(values, dtype=np.float64)
+        self.key = key
+        self.max_error = max_error
+        self.mean_error = mean_error
+        if direct is None:
+            direct = np.zeros(tuple(len(axis) - 1 for axis in self.axes), dtype=bool)
+        self.direct = np.asarray(direct, dtype=bool)
+
+    def locate(self, input_arrays):
+        """
+        Finds the grid cell holding each point and how far across the cell the point is along each axis. Inputs
+        outside the grid are clamped to its edge
+        :param input_arrays: List of 1d arrays, one per axis
+        :return: Tuple of lists (lower node index, fraction), each with one array per axis
+        """
+        lower = []
+        fractions = []
+        for axis, values in zip(self.axes, input_arrays):
+            values = np.clip(np.asarray(values, dtype=np.float64), axis[0], axis[-1])
+            i = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+            lower.append(i)
+            fractions.append((values - axis[i]) / (axis[i + 1] - axis[i]))
+        return lower, fractions
+
+    def evaluate(self, input_arrays, system=None):
+        """
+        Interpolates the surface at each reach's inputs. Where an output term's activation approaches 0 the centroid
+        can change faster than interpolation follows, so if the system is given, points in cells marked as direct are
+        evaluated with the system instead
+        :param input_arrays: List of 1d arrays, one per axis
+        :param system: The BatchFIS.MamdaniSystem the surface was built from, or None to interpolate every point
+        :return: 1d array of interpolated outputs
+        """
+        lower, fractions = self.locate(input_arrays)
+
+        # sum the weighted values at each of the 2^n corners of the cell holding each point
+        num_points = len(lower[0])
+        out = np.zeros(num_points)
+        num_dims = len(self.axes)
+        for corner in range(2 ** num_dims):
+            weight = np.ones(num_points)
+            index = []
+            for d in range(num_dims):
+                if (corner >> d) & 1:
+                    weight *= fractions[d]
+                    index.append(lower[d] + 1)
+                else:
+                    weight *= 1.0 - fractions[d]
+                    index.append(lower[d])
+            out += weight * self.values[tuple(index)]
+
+        if system is not None:
+            direct = self.direct[tuple(lower)]
+            if np.any(direct):
+                out[direct] = system.evaluate([np.asarray(values, dtype=np.float64)[direct] for values in input_arrays])
+        return out
+
+    def save(self, path):
+        arrays = {'values': self.values, 'direct': self.direct, 'key': np.array(self.key),
+                  'max_error': np.array(self.max_error), 'mean_error': np.array(self.mean_error)}
+        for d, axis in enumerate(self.axes):
+            arrays['axis' + str(d)] = axis
+        np.savez(path, **arrays)
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        axes = []
+        while 'axis' + str(len(axes)) in data.files:
+            axes.append(data['axis' + str(len(axes))])
+        direct = data['direct'] if 'direct' in data.files else None
+        return ResponseSurface(axes, data['values'], str(data['key']), float(data['max_error']),
+                               float(data['mean_error']), direct)
+
+
+def universe_axes(system, steps=None):
+    """
+    Builds grid axes that run across each input's sampled universe. The nodes are multiples of the step, so that
+    membership function corners that fall on the step land on a node
+    :param system: BatchFIS.MamdaniSystem
+    :param steps: Grid spacing for each input. Defaults to each input's universe step
+    :return: List of 1d arrays
+    """
+    axes = []
+    for i, var in enumerate(system.inputs):
+        start, stop = var.lower, var.upper
+        step = var.universe_def[2] if steps is None else steps[i]
+        nodes = np.round(np.arange(start, stop, step), 10)
+        axes.append(np.union1d(nodes, [stop]))
+    return axes
+
+
+def corner_axes(system, subdivisions=DEFAULT_SUBDIVISIONS):
+    """
+    Builds grid axes with a node at every membership function corner of each input, so that the trapezoid and
+    triangle edges are exact. Intervals between corners where some membership changes are split into
+    `subdivisions` cells; intervals where every membership is constant need no interior nodes. More subdivisions
+    give a more accurate surface at the cost of a bigger grid
+    :param system: BatchFIS.MamdaniSystem
+    :param subdivisions: Number of grid cells between neighbouring corners
+    :return: List of 1d arrays
+    """
+    axes = []
+    for var in system.inputs:
+        start, stop = var.lower, var.upper
+        corners = [start, stop]
+        for params in var.mf_params:
+            corners.extend(params)
+        corners = np.unique(np.clip(corners, start, stop))
+
+        nodes = [corners[0]]
+        memberships = var.memberships(corners)
+        for i in range(len(corners) - 1):
+            if subdivisions > 1 and not np.array_equal(memberships[i], memberships[i + 1]):
+                nodes.extend(np.linspace(corners[i], corners[i + 1], subdivisions + 1)[1:-1])
+            nodes.append(corners[i + 1])
+        axes.append(np.array(nodes))
+    return axes
+
+
+def surface_key(system, axes):
+    """
+    Hashes a FIS definition together with a grid, so that a saved surface is only reused for the same model and grid
+    :param system: BatchFIS.MamdaniSystem
+    :param axes: List of 1d arrays
+    :return: String
+    """
+    md5 = hashlib.md5(system.fingerprint().encode('utf-8'))
+    for axis in axes:
+        md5.update(np.ascontiguousarray(axis, dtype=np.float64).tobytes())
+    return md5.hexdigest()
+
+
+def cell_check_offsets(num_dims, face_offset=FACE_CHECK_OFFSET):
+    """
+    Lists where in each grid cell a surface is checked: the midpoint, and a point `face_offset` in from the middle of
+    each face
+    :param num_dims: Number of inputs
+    :param face_offset: Distance of the face points from the face, as a fraction of the cell width
+    :return: List of tuples, each the fraction of the way across the cell along every axis
+    """
+    offsets = [(0.5,) * num_dims]
+    for d in range(num_dims):
+        for fraction in [face_offset, 1.0 - face_offset]:
+            offsets.append(tuple(fraction if i == d else 0.5 for i in range(num_dims)))
+    return offsets
+
+
+def build_surface(system, axes, num_check_points=NUM_CHECK_POINTS, cell_tolerance=CELL_TOLERANCE,
+                  check_margin=CHECK_MARGIN):
+    """
+    Evaluates a FIS at every node of a grid and marks the cells that aren't interpolated to within the check margin
+    of the cell tolerance at every check point, then measures the error at random points
+    :param system: BatchFIS.MamdaniSystem
+    :param axes: List of 1d arrays, one per input
+    :param num_check_points: How many random points to check the surface against direct evaluation at
+    :param cell_tolerance: Largest error (dams/km) a reach should get from interpolation
+    :param check_margin: Fraction of the cell tolerance a check point's error must stay within for its cell to be
+                         interpolated
+    :return: ResponseSurface
+    """
+    grid = np.meshgrid(*axes, indexing='ij')
+    values = system.evaluate([g.ravel() for g in grid]).reshape(grid[0].shape)
+    surface = ResponseSurface(axes, values, surface_key(system, axes))
+
+    cell_lower = [c.ravel() for c in np.meshgrid(*[axis[:-1] for axis in axes], indexing='ij')]
+    cell_width = [w.ravel() for w in np.meshgrid(*[np.diff(axis) for axis in axes], indexing='ij')]
+    cell_error = np.zeros(len(cell_lower[0]))
+    for offset in cell_check_offsets(len(axes)):
+        points = [lower + fraction * width for lower, fraction, width in zip(cell_lower, offset, cell_width)]
+        cell_error = np.maximum(cell_error, np.abs(surface.evaluate(points) - system.evaluate(points)))
+    surface.direct = (cell_error > check_margin * cell_tolerance).reshape(surface.direct.shape)
+    surface.max_error, surface.mean_error = validate_surface(system, surface, num_check_points)
+    return surface
+
+
+def validate_surface(system, surface, num_check_points=NUM_CHECK_POINTS, seed=0):
+    """
+    Compares a surface to direct evaluation of the FIS at random points within the grid. Points are spread evenly
+    over the grid cells rather than over the input range, so that the finely gridded parts of the surface, where the
+    output actually changes, are checked as thoroughly as the flat parts
+    :param system: BatchFIS.MamdaniSystem
+    :param surface: ResponseSurface
+    :param num_check_points: How many random points to check
+    :param seed: Seed for the random points, so that reports are repeatable
+    :return: Tuple of the max and mean absolute difference
+    """
+    rng = np.random.RandomState(seed)
+    points = []
+    for axis in surface.axes:
+        cell = rng.randint(0, len(axis) - 1, num_check_points)
+        points.append(axis[cell] + rng.uniform(0, 1, num_check_points) * (axis[cell + 1] - axis[cell]))
+    error = np.abs(surface.evaluate(points, system) - system.evaluate(points))
+    return float(error.max()), float(error.mean())
+
+
+def compare_to_direct(system, surface, input_arrays, sample_size=NUM_CHECK_POINTS, seed=0):
+    """
+    Compares a surface to direct evaluation of the FIS for a random sample of actual reach inputs
+    :param system: BatchFIS.MamdaniSystem
+    :param surface: ResponseSurface
+    :param input_arrays: List of 1d arrays, one per input
+    :param sample_size: How many reaches to check
+    :param seed: Seed for choosing reaches, so that reports are repeatable
+    :return: Tuple of the max and mean absolute difference
+    """
+    num_reaches = len(input_arrays[0])
+    if num_reaches == 0:
+        return 0.0, 0.0
+    rng = np.random.RandomState(seed)
+    sample = rng.choice(num_reaches, min(sample_size, num_reaches), replace=False)
+    points = [np.asarray(values, dtype=np.float64)[sample] for values in input_arrays]
+    error = np.abs(surface.evaluate(points, system) - system.evaluate(points))
+    return float(error.max()), float(error.mean())
+
+
+def get_surface(system, name, axes=None, folder=LOOKUP_FOLDER):
+    """
+    Loads the saved surface for a FIS, or builds and saves it if there isn't one for the current definition and grid
+    :param system: BatchFIS.MamdaniSystem
+    :param name: Name used for the saved file, e.g. "veg_fis"
+    :param axes: Grid axes. Defaults to universe_axes(system)
+    :param folder: Where surfaces are saved
+    :return: ResponseSurface
+    """
+    if axes is None:
+        axes = universe_axes(system)
+    key = surface_key(system, axes)
+    path = os.path.join(folder, name + "_" + key[:12] + ".npz")
+
+    if os.path.exists(path):
+        surface = ResponseSurface.load(path)
+        if surface.key == key:
+            return surface
+
+    surface = build_surface(system, axes)
+    try:
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        # remove surfaces built from older definitions of this FIS, but not those of other rule tables whose names
+        # start with this one's, e.g. comb_fis_utah
+        for file_name in os.listdir(folder):
+            if re.match(re.escape(name) + r"_[0-9a-f]{12}\.npz$", file_name):
+                os.remove(os.path.join(folder, file_name))
+        surface.save(path)
+    except (IOError, OSError):
+        pass  # if the toolbox folder isn't writable, we still use the surface, we just rebuild it next time
+    return surface
@@ -0,0 +1,198 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Rule Table
+# Purpose:     Reads BRAT fuzzy inference system definitions from rule table files and compiles them into
+#              BatchFIS.MamdaniSystem evaluators
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# A rule table is a comma separated text file. Blank lines and lines starting with # are ignored, and the first
+# column of every other line says what the line defines:
+#
+#   variable,<name>,<input|output>,<universe start>,<universe stop>,<universe step>
+#   term,<variable name>,<term name>,<trimf|trapmf>,<corner>,<corner>,<corner>[,<corner>]
+#   rules,<input name>,...,<output name>
+#   rule,<input term>,...,<output term>
+#
+# Inputs are given to the system in the order their variable lines appear. The rules line sets which variable each
+# column of the rule lines belongs to. In a rule line, a blank cell means the rule doesn't use that input, and a term
+# starting with ~ means NOT that term. The cells that are used are AND-ed together.
+#
+# Compiled systems are cached for the life of the process, keyed by the file's path and modification time, so a table
+# is only parsed once however many times the FIS tools run, and editing the file picks up the changes.
+
+import os
+import csv
+import BatchFIS
+
+
+RULES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FISRules')
+
+try:
+    _compiled_systems  # keep the cache when the toolbox reloads this module
+except NameError:
+    _compiled_systems = {}
+
+
+def default_rule_table(name):
+    """
+    Returns the path of one of the rule tables that ship with BRAT
+    :param name: The name of the table, e.g. "veg_fis" or "comb_fis"
+    :return: String
+    """
+    return os.path.join(RULES_FOLDER, name + '.csv')
+
+
+def load_system(rule_table):
+    """
+    Returns the compiled system for a rule table, compiling it only if it hasn't been compiled since it last changed
+    :param rule_table: Path to the rule table file
+    :return: BatchFIS.MamdaniSystem
+    """
+    path = os.path.abspath(rule_table)
+    if not os.path.exists(path):
+        raise Exception("The FIS rule table " + path + " does not exist")
+    modified = os.path.getmtime(path)
+
+    cached = _compiled_systems.get(path)
+    if cached is None or cached[0] != modified:
+        cached = (modified, compile_rule_table(path))
+        _compiled_systems[path] = cached
+    return cached[1]
+
+
+def compile_rule_table(rule_table):
+    """
+    Reads a rule table and builds the system it defines
+    :param rule_table: Path to the rule table file
+    :return: BatchFIS.MamdaniSystem
+    """
+    variables = []  # (name, role, universe), in file order
+    terms = {}
+    columns = None
+    rules = []
+
+    with open(rule_table, 'r') as table_file:
+        for line_num, row in enumerate(csv.reader(table_file), 1):
+            row = [cell.strip() for cell in row]
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+            location = rule_table + ", line " + str(line_num)
+            kind = row[0].lower()
+
+            if kind == 'variable':
+                if len(row) != 6 or row[2] not in ('input', 'output'):
+                    raise Exception(location + ": variable lines need a name, input or output, and a universe start, "
+                                               "stop and step")
+                variables.append((row[1], row[2], [parse_number(v, location) for v in row[3:6]]))
+                terms[row[1]] = []
+            elif kind == 'term':
+                if row[1] not in terms:
+                    raise Exception(location + ": term for undefined variable " + row[1])
+                if row[3] not in BatchFIS.MEMBERSHIP_FUNCTIONS:
+                    raise Exception(location + ": unknown membership function " + row[3])
+                params = [parse_number(v, location) for v in row[4:] if v != '']
+                if len(params) != {'trimf': 3, 'trapmf': 4}[row[3]] or params != sorted(params):
+                    raise Exception(location + ": " + row[3] + " needs " + str({'trimf': 3, 'trapmf': 4}[row[3]]) +
+                                    " corners in increasing order")
+                terms[row[1]].append((row[2], row[3], params))
+            elif kind == 'rules':
+                columns = row[1:]
+                roles = dict((name, role) for name, role, universe in variables)
+                unknown = [name for name in columns if name not in roles]
+                if unknown:
+                    raise Exception(location + ": rules use undefined variables " + ", ".join(unknown))
+                if len(columns) < 2 or roles[columns[-1]] != 'output' or \
+                        [name for name in columns[:-1] if roles[name] != 'input']:
+                    raise Exception(location + ": the rules line should list input variables, then the output variable")
+            elif kind == 'rule':
+                if columns is None:
+                    raise Exception(location + ": rule lines must come after a rules line")
+                rules.append(parse_rule(row[1:], columns, terms, location))
+            else:
+                raise Exception(location + ": unknown line type " + row[0])
+
+    inputs = [BatchFIS.FuzzyVariable(name, universe, terms[name]) for name, role, universe in variables
+              if role == 'input']
+    outputs = [BatchFIS.FuzzyVariable(name, universe, terms[name]) for name, role, universe in variables
+               if role == 'output']
+    if len(outputs) != 1:
+        raise Exception(rule_table + ": a rule table needs exactly one output variable")
+    if len(rules) == 0:
+        raise Exception(rule_table + ": the rule table has no rules")
+    return BatchFIS.MamdaniSystem(inputs, outputs[0], rules)
+
+
+def parse_rule(cells, columns, terms, location):
+    """
+    Turns the cells of a rule line into a (antecedent, consequent) rule for BatchFIS.MamdaniSystem
+    :param cells: The cells after "rule"
+    :param columns: The variable names from the rules line
+    :param terms: Dictionary of variable name to its list of terms
+    :param location: File and line number for error messages
+    :return: Tuple of (antecedent, consequent)
+    """
+    if len(cells) != len(columns):
+        raise Exception(location + ": expected " + str(len(columns)) + " cells after rule, found " + str(len(cells)))
+
+    antecedent = []
+    consequent = None
+    for name, cell in zip(columns, cells):
+        if cell == '':
+            continue
+        is_negated = cell.startswith('~')
+        term_name = cell.lstrip('~').strip()
+        if term_name not in [term[0] for term in terms[name]]:
+            raise Exception(location + ": " + name + " has no term called " + term_name)
+        if name == columns[-1]:
+            if is_negated:
+                raise Exception(location + ": the consequent of a rule can't be negated")
+            consequent = term_name
+        else:
+            antecedent.append((name, term_name, is_negated))
+
+    if consequent is None or len(antecedent) == 0:
+        raise Exception(location + ": a rule needs at least one input term and an output term")
+    return antecedent, consequent
+
+
+def parse_number(value, location):
+    try:
+        return float(value)
+    except ValueError:
+        raise Exception(location + ": " + value + " is not a number")
+
+
+def write_rule_table(system, rule_table, description=None):
+    """
+    Writes a system out as a rule table, e.g. as a starting point for a regional variant of one of the BRAT models
+    :param system: BatchFIS.MamdaniSystem
+    :param rule_table: Path to write the rule table to
+    :param description: Optional comment written at the top of the file
+    :return:
+    """
+    with open(rule_table, 'w') as table_file:
+        if description is not None:
+            for line in description.splitlines():
+                table_file.write('# ' + line + '\n')
+            table_file.write('\n')
+
+        for var, role in [(var, 'input') for var in system.inputs] + [(system.output, 'output')]:
+            table_file.write(','.join(['variable', var.name, role] + [format_number(v) for v in var.universe_def]) +
+                             '\n')
+            for term_name, mf_type, params in zip(var.term_names, var.mf_types, var.mf_params):
+                table_file.write(','.join(['term', var.name, term_name, mf_type] +
+                                          [format_number(p) for p in params]) + '\n')
+            table_file.write('\n')
+
+        columns = [var.name for var in system.inputs] + [system.output.name]
+        table_file.write(','.join(['rules'] + columns) + '\n')
+        for antecedent, consequent in system.rules:
+            cells = [''] * len(system.inputs)
+            for input_name, term_name, is_negated in antecedent:
+                cells[columns.index(input_name)] = ('~' if is_negated else '') + term_name
+            table_file.write(','.join(['rule'] + cells + [consequent]) + '\n')
+
+
+def format_number(value):
+    return str(int(value)) if float(value) == int(value) else repr(float(value))
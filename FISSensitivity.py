@@ -0,0 +1,285 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Sensitivity
+# Purpose:     Measures how sensitive combined capacity is to each membership function breakpoint of the FIS
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Breakpoints (see FISCalibration.BreakpointSet) are perturbed together across a Latin hypercube of samples, and
+# every sample runs the batch FIS over all the reaches at once. Rather than keeping every sample's output, each reach
+# keeps running sums: the total and sum of squares of its capacity, and for each breakpoint the sum of its capacity
+# within each of a few bins of that breakpoint's values. These give each reach's mean and variance, and first-order
+# (Sobol) indices from the variance of the bin means. Memory only depends on the number of reaches in a chunk, not on
+# the number of samples.
+#
+# The variance of the bin means is inflated by the sampling noise of each mean. The noise is taken off each reach's
+# between-bin variance, which can leave it below 0 for a reach where the breakpoint has little effect. These values
+# are summed over the network as they are, and only the indices are clipped to [0, 1], since clipping each reach
+# first would only ever push the network's indices up.
+#
+# The first-order indices are only meaningful if every breakpoint is sampled independently of the others. Sorting a
+# sample's breakpoints back into order where their ranges overlap would swap values between them, so instead each
+# breakpoint's range is cut off halfway to its neighbours (see sample_bounds()). An input's breakpoints then stay in
+# order whatever values they take, and each column of the samples is always the breakpoint it is labelled with.
+#
+# A reach whose inputs all sit where every membership is flat, whichever sampled values the breakpoints take, gets the
+# same capacity from every sample, so only the reaches that can change are run through the samples.
+#
+# Reaches are split into chunks that can be handed to a pool of worker processes. All samples are drawn in the main
+# process before any chunk is run, so the result is the same whatever the number of workers.
+
+import multiprocessing
+import numpy as np
+import ParallelFIS
+
+
+DEFAULT_NUM_SAMPLES = 1000
+DEFAULT_PERTURBATION = 0.2  # breakpoints are perturbed by up to this fraction of their starting value
+DEFAULT_NUM_BINS = 10  # bins of each breakpoint's sampled values used to estimate first-order indices
+MIN_BIN_SAMPLES = 10  # fewer bins are used for small numbers of samples, so that each bin mean is meaningful
+DEFAULT_CHUNK_SIZE = 20000  # reaches run through every sample at a time
+INDEX_SUM_TOLERANCE = 0.05  # sampling noise allowed in the sum of the network's first-order indices above 1
+
+_worker_data = {}  # set in each worker process by _init_worker()
+
+
+def sample_bounds(breakpoints, perturbation=DEFAULT_PERTURBATION):
+    """
+    Finds the range each breakpoint is sampled over: up to perturbation of its starting value, but no further than
+    halfway to the neighbouring breakpoints of the same input, so the ranges of an input's breakpoints don't overlap
+    :param breakpoints: FISCalibration.BreakpointSet
+    :param perturbation: How far breakpoints can move, as a fraction of their starting value
+    :return: Tuple of (lower bounds, upper bounds) arrays
+    """
+    lower, upper = breakpoints.bounds(perturbation)
+    for group in breakpoints.groups:
+        initial = breakpoints.initial[group]
+        halfway = (initial[:-1] + initial[1:]) / 2.0
+        lower[group][1:] = np.maximum(lower[group][1:], halfway)
+        upper[group][:-1] = np.minimum(upper[group][:-1], halfway)
+    return lower, upper
+
+
+def sample_breakpoints(breakpoints, num_samples=DEFAULT_NUM_SAMPLES, perturbation=DEFAULT_PERTURBATION, seed=0):
+    """
+    Draws a Latin hypercube of breakpoint values, so that each breakpoint's range is evenly covered whatever the
+    number of samples, and every breakpoint is sampled independently of the others
+    :param breakpoints: FISCalibration.BreakpointSet
+    :param num_samples: Number of samples
+    :param perturbation: How far breakpoints can move, as a fraction of their starting value
+    :param seed: Seed for the samples, so that runs are repeatable
+    :return: Array with one row of parameters per sample
+    """
+    rng = np.random.RandomState(seed)
+    lower, upper = sample_bounds(breakpoints, perturbation)
+    num_params = len(breakpoints.initial)
+    strata = np.column_stack([rng.permutation(num_samples) for j in range(num_params)])
+    samples = lower + (strata + rng.uniform(size=(num_samples, num_params))) / num_samples * (upper - lower)
+    for group in breakpoints.groups:
+        if np.any(np.diff(samples[:, group], axis=1) < 0):
+            raise Exception("Sampled breakpoints are out of order, so they would have to be sorted, and wouldn't be "
+                            "sampled independently")
+    return samples
+
+
+def sample_bins(samples, num_bins=DEFAULT_NUM_BINS):
+    """
+    Splits each breakpoint's sampled values into bins holding equal numbers of samples
+    :param samples: Array with one row of parameters per sample
+    :param num_bins: Number of bins for each breakpoint
+    :return: Integer array the same shape as samples, giving the bin each sampled value falls in
+    """
+    num_samples = samples.shape[0]
+    ranks = np.argsort(np.argsort(samples, axis=0, kind='mergesort'), axis=0, kind='mergesort')
+    return ranks * num_bins // num_samples
+
+
+def reach_sensitivity(model, breakpoints, samples, bins, num_bins=DEFAULT_NUM_BINS):
+    """
+    Runs every sample of breakpoints over a set of reaches and finds the variance of each reach's capacity and the
+    first-order index of each breakpoint for each reach
+    :param model: FISCalibration.CapacityModel for the reaches
+    :param breakpoints: FISCalibration.BreakpointSet of the combined FIS
+    :param samples: Array with one row of parameters per sample, from sample_breakpoints()
+    :param bins: The bin of each sampled value, from sample_bins()
+    :param num_bins: Number of bins for each breakpoint
+    :return: Tuple of (mean capacity, capacity variance, explained variance). The explained variance is the variance
+             of capacity between the bins of each breakpoint, less sampling noise, with one row per breakpoint and one
+             column per reach. It isn't clipped, so it can be a little below 0 or above the reach's variance
+    """
+    num_samples, num_params = samples.shape
+    baseline = model.capacity()
+    mean = baseline.copy()
+    variance = np.zeros(len(baseline))
+    explained = np.zeros((num_params, len(baseline)))
+    varies = varying_reaches(model, breakpoints, samples)
+    if not np.any(varies):
+        return mean, variance, explained
+    model = model.subset(varies)
+    baseline = baseline[varies]  # sums are taken relative to the unperturbed model, so they don't lose precision
+
+    total = np.zeros(len(baseline))
+    total_squares = np.zeros(len(baseline))
+    bin_sums = np.zeros((num_params, num_bins, len(baseline)))
+    params = np.arange(num_params)
+
+    for s in range(num_samples):
+        change = model.capacity(comb_system=breakpoints.apply(samples[s])) - baseline
+        total += change
+        total_squares += change * change
+        bin_sums[params, bins[s]] += change
+
+    mean_change = total / num_samples
+    reach_variance = np.maximum(total_squares / num_samples - mean_change ** 2, 0.0)
+
+    # the variance of the bin means is inflated by the sampling noise of each mean, which is (num_bins - 1) /
+    # num_samples of the variance left within the bins
+    counts = np.array([np.bincount(bins[:, j], minlength=num_bins) for j in range(num_params)], dtype=np.float64)
+    bin_means = bin_sums / np.maximum(counts, 1)[:, :, np.newaxis]
+    between = np.sum(counts[:, :, np.newaxis] / num_samples * (bin_means - mean_change) ** 2, axis=1)
+    noise = (num_bins - 1.0) / num_samples
+    explained[:, varies] = (between - noise * reach_variance) / (1.0 - noise)
+    mean[varies] = baseline + mean_change
+    variance[varies] = reach_variance
+    return mean, variance, explained
+
+
+def varying_reaches(model, breakpoints, samples):
+    """
+    Finds the reaches whose capacity can change between samples. Membership functions are linear between
+    neighbouring breakpoints, so an input is only affected if it falls within the sampled range of one of its
+    breakpoints, or between two breakpoints where some membership changes
+    :param model: FISCalibration.CapacityModel for the reaches
+    :param breakpoints: FISCalibration.BreakpointSet of the combined FIS
+    :param samples: Array with one row of parameters per sample
+    :return: Boolean array, True for reaches that can change
+    """
+    low = samples.min(axis=0)
+    high = samples.max(axis=0)
+    varies = np.zeros(len(model.drainage_area), dtype=bool)
+    for i, group in zip(breakpoints.input_indexes, breakpoints.groups):
+        var = breakpoints.system.inputs[i]
+        values = var.clamp(model.comb_inputs[i])
+        # the ends of the universe don't move, but memberships can still change between them and the outer breakpoints
+        corners = np.concatenate([[var.lower], breakpoints.initial[group], [var.upper]])
+        group_low = np.concatenate([[var.lower], low[group], [var.upper]])
+        group_high = np.concatenate([[var.lower], high[group], [var.upper]])
+        memberships = var.memberships(corners)
+        for j in range(len(corners)):
+            varies |= (values >= group_low[j]) & (values <= group_high[j])
+            if j + 1 < len(corners) and not np.array_equal(memberships[j], memberships[j + 1]):
+                varies |= (values > group_high[j]) & (values < group_low[j + 1])
+    return varies
+
+
+def sensitivity(model, breakpoints, num_samples=DEFAULT_NUM_SAMPLES, perturbation=DEFAULT_PERTURBATION,
+                num_bins=DEFAULT_NUM_BINS, num_workers=1, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, report=None):
+    """
+    Finds how much each reach's combined capacity varies when the breakpoints are perturbed, and how much of that
+    variance each breakpoint causes on its own
+    :param model: FISCalibration.CapacityModel for the network
+    :param breakpoints: FISCalibration.BreakpointSet of the combined FIS
+    :param num_samples: Number of perturbed models to run
+    :param perturbation: How far breakpoints can move, as a fraction of their starting value
+    :param num_bins: Number of bins for each breakpoint used to estimate first-order indices
+    :param num_workers: Number of processes to run chunks of reaches in (see ParallelFIS.resolve_num_workers)
+    :param seed: Seed for the samples, so that runs are repeatable
+    :param chunk_size: Largest number of reaches to run through every sample at a time
+    :param report: Function called with a message after each chunk, e.g. arcpy.AddMessage
+    :return: Tuple of (mean capacity, capacity variance, explained variance), as returned by reach_sensitivity()
+    """
+    samples = sample_breakpoints(breakpoints, num_samples, perturbation, seed)
+    num_bins = max(2, min(num_bins, num_samples // MIN_BIN_SAMPLES))
+    bins = sample_bins(samples, num_bins)
+    num_reaches = len(model.drainage_area)
+    num_params = samples.shape[1]
+    num_workers = ParallelFIS.resolve_num_workers(num_workers)
+
+    # give every worker at least one chunk
+    chunk_size = max(1, min(chunk_size, -(-num_reaches // num_workers)))
+    chunks = [(start, min(start + chunk_size, num_reaches)) for start in range(0, num_reaches, chunk_size)]
+    num_workers = min(num_workers, len(chunks))
+
+    shared_output = multiprocessing.RawArray('d', (num_params + 2) * num_reaches) if num_workers > 1 else \
+        np.zeros((num_params + 2) * num_reaches)
+    output = ParallelFIS.shared_array(shared_output, (num_params + 2, num_reaches))
+    args = (model, breakpoints, samples, bins, num_bins, shared_output)
+
+    if num_workers > 1:
+        ParallelFIS.set_worker_executable()
+        pool = multiprocessing.Pool(num_workers, _init_worker, args)
+        try:
+            for done, stop in enumerate(pool.imap_unordered(_sensitivity_chunk, chunks), 1):
+                _report_progress(report, done, chunks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        _init_worker(*args)
+        for done, chunk in enumerate(chunks, 1):
+            _sensitivity_chunk(chunk)
+            _report_progress(report, done, chunks)
+
+    return output[0].copy(), output[1].copy(), output[2:].copy()
+
+
+def reach_indices(variance, explained):
+    """
+    Finds the first-order index of each breakpoint for each reach: the share of the reach's variance the breakpoint
+    causes on its own
+    :param variance: Capacity variance of each reach
+    :param explained: Explained variance, with one row per breakpoint and one column per reach
+    :return: First-order indices, with one row per breakpoint and one column per reach
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(variance > 0, np.clip(explained / variance, 0.0, 1.0), 0.0)
+
+
+def network_indices(variance, explained):
+    """
+    Finds one index per breakpoint for the whole network, the share of the network's total variance the breakpoint
+    causes on its own. The explained variance of every reach is summed before it is divided by the total, so the
+    sampling noise taken off each reach averages out rather than being clipped away
+    :param variance: Capacity variance of each reach
+    :param explained: Explained variance, with one row per breakpoint and one column per reach
+    :return: 1d array with one index per breakpoint
+    """
+    total_variance = np.sum(variance)
+    if total_variance == 0:
+        return np.zeros(explained.shape[0])
+    return np.clip(np.sum(explained, axis=1) / total_variance, 0.0, 1.0)
+
+
+def index_sum_ok(indices, tolerance=INDEX_SUM_TOLERANCE):
+    """
+    Checks that first-order indices sum to 1 or less, as they must when the breakpoints are sampled independently
+    :param indices: First-order index of each breakpoint for the whole network, from network_indices()
+    :param tolerance: How far above 1 the sum can be from sampling noise
+    :return: True if the sum is within the tolerance
+    """
+    return float(np.sum(indices)) <= 1.0 + tolerance
+
+
+def _report_progress(report, done, chunks):
+    if report is not None:
+        report("Finished " + str(done) + " of " + str(len(chunks)) + " chunks of reaches")
+
+
+def _init_worker(model, breakpoints, samples, bins, num_bins, shared_output):
+    _worker_data['args'] = (model, breakpoints, samples, bins, num_bins)
+    _worker_data['output'] = ParallelFIS.shared_array(shared_output, (samples.shape[1] + 2, len(model.drainage_area)))
+
+
+def _sensitivity_chunk(bounds):
+    start, stop = bounds
+    model, breakpoints, samples, bins, num_bins = _worker_data['args']
+    mean, variance, explained = reach_sensitivity(model.subset(slice(start, stop)), breakpoints, samples, bins,
+                                                  num_bins)
+    output = _worker_data['output']
+    output[0, start:stop] = mean
+    output[1, start:stop] = variance
+    output[2:, start:stop] = explained
+    return stop
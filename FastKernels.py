@@ -0,0 +1,499 @@
+# -------------------------------------------------------------------------------
+# Name:        Fast Kernels
+# Purpose:     Compiled versions of the per-element loops in the FIS, conflict potential, BDSWEA and D8 flow code, with
+#              NumPy and plain Python fallbacks for when Numba isn't installed
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Numba is optional. When it can be imported, the kernels below are compiled the first time they are called (and the
+# compiled code is cached next to this file), and BatchFIS, Conflict_Potential, bdws and D8Flow use them. When it
+# can't, the same functions fall back to NumPy, or run as plain Python for the kernels that can't be written as array
+# operations.
+# The kernels give the same results either way, except that the compiled centroid adds up its pieces in a different
+# order from NumPy, so it can differ in the last few bits.
+#
+# Running this file prints a benchmark of each kernel with and without Numba.
+
+import sys
+import time
+import numpy as np
+
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    numba = None
+    HAVE_NUMBA = False
+
+USE_NUMBA = HAVE_NUMBA  # set to False to run the fallbacks even when Numba is installed
+NO_DATA = -9999.0
+
+
+def jit(function):
+    """
+    Compiles a function with Numba if it is installed, and otherwise leaves it as it is
+    :param function: A function written with loops over NumPy arrays and scalars
+    :return: The compiled function, or the function itself
+    """
+    if HAVE_NUMBA:
+        return numba.njit(cache=True)(function)
+    return function
+
+
+def python_function(function):
+    """
+    :param function: A function decorated with jit()
+    :return: The function before it was compiled
+    """
+    return getattr(function, 'py_func', function)
+
+
+def centroid(activation, corners, slopes, intercepts, breakpoints, lower, upper, gauss_points):
+    """
+    Exact centroid of the clipped and aggregated output terms of a Mamdani FIS, for every reach. This is the compiled
+    version of BatchFIS.MamdaniSystem.defuzzify, which should be used instead when Numba isn't installed
+    :param activation: Array of shape (number of reaches, number of output terms)
+    :param corners: Array of trapezoid corners of the output terms, shape (number of terms, 4)
+    :param slopes: Slope of each sloped term edge (see BatchFIS.output_geometry)
+    :param intercepts: Intercept of each sloped term edge
+    :param breakpoints: Breakpoints of the aggregate that don't depend on the activations
+    :param lower: First output universe sample
+    :param upper: Last output universe sample
+    :param gauss_points: Quadrature nodes on [0, 1] used on each piece of the aggregate
+    :return: 1d array of crisp outputs. Reaches where no rule fires get 0
+    """
+    return _centroid(np.ascontiguousarray(activation, dtype=np.float64), np.asarray(corners, dtype=np.float64),
+                     np.asarray(slopes, dtype=np.float64), np.asarray(intercepts, dtype=np.float64),
+                     np.asarray(breakpoints, dtype=np.float64), float(lower), float(upper),
+                     np.asarray(gauss_points, dtype=np.float64))
+
+
+@jit
+def _centroid(activation, corners, slopes, intercepts, breakpoints, lower, upper, gauss_points):
+    num_reaches, num_terms = activation.shape
+    num_edges = len(slopes)
+    num_breakpoints = len(breakpoints)
+    x = np.empty(num_breakpoints + num_terms * num_edges)
+    out = np.zeros(num_reaches)
+    for r in range(num_reaches):
+        x[:num_breakpoints] = breakpoints
+        k = num_breakpoints
+        for t in range(num_terms):
+            for e in range(num_edges):
+                crossing = (activation[r, t] - intercepts[e]) / slopes[e]
+                x[k] = min(max(crossing, lower), upper)
+                k += 1
+        x.sort()
+
+        area = 0.0
+        moment = 0.0
+        for p in range(len(x) - 1):
+            width = x[p + 1] - x[p]
+            for g in range(len(gauss_points)):
+                xq = x[p] + gauss_points[g] * width
+                aggregated = 0.0
+                for t in range(num_terms):
+                    a = corners[t, 0]
+                    b = corners[t, 1]
+                    c = corners[t, 2]
+                    d = corners[t, 3]
+                    membership = 0.0
+                    if b <= xq <= c:
+                        membership = 1.0
+                    elif a != b and a < xq < b:
+                        membership = (xq - a) / (b - a)
+                    elif c != d and c < xq < d:
+                        membership = (d - xq) / (d - c)
+                    aggregated = max(aggregated, min(activation[r, t], membership))
+                yq = aggregated * width / 2.0
+                area += yq
+                moment += xq * yq
+        if area > 0:
+            out[r] = moment / area
+    return out
+
+
+def conflict_score(values, low, high, slope, intercept):
+    """
+    Scores conflict potential from a distance: 0.99 from 0 to low, falling along a line to 0.01 at high, and 0.01
+    beyond high or for negative and missing distances
+    :param values: Array of distances
+    :param low: Distance below which conflict potential is highest
+    :param high: Distance above which conflict potential is lowest
+    :param slope: Slope of the line between low and high (see Conflict_Potential.slopeInt)
+    :param intercept: Intercept of the line between low and high
+    :return: Array of scores
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if USE_NUMBA:
+        return _conflict_score(values, float(low), float(high), float(slope), float(intercept))
+    scores = np.full(values.shape, 0.01)
+    near = (values >= 0) & (values <= low)
+    scores[near] = 0.99
+    between = (values > low) & (values <= high)
+    scores[between] = slope * values[between] + intercept
+    return scores
+
+
+@jit
+def _conflict_score(values, low, high, slope, intercept):
+    scores = np.empty(values.shape)
+    for i in range(len(values)):
+        if 0 <= values[i] <= low:
+            scores[i] = 0.99
+        elif low < values[i] <= high:
+            scores[i] = slope * values[i] + intercept
+        else:
+            scores[i] = 0.01
+    return scores
+
+
+def land_use_score(values):
+    """
+    Scores conflict potential from land use intensity
+    :param values: Array of land use intensities (iPC_LU)
+    :return: Array of scores
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if USE_NUMBA:
+        return _land_use_score(values)
+    scores = np.full(values.shape, 0.01)
+    scores[(values > 0) & (values < 0.33)] = 0.25
+    scores[(values >= 0.33) & (values < 0.66)] = 0.5
+    scores[(values >= 0.66) & (values < 1.0)] = 0.75
+    scores[values >= 1.0] = 0.99
+    return scores
+
+
+@jit
+def _land_use_score(values):
+    scores = np.empty(values.shape)
+    for i in range(len(values)):
+        if values[i] >= 1.0:
+            scores[i] = 0.99
+        elif values[i] >= 0.66:
+            scores[i] = 0.75
+        elif values[i] >= 0.33:
+            scores[i] = 0.5
+        elif values[i] > 0:
+            scores[i] = 0.25
+        else:
+            scores[i] = 0.01
+    return scores
+
+
+def backward_hand(dem, fdir, ht_out, id_out, start_x, start_y, start_e, pond_id, flow_dir, row_offset, col_offset,
+                  max_height, max_count, count=0):
+    """
+    Finds every cell that drains to a dam and its height above the dam, filling in ht_out and id_out. This follows
+    the same cells in the same order as the recursive BDSWEA.backwardHAND, but keeps its own stack, so it isn't
+    limited by Python's recursion depth
+    :param dem: 2d DEM array
+    :param fdir: 2d flow direction array
+    :param ht_out: 2d array of heights above dams, NO_DATA where not yet found. Updated in place
+    :param id_out: 2d array of pond IDs. Updated in place
+    :param start_x: Column of the dam
+    :param start_y: Row of the dam
+    :param start_e: DEM elevation at the dam
+    :param pond_id: ID of the dam
+    :param flow_dir: Flow direction values of the nine cells of a 3x3 window, pointing away from the center
+    :param row_offset: Row offset of each cell of a 3x3 window
+    :param col_offset: Column offset of each cell of a 3x3 window
+    :param max_height: Highest a cell can be above the dam
+    :param max_count: Most cells that can be added to a pond
+    :param count: Number of cells already added to the pond
+    :return: Number of cells added to the pond, including count
+    """
+    num_rows, num_cols = dem.shape
+    stack = np.empty((int(min(max_count, num_rows * num_cols)) + 2, 3), dtype=np.int64)
+    kernel = _backward_hand if USE_NUMBA else python_function(_backward_hand)
+    return kernel(dem, fdir, ht_out, id_out, start_x, start_y, start_e, pond_id, flow_dir, row_offset, col_offset,
+                  max_height, max_count, count, stack)
+
+
+@jit
+def _backward_hand(dem, fdir, ht_out, id_out, start_x, start_y, start_e, pond_id, flow_dir, row_offset, col_offset,
+                   max_height, max_count, count, stack):
+    num_rows, num_cols = dem.shape
+    if not (0 < start_x < num_cols - 1 and 0 < start_y < num_rows - 1):
+        return count
+    # each frame is the cell being visited and the next of its neighbours to look at
+    stack[0, 0] = start_x
+    stack[0, 1] = start_y
+    stack[0, 2] = 0
+    depth = 1
+    while depth > 0:
+        x = stack[depth - 1, 0]
+        y = stack[depth - 1, 1]
+        i = stack[depth - 1, 2]
+        if i == 9:
+            depth -= 1
+            continue
+        stack[depth - 1, 2] = i + 1
+        if i == 4:
+            continue
+        new_x = x + col_offset[i]
+        new_y = y + row_offset[i]
+        ht_above = dem[new_y, new_x] - start_e
+        # a neighbour drains to the center when it points the opposite way from the center to it
+        if fdir[new_y, new_x] == flow_dir[8 - i] and -10.0 < ht_above < max_height and count < max_count:
+            ht_old = ht_out[new_y, new_x]
+            if ht_old >= ht_above or ht_old == -9999.0:
+                id_out[new_y, new_x] = pond_id
+                ht_out[new_y, new_x] = ht_above
+                count += 1
+                if 0 < new_x < num_cols - 1 and 0 < new_y < num_rows - 1:
+                    stack[depth, 0] = new_x
+                    stack[depth, 1] = new_y
+                    stack[depth, 2] = 0
+                    depth += 1
+    return count
+
+
+def height_above_dams(dem, fdir, dam_id, ht_out, id_out, flow_dir, row_offset, col_offset, max_height, max_count):
+    """
+    Runs backward_hand() from every dam cell, in the same order as BDSWEA.heightAboveDams
+    :param dem: 2d DEM array
+    :param fdir: 2d flow direction array
+    :param dam_id: 2d array of dam IDs, 0 or more at dam cells
+    :param ht_out: 2d array of heights above dams. Updated in place
+    :param id_out: 2d array of pond IDs. Updated in place
+    :param flow_dir: Flow direction values of the nine cells of a 3x3 window, pointing away from the center
+    :param row_offset: Row offset of each cell of a 3x3 window
+    :param col_offset: Column offset of each cell of a 3x3 window
+    :param max_height: Highest a cell can be above its dam
+    :param max_count: Most cells that can be added to each pond
+    :return:
+    """
+    num_rows, num_cols = dem.shape
+    stack = np.empty((int(min(max_count, num_rows * num_cols)) + 2, 3), dtype=np.int64)
+    if USE_NUMBA:
+        _height_above_dams(dem, fdir, dam_id, ht_out, id_out, flow_dir, row_offset, col_offset, max_height, max_count,
+                           stack)
+        return
+    backward = python_function(_backward_hand)
+    for i, j in zip(*np.nonzero(dam_id[1:, 1:] >= 0)):
+        backward(dem, fdir, ht_out, id_out, j + 1, i + 1, dem[i + 1, j + 1], dam_id[i + 1, j + 1], flow_dir, row_offset,
+                 col_offset, max_height, max_count, 0, stack)
+
+
+@jit
+def _height_above_dams(dem, fdir, dam_id, ht_out, id_out, flow_dir, row_offset, col_offset, max_height, max_count,
+                       stack):
+    num_rows, num_cols = dem.shape
+    for i in range(1, num_rows):
+        for j in range(1, num_cols):
+            if dam_id[i, j] >= 0:
+                _backward_hand(dem, fdir, ht_out, id_out, j, i, dem[i, j], dam_id[i, j], flow_dir, row_offset,
+                               col_offset, max_height, max_count, 0, stack)
+
+
+def priority_flood(dem, level, label, parent, seeds):
+    """
+    Floods a DEM inwards from seed cells, always spreading from the lowest cell reached so far, which raises every
+    cell to the lowest level water can drain out of it at (Barnes et al. 2014, with the queue for flooded pits)
+    :param dem: 2d float64 array, with NaN for NoData. NoData cells aren't flooded
+    :param level: 2d float64 array with the levels of the seeds set. Filled in with the level of every cell reached
+    :param label: 2d int64 array with a label for each seed. Every cell reached gets the label of the cell it was
+                  reached from, and among cells at the same level, those with lower labels are spread from first
+    :param parent: 2d int8 array. Every cell reached gets the index (0-8, see D8Flow.ROW_OFFSET) of the neighbor it
+                   was reached from
+    :param seeds: 1d int64 array of flat indexes of the seed cells
+    :return: Number of cells reached, including the seeds
+    """
+    num_cells = dem.size
+    heap_level = np.empty(num_cells)
+    heap_label = np.empty(num_cells, dtype=np.int64)
+    heap_order = np.empty(num_cells, dtype=np.int64)
+    heap_cell = np.empty(num_cells, dtype=np.int64)
+    pit = np.empty(num_cells, dtype=np.int64)
+    closed = np.zeros(dem.shape, dtype=np.bool_)
+    kernel = _priority_flood if USE_NUMBA else python_function(_priority_flood)
+    return kernel(dem, level, label, parent, np.asarray(seeds, dtype=np.int64), closed, heap_level, heap_label,
+                  heap_order, heap_cell, pit)
+
+
+@jit
+def _heap_less(heap_level, heap_label, heap_order, i, j):
+    if heap_level[i] != heap_level[j]:
+        return heap_level[i] < heap_level[j]
+    if heap_label[i] != heap_label[j]:
+        return heap_label[i] < heap_label[j]
+    return heap_order[i] < heap_order[j]
+
+
+@jit
+def _heap_swap(heap_level, heap_label, heap_order, heap_cell, i, j):
+    heap_level[i], heap_level[j] = heap_level[j], heap_level[i]
+    heap_label[i], heap_label[j] = heap_label[j], heap_label[i]
+    heap_order[i], heap_order[j] = heap_order[j], heap_order[i]
+    heap_cell[i], heap_cell[j] = heap_cell[j], heap_cell[i]
+
+
+@jit
+def _priority_flood(dem, level, label, parent, seeds, closed, heap_level, heap_label, heap_order, heap_cell, pit):
+    num_rows, num_cols = dem.shape
+    row_offset = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+    col_offset = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+    size = 0
+    pushed = 0
+    for cell in seeds:
+        r = cell // num_cols
+        c = cell % num_cols
+        closed[r, c] = True
+        # push onto the heap, then sift up
+        heap_level[size] = level[r, c]
+        heap_label[size] = label[r, c]
+        heap_order[size] = pushed
+        heap_cell[size] = cell
+        i = size
+        size += 1
+        pushed += 1
+        while i > 0 and _heap_less(heap_level, heap_label, heap_order, i, (i - 1) // 2):
+            _heap_swap(heap_level, heap_label, heap_order, heap_cell, i, (i - 1) // 2)
+            i = (i - 1) // 2
+
+    pit_start = 0
+    pit_end = 0
+    reached = len(seeds)
+    while size > 0 or pit_end > pit_start:
+        if pit_end > pit_start:
+            cell = pit[pit_start]
+            pit_start += 1
+        else:
+            cell = heap_cell[0]
+            # move the last entry to the top, then sift down
+            size -= 1
+            _heap_swap(heap_level, heap_label, heap_order, heap_cell, 0, size)
+            i = 0
+            while True:
+                smallest = i
+                left = 2 * i + 1
+                if left < size and _heap_less(heap_level, heap_label, heap_order, left, smallest):
+                    smallest = left
+                if left + 1 < size and _heap_less(heap_level, heap_label, heap_order, left + 1, smallest):
+                    smallest = left + 1
+                if smallest == i:
+                    break
+                _heap_swap(heap_level, heap_label, heap_order, heap_cell, i, smallest)
+                i = smallest
+        r = cell // num_cols
+        c = cell % num_cols
+        for k in range(9):
+            if k == 4:
+                continue
+            nr = r + row_offset[k]
+            nc = c + col_offset[k]
+            if nr < 0 or nr >= num_rows or nc < 0 or nc >= num_cols or closed[nr, nc] or np.isnan(dem[nr, nc]):
+                continue
+            closed[nr, nc] = True
+            label[nr, nc] = label[r, c]
+            parent[nr, nc] = 8 - k
+            reached += 1
+            if dem[nr, nc] <= level[r, c]:
+                # flooded up to this cell's level, so it is spread from next, before anything on the heap
+                level[nr, nc] = level[r, c]
+                pit[pit_end] = nr * num_cols + nc
+                pit_end += 1
+            else:
+                level[nr, nc] = dem[nr, nc]
+                heap_level[size] = level[nr, nc]
+                heap_label[size] = label[nr, nc]
+                heap_order[size] = pushed
+                heap_cell[size] = nr * num_cols + nc
+                i = size
+                size += 1
+                pushed += 1
+                while i > 0 and _heap_less(heap_level, heap_label, heap_order, i, (i - 1) // 2):
+                    _heap_swap(heap_level, heap_label, heap_order, heap_cell, i, (i - 1) // 2)
+                    i = (i - 1) // 2
+    return reached
+
+
+def benchmark(num_reaches=100000, raster_size=400, repeat=3):
+    """
+    Times each kernel with Numba and with its fallback, and checks that they agree
+    :param num_reaches: Number of reaches for the FIS and conflict kernels
+    :param raster_size: Number of rows and columns in the synthetic DEM for the BDSWEA and priority flood kernels
+    :param repeat: Number of runs of each kernel; the fastest is reported
+    :return: List of (kernel name, fallback seconds, Numba seconds, largest difference) tuples
+    """
+    global USE_NUMBA
+    import BatchFIS
+    import FISRuleTable
+
+    rng = np.random.RandomState(0)
+    comb_system = FISRuleTable.load_system(FISRuleTable.default_rule_table('comb_fis'))
+    comb_inputs = [rng.uniform(var.lower, var.upper, num_reaches) for var in comb_system.inputs]
+    activation = comb_system.sparse_activations(comb_system.input_memberships(comb_inputs))
+    distances = rng.uniform(-10, 300, num_reaches)
+    land_use = rng.uniform(0, 1.5, num_reaches)
+    dem, fdir, dam_id, flow_dir = _synthetic_dams(raster_size, rng)
+    offsets = (np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1]), np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1]))
+
+    def run_hand():
+        ht_out = np.full(dem.shape, NO_DATA)
+        height_above_dams(dem, fdir, dam_id, ht_out, dam_id.copy(), flow_dir, offsets[0], offsets[1], 5.0, 2000)
+        return ht_out
+
+    def run_flood():
+        level = np.full(dem.shape, np.nan)
+        level[0, :] = dem[0, :]
+        seeds = np.arange(dem.shape[1])
+        priority_flood(dem.astype(np.float64), level, np.zeros(dem.shape, np.int64), np.zeros(dem.shape, np.int8),
+                       seeds)
+        return level
+
+    kernels = [
+        ('FIS centroid', lambda: BatchFIS.MamdaniSystem.defuzzify(comb_system, activation)),
+        ('Conflict score', lambda: conflict_score(distances, 10.0, 100.0, -0.98 / 90.0, 0.99 + 0.98 / 9.0)),
+        ('Land use score', lambda: land_use_score(land_use)),
+        ('BDSWEA height above dams', run_hand),
+        ('Priority flood', run_flood),
+    ]
+    results = []
+    for name, run in kernels:
+        times = []
+        outputs = []
+        for use_numba in [False, True]:
+            USE_NUMBA = use_numba and HAVE_NUMBA
+            outputs.append(run())  # the first compiled call also compiles the kernel, so it isn't timed
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                run()
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            times.append(best)
+        results.append((name, times[0], times[1], float(np.max(np.abs(outputs[0] - outputs[1])))))
+    USE_NUMBA = HAVE_NUMBA
+    return results
+
+
+def _synthetic_dams(size, rng):
+    """
+    A tilted, noisy valley draining down its rows with a dam every few rows along its center, for benchmarking
+    """
+    rows, cols = np.mgrid[0:size, 0:size]
+    dem = (0.05 * (size - rows) + 0.02 * np.abs(cols - size // 2) + rng.uniform(0, 0.05, (size, size)))
+    dem = dem.astype(np.float32)
+    flow_dir = np.array([32, 64, 128, 16, 0, 1, 8, 4, 2])
+    fdir = np.where(cols < size // 2, 2, np.where(cols > size // 2, 8, 4)).astype(np.int32)  # ESRI SE, SW and S
+    dam_id = np.full((size, size), -1, dtype=np.int32)
+    dam_rows = np.arange(size // 10, size - 1, size // 10)
+    dam_id[dam_rows, size // 2] = np.arange(len(dam_rows))
+    return dem, fdir, dam_id, flow_dir
+
+
+if __name__ == '__main__':
+    if not HAVE_NUMBA:
+        print("Numba isn't installed, so only the fallbacks can be run")
+        sys.exit(0)
+    print("{0:<28}{1:>12}{2:>12}{3:>10}{4:>14}".format("Kernel", "Fallback s", "Numba s", "Speedup", "Max diff"))
+    # run the benchmark in the imported module, which is the one BatchFIS switches on
+    import FastKernels
+    for name, fallback_time, numba_time, difference in FastKernels.benchmark():
+        print("{0:<28}{1:>12.4f}{2:>12.4f}{3:>9.1f}x{4:>14.2e}".format(name, fallback_time, numba_time,
+                                                                      fallback_time / max(numba_time, 1e-9),
+                                                                      difference))
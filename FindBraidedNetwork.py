@@ -21,6 +21,8 @@
 import os
 import sys
 import arcpy
+import NetworkGeometry
+from SupportingFunctions import read_lines, read_feature_parts
 
 
 def main(fcStreamNetwork, canal, tempDir, is_verbose):
@@ -71,13 +73,15 @@ def handleCanals(stream_network, canal, temp_folder, is_verbose):
             if row[0] == 0:
                 cursor.deleteRow()
 
-    arcpy.MakeFeatureLayer_management(stream_network, "lyrBraidedReaches")
-    arcpy.MakeFeatureLayer_management(stream_network_no_canals,"lyrNoCanals")
-
-    arcpy.SelectLayerByLocation_management("lyrBraidedReaches","SHARE_A_LINE_SEGMENT_WITH","lyrNoCanals",'',"NEW_SELECTION")
-
-    arcpy.CalculateField_management("lyrBraidedReaches","IsMultiCh",1,"PYTHON")
-    arcpy.CalculateField_management("lyrBraidedReaches","IsMainCh",0,"PYTHON")
+    # reaches that share a line segment with the braided reaches left after erasing the canals
+    isBraided = NetworkGeometry.shares_segment(read_lines(stream_network)[1],
+                                                read_feature_parts(stream_network_no_canals))
+    with arcpy.da.UpdateCursor(stream_network, ["IsMultiCh", "IsMainCh"]) as cursor:
+        for row, rowIsBraided in zip(cursor, isBraided):
+            if rowIsBraided:
+                row[0] = 1
+                row[1] = 0
+                cursor.updateRow(row)
 
     arcpy.Delete_management(stream_network_no_canals)
 
@@ -0,0 +1,112 @@
+# -------------------------------------------------------------------------------
+# Name:        Focal Mean
+# Purpose:     Smooths a DEM with a focal mean one tile at a time, so rasters bigger than memory can be smoothed, and
+#              only the tiles that are needed have to be
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# focal_mean() matches FocalStatistics with a rectangle neighborhood and the MEAN statistic, followed by ExtractByMask
+# to the input: NoData neighbors are left out of each mean, cells near the edge of the raster average the neighbors
+# they have, and cells that are NoData stay NoData.
+#
+# Each tile is read with a halo of size // 2 cells on each side, so the means along its edges see the same neighbors
+# they would if the whole raster were smoothed at once, and tiled results match untiled ones exactly.
+#
+# read_with_halo() and smoothed_reader() read through a function they are given, so they work with any raster library:
+# D8Flow reads the DEM with GDAL, and ReachZonal.tiled_point_statistic() reads only the tiles near reach ends with
+# arcpy.
+
+import numpy as np
+
+
+DEFAULT_TILE_SIZE = 2048  # rows and columns in each tile, not counting the halo
+
+
+def focal_mean(values, size=3, keep_no_data=True):
+    """
+    Finds the mean of each cell's size x size neighborhood, ignoring NoData
+    :param values: 2d array, with NaN for NoData
+    :param size: Width and height of the neighborhood in cells, which must be odd
+    :param keep_no_data: True to leave cells that are NoData as NoData, as ExtractByMask to the input does
+    :return: 2d float array the same shape as values, with NaN where there is no data
+    """
+    size = int(size)
+    if size < 1 or size % 2 == 0:
+        raise Exception("The focal mean neighborhood must be an odd number of cells wide, not " + str(size))
+    values = np.asarray(values, np.float64)
+    valid = ~np.isnan(values)
+    sums = window_sums(np.where(valid, values, 0.0), size)
+    counts = window_sums(valid.astype(np.float64), size)
+    means = np.full(values.shape, np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    if keep_no_data:
+        means[~valid] = np.nan
+    return means
+
+
+def window_sums(values, size):
+    """
+    Sums each cell's size x size neighborhood, treating cells beyond the edges as 0
+    :param values: 2d float array
+    :param size: Odd width of the neighborhood
+    :return: 2d array the same shape as values
+    """
+    num_rows, num_cols = values.shape
+    padded = np.pad(values, size // 2, mode='constant')
+    row_sums = padded[:num_rows, :].copy()
+    for i in range(1, size):
+        row_sums += padded[i:i + num_rows, :]
+    sums = row_sums[:, :num_cols].copy()
+    for j in range(1, size):
+        sums += row_sums[:, j:j + num_cols]
+    return sums
+
+
+def tile_ranges(num_rows, num_cols, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Splits a raster into tiles
+    :param num_rows: Rows in the raster
+    :param num_cols: Columns in the raster
+    :param tile_size: Rows and columns in each tile
+    :return: List of (first row, last row + 1, first column, last column + 1) tuples
+    """
+    return [(row, min(row + tile_size, num_rows), col, min(col + tile_size, num_cols))
+            for row in range(0, num_rows, tile_size) for col in range(0, num_cols, tile_size)]
+
+
+def read_with_halo(read_block, tile, halo, num_rows, num_cols):
+    """
+    Reads a tile along with the cells around it, up to the edges of the raster
+    :param read_block: Function taking (first row, last row + 1, first column, last column + 1) and returning a 2d
+                       float array with NaN for NoData
+    :param tile: (first row, last row + 1, first column, last column + 1) of the tile
+    :param halo: Number of cells to read around the tile
+    :param num_rows: Rows in the raster
+    :param num_cols: Columns in the raster
+    :return: Tuple of (the block read, the tile's slice of the block)
+    """
+    first_row, last_row, first_col, last_col = tile
+    block_first_row = max(first_row - halo, 0)
+    block_first_col = max(first_col - halo, 0)
+    block = read_block(block_first_row, min(last_row + halo, num_rows), block_first_col, min(last_col + halo, num_cols))
+    inner = (slice(first_row - block_first_row, last_row - block_first_row),
+             slice(first_col - block_first_col, last_col - block_first_col))
+    return block, inner
+
+
+def smoothed_reader(read_block, num_rows, num_cols, size=3):
+    """
+    Wraps a block reader so that the blocks it returns are smoothed, reading each with the halo its means need
+    :param read_block: Function taking (first row, last row + 1, first column, last column + 1) and returning a 2d
+                       float array with NaN for NoData
+    :param num_rows: Rows in the raster
+    :param num_cols: Columns in the raster
+    :param size: Width and height of the neighborhood in cells
+    :return: Function taking the same arguments as read_block
+    """
+    def read_smoothed(first_row, last_row, first_col, last_col):
+        block, inner = read_with_halo(read_block, (first_row, last_row, first_col, last_col), int(size) // 2,
+                                      num_rows, num_cols)
+        return focal_mean(block, size)[inner]
+    return read_smoothed
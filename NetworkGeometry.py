@@ -0,0 +1,302 @@
+# -------------------------------------------------------------------------------
+# Name:        Network Geometry
+# Purpose:     Finds where roads cross the network, splits reaches there, finds reaches that share segments with
+#              another network, and measures how far along its stream each reach is, straight from the vertices
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Intersect_analysis and FeatureToLine_management compare the network with every road, which is slow with county-wide
+# road layers. Here the roads' segments are put in a VectorDistance.SegmentIndex once, every segment of every reach is
+# looked up in it at the same time, and only the pairs of segments the index finds are tested for where they cross.
+# With shapely the index is an STRtree; without it the NumPy grid index finds the pairs instead.
+#
+# Crossings are measured along their reach, so reaches can be split at all of their crossings in one pass, and every
+# new reach knows which reach it came from.
+#
+# Reaches that share a line segment with another network, as SelectLayerByLocation with SHARE_A_LINE_SEGMENT_WITH
+# selects them, are found by snapping both networks' vertices to a grid the size of the snapping tolerance and putting
+# the other network's segments, as pairs of snapped vertices, in a set. Reaches drawn from the same vertices as the
+# other network are found by looking their segments up in it, in time linear in the number of segments. The few
+# reaches left, whose segments were cut somewhere other than a vertex of the other network, are checked for segments
+# lying along the other network's with the segment index.
+#
+# ReachDist is the distance from the start of a reach's stream to the reach's midpoint, which CreateRoutes_lr and
+# LocateFeaturesAlongRoutes_lr used to find through a temporary table of route measures. BRAT_table, AddAttributes and
+# segmentNetwork all find it with reach_distances() instead. Here the reaches of each stream are chained end to start
+# where exactly two reaches of the stream meet, the same chains Dissolve_management with UNSPLIT_LINES makes, and the
+# length of the reaches before each reach in its chain is found for every reach at once by pointer jumping.
+#
+# This module doesn't use arcpy. BRAT_table and the supporting tools read the networks and write the results.
+
+import numpy as np
+import VectorDistance
+
+
+NODE_TOLERANCE = 0.001  # meters between reach ends that are treated as the same point
+
+
+def reach_segments(lines):
+    """
+    Splits reaches into their segments, measuring where each segment starts along its reach
+    :param lines: List with a list of (x, y) vertex arrays for each reach, one array per part
+    :return: Tuple of (reach index, start X, start Y, end X, end Y, measure at start) arrays. Measures run through the
+             parts of a reach in order
+    """
+    line_index = []
+    segments = []
+    measures = []
+    for i, parts in enumerate(lines):
+        offset = 0.0
+        for part in parts:
+            part = np.asarray(part, np.float64).reshape(-1, 2)
+            if len(part) < 2:
+                continue
+            along = offset + np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(part[:, 0]), np.diff(part[:, 1])))])
+            line_index.append(np.full(len(part) - 1, i, np.int64))
+            segments.append(np.column_stack([part[:-1], part[1:]]))
+            measures.append(along[:-1])
+            offset = along[-1]
+    if not line_index:
+        empty = np.zeros(0)
+        return np.zeros(0, np.int64), empty, empty, empty, empty, empty
+    segments = np.concatenate(segments)
+    return (np.concatenate(line_index), segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3],
+            np.concatenate(measures))
+
+
+def line_lengths(lines):
+    """
+    :param lines: List with a list of (x, y) vertex arrays for each line, one array per part
+    :return: Array with the length of each line
+    """
+    line_index, x0, y0, x1, y1 = reach_segments(lines)[:5]
+    return np.bincount(line_index, np.hypot(x1 - x0, y1 - y0), len(lines))
+
+
+def crossing_points(lines, feature_parts, use_shapely=None):
+    """
+    Finds every point where features, e.g. roads, cross or touch the lines. Stretches where a feature runs along a
+    line don't give points
+    :param lines: List with a list of (x, y) vertex arrays for each line, one array per part
+    :param feature_parts: List of (x, y) vertex arrays, one per part of each feature
+    :param use_shapely: Passed to VectorDistance.SegmentIndex
+    :return: Tuple of (line index, X, Y, measure along the line) arrays, sorted by line and measure, with one point for
+             each place a line is crossed
+    """
+    line_index, x0, y0, x1, y1, start = reach_segments(lines)
+    index = VectorDistance.SegmentIndex(*VectorDistance.line_segments(feature_parts), use_shapely=use_shapely)
+    segment, feature = index.candidate_pairs(x0, y0, x1, y1)
+
+    # where segment (x0, y0) + t (dx, dy) meets feature segment (fx0, fy0) + u (fdx, fdy)
+    dx = (x1 - x0)[segment]
+    dy = (y1 - y0)[segment]
+    fdx = (index.x1 - index.x0)[feature]
+    fdy = (index.y1 - index.y0)[feature]
+    qx = index.x0[feature] - x0[segment]
+    qy = index.y0[feature] - y0[segment]
+    denominator = dx * fdy - dy * fdx
+    parallel = denominator == 0
+    denominator[parallel] = 1.0
+    t = (qx * fdy - qy * fdx) / denominator
+    u = (qx * dy - qy * dx) / denominator
+    crossing = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    segment, t = segment[crossing], t[crossing]
+    x = x0[segment] + t * dx[crossing]
+    y = y0[segment] + t * dy[crossing]
+    measure = start[segment] + t * np.hypot(dx, dy)[crossing]
+
+    # a feature crossing at a vertex meets the segments on both sides of it, and features can cross at the same point
+    reach = line_index[segment]
+    order = np.lexsort((measure, reach))
+    reach, x, y, measure = reach[order], x[order], y[order], measure[order]
+    repeat = np.zeros(len(reach), bool)
+    repeat[1:] = (reach[1:] == reach[:-1]) & (measure[1:] - measure[:-1] <= NODE_TOLERANCE)
+    return reach[~repeat], x[~repeat], y[~repeat], measure[~repeat]
+
+
+def part_between(part, along, start, end):
+    """
+    :param part: (x, y) vertex array
+    :param along: Measure of each vertex
+    :param start: Measure the piece starts at
+    :param end: Measure the piece ends at
+    :return: (x, y) vertex array of the piece of the part between the measures
+    """
+    inside = (along > start) & (along < end)
+    first = [np.interp(start, along, part[:, 0]), np.interp(start, along, part[:, 1])]
+    last = [np.interp(end, along, part[:, 0]), np.interp(end, along, part[:, 1])]
+    return np.vstack([[first], part[inside], [last]])
+
+
+def split_lines(lines, line_index, measures, min_length=NODE_TOLERANCE):
+    """
+    Splits lines at measures along them, all in one pass
+    :param lines: List with a list of (x, y) vertex arrays for each line, one array per part
+    :param line_index: Index of the line each split is on
+    :param measures: Measure along its line of each split, e.g. from crossing_points()
+    :param min_length: Splits closer than this to the ends of their line or to each other are ignored
+    :return: Tuple of (array with the index of the line each new line came from, list of new lines as lists of parts).
+             Lines that aren't split are kept as they are
+    """
+    line_index = np.asarray(line_index, np.int64)
+    measures = np.asarray(measures, np.float64)
+    lengths = line_lengths(lines)
+    order = np.lexsort((measures, line_index))
+    line_index, measures = line_index[order], measures[order]
+    bounds = np.searchsorted(line_index, np.arange(len(lines) + 1))
+    parents = []
+    new_lines = []
+    for i, parts in enumerate(lines):
+        cuts = [0.0]
+        for measure in measures[bounds[i]:bounds[i + 1]]:
+            if measure - cuts[-1] >= min_length and lengths[i] - measure >= min_length:
+                cuts.append(measure)
+        if len(cuts) == 1:
+            parents.append(i)
+            new_lines.append(parts)
+            continue
+        cuts.append(lengths[i])
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            pieces = []
+            offset = 0.0
+            for part in parts:
+                part = np.asarray(part, np.float64).reshape(-1, 2)
+                if len(part) < 2:
+                    continue
+                along = offset + np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(part[:, 0]),
+                                                                           np.diff(part[:, 1])))])
+                if along[-1] > start and along[0] < end:
+                    pieces.append(part_between(part, along, max(start, along[0]), min(end, along[-1])))
+                offset = along[-1]
+            parents.append(i)
+            new_lines.append(pieces)
+    return np.array(parents, np.int64), new_lines
+
+
+def snapped_vertices(x, y, tolerance):
+    """
+    :return: Tuple of (X, Y) integer arrays of coordinates snapped to a grid with cells tolerance wide
+    """
+    return (np.round(np.asarray(x, np.float64) / tolerance).astype(np.int64),
+            np.round(np.asarray(y, np.float64) / tolerance).astype(np.int64))
+
+
+def segment_keys(x0, y0, x1, y1, tolerance):
+    """
+    Finds a key for each segment that is the same for any segment with the same ends, once they are snapped, whichever
+    way the segments run
+    :return: List of (X, Y, X, Y) tuples of snapped ends, with the lower end first
+    """
+    sx0, sy0 = snapped_vertices(x0, y0, tolerance)
+    sx1, sy1 = snapped_vertices(x1, y1, tolerance)
+    swap = (sx1 < sx0) | ((sx1 == sx0) & (sy1 < sy0))
+    ends = np.column_stack([np.where(swap, sx1, sx0), np.where(swap, sy1, sy0),
+                            np.where(swap, sx0, sx1), np.where(swap, sy0, sy1)])
+    return [tuple(key) for key in ends.tolist()]
+
+
+def shares_segment(lines, other_parts, tolerance=NODE_TOLERANCE, use_shapely=None):
+    """
+    Finds the lines that share a line segment with another set of lines, i.e. that overlap them for some length, as
+    SelectLayerByLocation with SHARE_A_LINE_SEGMENT_WITH does. Lines that only cross or touch the others don't
+    :param lines: List with a list of (x, y) vertex arrays for each line, one array per part
+    :param other_parts: List of (x, y) vertex arrays, one per part of each of the other lines
+    :param tolerance: Snapping tolerance. Vertices closer than this are the same vertex, and segments lying within this
+                      of each other for more than this length share it
+    :param use_shapely: Passed to VectorDistance.SegmentIndex
+    :return: Boolean array that is True for each line that shares a segment
+    """
+    line_index, x0, y0, x1, y1 = reach_segments(lines)[:5]
+    other_x0, other_y0, other_x1, other_y1 = VectorDistance.line_segments(other_parts)
+    shares = np.zeros(len(lines), bool)
+    has_length = np.hypot(x1 - x0, y1 - y0) > tolerance
+    other_has_length = np.hypot(other_x1 - other_x0, other_y1 - other_y0) > tolerance
+    other_x0, other_y0, other_x1, other_y1 = [v[other_has_length] for v in (other_x0, other_y0, other_x1, other_y1)]
+
+    # segments with the same snapped ends as one of the other lines' segments
+    other_keys = set(segment_keys(other_x0, other_y0, other_x1, other_y1, tolerance))
+    for i, key in zip(line_index.tolist(), segment_keys(x0, y0, x1, y1, tolerance)):
+        if key in other_keys:
+            shares[i] = True
+
+    # segments of the other lines' segments that were cut somewhere else, which lie along them
+    left = has_length & ~shares[line_index]
+    line_index, x0, y0, x1, y1 = [v[left] for v in (line_index, x0, y0, x1, y1)]
+    index = VectorDistance.SegmentIndex(other_x0, other_y0, other_x1, other_y1, use_shapely=use_shapely)
+    segment, other = index.candidate_pairs(x0, y0, x1, y1, tolerance)
+    dx = (x1 - x0)[segment]
+    dy = (y1 - y0)[segment]
+    length = np.hypot(dx, dy)
+    # distance of the other segment's ends from the segment's line, and where they are along it
+    ends_x = [other_x0[other] - x0[segment], other_x1[other] - x0[segment]]
+    ends_y = [other_y0[other] - y0[segment], other_y1[other] - y0[segment]]
+    offsets = [np.abs(end_x * dy - end_y * dx) / length for end_x, end_y in zip(ends_x, ends_y)]
+    along = [(end_x * dx + end_y * dy) / length for end_x, end_y in zip(ends_x, ends_y)]
+    overlap = np.minimum(np.maximum(along[0], along[1]), length) - np.maximum(np.minimum(along[0], along[1]), 0.0)
+    along_line = (offsets[0] <= tolerance) & (offsets[1] <= tolerance) & (overlap > tolerance)
+    shares[line_index[segment[along_line]]] = True
+    return shares
+
+
+def reach_distances(stream_ids, lines, tolerance=NODE_TOLERANCE):
+    """
+    Finds the distance from the start of each reach's stream to the middle of the reach. Reaches of the same stream are
+    chained where one ends at the start of another and no other reach of the stream starts or ends there
+    :param stream_ids: StreamID of each reach
+    :param lines: List with a list of (x, y) vertex arrays for each reach, one array per part
+    :param tolerance: Reach ends closer than this are treated as the same point
+    :return: Array with the distance for each reach, NaN for reaches without a line
+    """
+    num_reaches = len(lines)
+    line_index, x0, y0, x1, y1 = reach_segments(lines)[:5]
+    lengths = np.bincount(line_index, np.hypot(x1 - x0, y1 - y0), num_reaches)
+    has_shape = np.bincount(line_index, minlength=num_reaches) > 0
+    first = np.searchsorted(line_index, np.arange(num_reaches))[has_shape]
+    last = np.searchsorted(line_index, np.arange(num_reaches), 'right')[has_shape] - 1
+    ends = np.zeros((num_reaches, 4))
+    ends[has_shape] = np.column_stack([x0[first], y0[first], x1[last], y1[last]])
+
+    # number the distinct points within each stream, with the starts of the reaches before their ends
+    _, stream = np.unique(np.asarray(stream_ids), return_inverse=True)
+    snapped = np.round(ends / tolerance)
+    keys = np.vstack([np.column_stack([stream, snapped[:, :2]]), np.column_stack([stream, snapped[:, 2:]])])
+    order = np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+    new_node = np.ones(len(keys), bool)
+    new_node[1:] = np.any(keys[order[1:]] != keys[order[:-1]], axis=1)
+    node = np.empty(len(keys), np.int64)
+    node[order] = np.cumsum(new_node) - 1
+    node[np.concatenate([~has_shape, ~has_shape])] = -1
+    start_node, end_node = node[:num_reaches], node[num_reaches:]
+    num_nodes = int(node.max()) + 1 if num_reaches else 0
+    starts_at = np.bincount(start_node[has_shape], minlength=num_nodes)
+    ends_at = np.bincount(end_node[has_shape], minlength=num_nodes)
+    reach_starting = np.full(num_nodes, -1, np.int64)
+    reach_starting[start_node[has_shape]] = np.flatnonzero(has_shape)
+
+    # each reach's predecessor is the only reach ending where it starts, if it is the only reach starting there
+    previous = np.full(num_reaches, -1, np.int64)
+    linked = has_shape & (start_node != end_node)
+    linked[linked] = (starts_at[end_node[linked]] == 1) & (ends_at[end_node[linked]] == 1)
+    previous[reach_starting[end_node[linked]]] = np.flatnonzero(linked)
+
+    # a stream that loops back on itself has no first reach, so its chain is broken at its lowest numbered reach
+    lowest = np.arange(num_reaches)
+    pointer = previous.copy()
+    for step in range(int(np.ceil(np.log2(num_reaches + 1))) + 1):
+        has_pointer = pointer >= 0
+        lowest[has_pointer] = np.minimum(lowest[has_pointer], lowest[pointer[has_pointer]])
+        pointer[has_pointer] = pointer[pointer[has_pointer]]
+    in_loop = pointer >= 0
+    previous[in_loop & (lowest == np.arange(num_reaches))] = -1
+
+    # pointer jumping: each step adds the length between a reach and the reach it points to, then points it twice as far
+    offset = np.where(previous >= 0, lengths[np.maximum(previous, 0)], 0.0)
+    pointer = previous.copy()
+    while (pointer >= 0).any():
+        has_pointer = pointer >= 0
+        offset = np.where(has_pointer, offset + offset[np.maximum(pointer, 0)], offset)
+        pointer = np.where(has_pointer, pointer[np.maximum(pointer, 0)], -1)
+    distances = offset + lengths / 2.0
+    distances[~has_shape] = np.nan
+    return distances
@@ -0,0 +1,106 @@
+# -------------------------------------------------------------------------------
+# Name:        Parallel FIS
+# Purpose:     Splits batch FIS evaluation across a pool of worker processes for very large networks
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# The input arrays are copied once into a shared memory block that every worker maps, and each worker writes its
+# outputs straight into a shared output block, so only (start, stop) chunk bounds are sent between processes. Each
+# worker compiles the rule table itself (see FISRuleTable.load_system), and every reach goes through exactly the same
+# BatchFIS code as it would in a single process, so the output is identical whatever the number of workers or chunks.
+#
+# Workers only import numpy, BatchFIS and FISRuleTable, not arcpy, so they start quickly and don't take a license.
+
+import os
+import sys
+import multiprocessing
+import numpy as np
+import FISRuleTable
+
+
+DEFAULT_CHUNK_SIZE = 50000  # reaches sent to a worker at a time
+
+_worker_data = {}  # set in each worker process by _init_worker()
+
+
+def resolve_num_workers(num_workers):
+    """
+    Turns the number of workers given to a tool into the number of processes to use
+    :param num_workers: Number of workers, None or blank for a single process, or 0 for one per CPU core
+    :return: Int
+    """
+    if num_workers is None or str(num_workers).strip() == '':
+        return 1
+    num_workers = int(num_workers)
+    if num_workers <= 0:
+        return multiprocessing.cpu_count()
+    return num_workers
+
+
+def evaluate(rule_table, input_arrays, num_workers, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Evaluates the FIS defined by a rule table for every reach, using a pool of worker processes
+    :param rule_table: Path to the FISRuleTable file that defines the FIS
+    :param input_arrays: List of 1d arrays, one per input, in the same order as the reaches
+    :param num_workers: Number of worker processes (see resolve_num_workers)
+    :param chunk_size: How many reaches to hand a worker at a time
+    :return: 1d array of outputs in the same order as the input arrays
+    """
+    input_arrays = [np.asarray(values, dtype=np.float64) for values in input_arrays]
+    num_inputs = len(input_arrays)
+    num_reaches = len(input_arrays[0])
+    chunks = [(start, min(start + chunk_size, num_reaches)) for start in range(0, num_reaches, chunk_size)]
+    num_workers = min(resolve_num_workers(num_workers), len(chunks))
+    if num_workers <= 1:
+        return FISRuleTable.load_system(rule_table).evaluate(input_arrays)
+
+    shared_inputs = multiprocessing.RawArray('d', num_inputs * num_reaches)
+    shared_output = multiprocessing.RawArray('d', num_reaches)
+    shared_array(shared_inputs, (num_inputs, num_reaches))[:] = input_arrays
+
+    set_worker_executable()
+    pool = multiprocessing.Pool(num_workers, _init_worker,
+                                (os.path.abspath(rule_table), shared_inputs, shared_output, num_inputs, num_reaches))
+    try:
+        pool.map(_evaluate_chunk, chunks, chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return shared_array(shared_output, (num_reaches,)).copy()
+
+
+def shared_array(raw_array, shape):
+    """
+    Views a multiprocessing RawArray of doubles as a numpy array, without copying it
+    :param raw_array: multiprocessing.RawArray('d', ...)
+    :param shape: Shape of the view
+    :return: numpy array
+    """
+    return np.frombuffer(raw_array, dtype=np.float64).reshape(shape)
+
+
+def set_worker_executable():
+    """
+    Inside ArcMap or ArcCatalog sys.executable is the ArcGIS application, so on Windows the workers have to be started
+    with the python interpreter that ArcGIS uses instead
+    :return:
+    """
+    if sys.platform == 'win32' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+
+
+def _init_worker(rule_table, shared_inputs, shared_output, num_inputs, num_reaches):
+    _worker_data['system'] = FISRuleTable.load_system(rule_table)
+    _worker_data['inputs'] = shared_array(shared_inputs, (num_inputs, num_reaches))
+    _worker_data['output'] = shared_array(shared_output, (num_reaches,))
+
+
+def _evaluate_chunk(bounds):
+    start, stop = bounds
+    inputs = _worker_data['inputs']
+    _worker_data['output'][start:stop] = _worker_data['system'].evaluate([values[start:stop] for values in inputs])
@@ -0,0 +1,665 @@
+# -------------------------------------------------------------------------------
+# Name:        Reach Zonal
+# Purpose:     Summarizes raster values within each reach's buffer, handling buffers that overlap each other
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# ZonalStatisticsAsTable turns zone polygons into a single raster, so where buffers overlap only one reach keeps each
+# cell, and reaches that lose all their cells get no output. Here every reach keeps its own list of cells (its
+# footprint), so overlapping buffers share cells and every reach gets a value in one pass.
+#
+# A cell belongs to a reach when the cell's center falls inside the reach's buffer, the same rule ArcGIS uses to turn
+# polygons into zones. Buffers are scanned one row of cell centers at a time: the crossings of each row with the
+# buffer's edges are sorted, and the cells between each pair of crossings are inside. This treats every ring the same
+# way (even-odd), so holes in buffers are left out without needing to know which rings are holes. A buffer too small
+# to hold any cell center gets the cell under its first vertex, so that it still gets a value.
+#
+# Footprints are stored like a sparse matrix (CSR): the cells of reach i are cells[offsets[i]:offsets[i + 1]], as
+# flat indexes into the grid (row * number of columns + column).
+#
+# Footprints can also hold the exact fraction of each cell that falls in the buffer (from_polygon_coverage), found
+# with Green's theorem on the buffer edges split at the cell lines. The COUNT, SUM, MEAN and STD of these footprints
+# weight each cell by that fraction, so a cell half inside a 30 m buffer counts half, rather than all or nothing
+# depending on where its center falls. MINIMUM, MAXIMUM, RANGE and percentiles use every cell the buffer touches.
+#
+# zonal_statistics() finds every statistic asked for, of every raster on the same grid, from one set of footprints, so
+# each buffer's cells are only found once however many fields are filled in from them.
+#
+# class_histograms() counts the cells of each class of a categorical raster, like land use, in every footprint at once.
+#
+# Footprints can be saved and reused (load_or_build_footprints). Each file is named after a hash of the ReachIDs, the
+# polygons' vertices and the grid, so a changed network or raster makes a new index rather than using a stale one.
+#
+# This module doesn't use arcpy. BRAT_table reads the buffers and rasters and writes the results.
+
+import os
+import hashlib
+import numpy as np
+import FocalMean
+
+
+STATISTICS = ['MINIMUM', 'MAXIMUM', 'RANGE', 'MEAN', 'STD', 'SUM', 'COUNT', 'MEDIAN']  # and PERCENTILE_<n>
+WEIGHTED_STATISTICS = ['MEAN', 'STD', 'SUM', 'COUNT']  # weighted by coverage, when footprints have it
+
+
+class RasterGrid(object):
+    """
+    The cells of a north-up raster, or of a window of one
+    """
+    def __init__(self, left, top, cell_size, num_rows, num_cols):
+        """
+        :param left: X coordinate of the left edge of the grid
+        :param top: Y coordinate of the top edge of the grid
+        :param cell_size: Width and height of each cell
+        :param num_rows: Number of rows
+        :param num_cols: Number of columns
+        """
+        self.left = float(left)
+        self.top = float(top)
+        self.cell_size = float(cell_size)
+        self.num_rows = int(num_rows)
+        self.num_cols = int(num_cols)
+
+    def __eq__(self, other):
+        tolerance = 1e-6 * self.cell_size
+        return isinstance(other, RasterGrid) and self.num_rows == other.num_rows and \
+            self.num_cols == other.num_cols and abs(self.cell_size - other.cell_size) < tolerance and \
+            abs(self.left - other.left) < tolerance and abs(self.top - other.top) < tolerance
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def bottom(self):
+        return self.top - self.num_rows * self.cell_size
+
+    @property
+    def right(self):
+        return self.left + self.num_cols * self.cell_size
+
+    def window(self, x_min, y_min, x_max, y_max, margin=1):
+        """
+        The part of this grid that covers an extent, lined up with this grid's cells
+        :param x_min: Left of the extent
+        :param y_min: Bottom of the extent
+        :param x_max: Right of the extent
+        :param y_max: Top of the extent
+        :param margin: Number of extra cells to keep around the extent
+        :return: RasterGrid
+        """
+        first_col = max(int(np.floor((x_min - self.left) / self.cell_size)) - margin, 0)
+        last_col = min(int(np.floor((x_max - self.left) / self.cell_size)) + margin, self.num_cols - 1)
+        first_row = max(int(np.floor((self.top - y_max) / self.cell_size)) - margin, 0)
+        last_row = min(int(np.floor((self.top - y_min) / self.cell_size)) + margin, self.num_rows - 1)
+        if last_col < first_col or last_row < first_row:
+            raise Exception("The extent doesn't overlap the raster")
+        return RasterGrid(self.left + first_col * self.cell_size, self.top - first_row * self.cell_size,
+                          self.cell_size, last_row - first_row + 1, last_col - first_col + 1)
+
+    def subgrid(self, first_row, last_row, first_col, last_col):
+        """
+        :param first_row: First row of this grid in the subgrid
+        :param last_row: Last row + 1
+        :param first_col: First column of this grid in the subgrid
+        :param last_col: Last column + 1
+        :return: RasterGrid of those rows and columns
+        """
+        return RasterGrid(self.left + first_col * self.cell_size, self.top - first_row * self.cell_size,
+                          self.cell_size, last_row - first_row, last_col - first_col)
+
+    def grid_coordinates(self, x, y):
+        """
+        :param x: Array of X coordinates
+        :param y: Array of Y coordinates
+        :return: Tuple of (column, row) arrays in units of cells from the top left corner, as floats
+        """
+        return (np.asarray(x, np.float64) - self.left) / self.cell_size, \
+            (self.top - np.asarray(y, np.float64)) / self.cell_size
+
+
+class ReachFootprints(object):
+    """
+    The cells of a raster grid that fall in each reach's buffer
+    """
+    def __init__(self, reach_ids, offsets, cells, grid, weights=None):
+        """
+        :param reach_ids: ReachID of each footprint
+        :param offsets: The cells of footprint i are cells[offsets[i]:offsets[i + 1]]
+        :param cells: Flat cell indexes (row * number of columns + column) into grid
+        :param grid: The RasterGrid the cells are in
+        :param weights: Fraction of each entry of cells covered by its footprint, or None if cells are whole
+        """
+        self.reach_ids = np.asarray(reach_ids)
+        self.offsets = np.asarray(offsets, np.int64)
+        self.cells = np.asarray(cells, np.int64)
+        self.grid = grid
+        self.weights = None if weights is None else np.asarray(weights, np.float64)
+
+    @classmethod
+    def from_polygons(cls, reach_ids, polygons, grid):
+        """
+        Finds the cells whose centers fall in each polygon
+        :param reach_ids: ReachID of each polygon
+        :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices
+        :param grid: The RasterGrid to find cells in
+        :return: ReachFootprints
+        """
+        polygon_index, cells = center_cells(polygons, grid)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(polygon_index, minlength=len(polygons)))])
+        return cls(reach_ids, offsets, cells, grid)
+
+    @classmethod
+    def from_polygon_coverage(cls, reach_ids, polygons, grid):
+        """
+        Finds every cell each polygon covers, along with the fraction of the cell it covers
+        :param reach_ids: ReachID of each polygon
+        :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices
+        :param grid: The RasterGrid to find cells in
+        :return: ReachFootprints with weights
+        """
+        polygon_index, cells, weights = coverage_cells(polygons, grid)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(polygon_index, minlength=len(polygons)))])
+        return cls(reach_ids, offsets, cells, grid, weights)
+
+    @classmethod
+    def from_points(cls, reach_ids, x, y, radius, grid, chunk_size=100000):
+        """
+        Finds the cells whose centers are within a radius of each point, the cells a round buffer around the point
+        would hold. A point with no cell center that close gets the cell under it
+        :param reach_ids: ReachID of each point
+        :param x: Array of X coordinates
+        :param y: Array of Y coordinates
+        :param radius: Distance from each point, in the grid's units
+        :param grid: The RasterGrid to find cells in
+        :param chunk_size: Number of points whose candidate cells are checked at once
+        :return: ReachFootprints
+        """
+        u, v = grid.grid_coordinates(x, y)
+        radius = float(radius) / grid.cell_size
+        steps = np.arange(-int(np.ceil(radius)) - 1, int(np.ceil(radius)) + 2)
+        row_step, col_step = [step.ravel() for step in np.meshgrid(steps, steps, indexing='ij')]
+        point_index = []
+        cells = []
+        for start in range(0, len(u), chunk_size):
+            point_u = u[start:start + chunk_size, None]
+            point_v = v[start:start + chunk_size, None]
+            col = np.floor(point_u).astype(np.int64) + col_step
+            row = np.floor(point_v).astype(np.int64) + row_step
+            inside = ((col + 0.5 - point_u) ** 2 + (row + 0.5 - point_v) ** 2 <= radius * radius) & \
+                (col >= 0) & (col < grid.num_cols) & (row >= 0) & (row < grid.num_rows)
+            point, candidate = np.nonzero(inside)
+            point_index.append(point + start)
+            cells.append(row[point, candidate] * grid.num_cols + col[point, candidate])
+        point_index = np.concatenate(point_index + [np.zeros(0, np.int64)])
+        cells = np.concatenate(cells + [np.zeros(0, np.int64)])
+
+        empty = np.flatnonzero(np.bincount(point_index, minlength=len(u)) == 0)
+        empty = empty[(u[empty] >= 0) & (u[empty] < grid.num_cols) & (v[empty] >= 0) & (v[empty] < grid.num_rows)]
+        point_index = np.concatenate([point_index, empty])
+        cells = np.concatenate([cells, v[empty].astype(np.int64) * grid.num_cols + u[empty].astype(np.int64)])
+
+        order = np.lexsort((cells, point_index))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(point_index, minlength=len(u)))])
+        return cls(reach_ids, offsets, cells[order], grid)
+
+    @classmethod
+    def load(cls, path, key, grid):
+        """
+        Reads footprints saved by save()
+        :param path: The .npz file to read
+        :param key: The key the footprints were saved with, from footprint_key()
+        :param grid: The RasterGrid the footprints are in
+        :return: ReachFootprints, or None if the file doesn't exist, can't be read or has a different key
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            data = np.load(path)
+            if str(data['key']) != key:
+                return None
+            weights = data['weights'] if 'weights' in data.files else None
+            return cls(data['reach_ids'], data['offsets'], data['cells'], grid, weights)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path, key):
+        """
+        Writes the footprints to a .npz file. If the file can't be written the footprints just aren't kept
+        :param path: The .npz file to write
+        :param key: Key from footprint_key(), checked when the footprints are loaded
+        :return:
+        """
+        try:
+            folder = os.path.dirname(path)
+            if not os.path.exists(folder):
+                os.mkdir(folder)
+            temp_path = path[:-len(".npz")] + "_temp.npz"
+            arrays = dict(key=np.array(key), reach_ids=self.reach_ids, offsets=self.offsets, cells=self.cells)
+            if self.weights is not None:
+                arrays['weights'] = self.weights
+            np.savez(temp_path, **arrays)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+
+    def counts(self):
+        """
+        :return: Number of cells in each footprint
+        """
+        return np.diff(self.offsets)
+
+    def reach_index(self):
+        """
+        :return: The index of the footprint each entry of cells belongs to
+        """
+        return np.repeat(np.arange(len(self.reach_ids)), self.counts())
+
+    def gather(self, raster):
+        """
+        :param raster: 2d array of values on this footprint's grid
+        :return: The value of every entry of cells
+        """
+        raster = np.asarray(raster)
+        if raster.shape != (self.grid.num_rows, self.grid.num_cols):
+            raise Exception("The raster has shape " + str(raster.shape) + ", not the footprints' grid shape " +
+                            str((self.grid.num_rows, self.grid.num_cols)))
+        return raster.ravel()[self.cells]
+
+
+def load_or_build_footprints(reach_ids, polygons, grid, folder, name, coverage=False):
+    """
+    Reads the footprints of a set of polygons from folder if they have been found before on the same grid, or finds
+    and saves them if not
+    :param reach_ids: ReachID of each polygon
+    :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices
+    :param grid: The RasterGrid to find cells in
+    :param folder: Where footprint files are kept
+    :param name: Name used for the footprint file, e.g. "buffer_30m"
+    :param coverage: True for footprints with the fraction of each cell covered (from_polygon_coverage)
+    :return: ReachFootprints
+    """
+    key = footprint_key(reach_ids, polygons, grid, coverage)
+    path = os.path.join(folder, name + ("_coverage_" if coverage else "_") + key[:12] + ".npz")
+    footprints = ReachFootprints.load(path, key, grid)
+    if footprints is None:
+        if coverage:
+            footprints = ReachFootprints.from_polygon_coverage(reach_ids, polygons, grid)
+        else:
+            footprints = ReachFootprints.from_polygons(reach_ids, polygons, grid)
+        footprints.save(path, key)
+    return footprints
+
+
+def footprint_key(reach_ids, polygons, grid, coverage=False):
+    """
+    Hashes a set of polygons together with a grid
+    :param reach_ids: ReachID of each polygon
+    :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices
+    :param grid: RasterGrid
+    :param coverage: Whether the footprints have coverage weights
+    :return: String
+    """
+    md5 = hashlib.md5(np.array([grid.left, grid.top, grid.cell_size, grid.num_rows, grid.num_cols, coverage],
+                               np.float64).tobytes())
+    md5.update(np.ascontiguousarray(reach_ids, np.int64).tobytes())
+    for rings in polygons:
+        md5.update(np.int64(len(rings)).tobytes())
+        for ring in rings:
+            ring = np.ascontiguousarray(ring, np.float64)
+            md5.update(np.int64(ring.size).tobytes())
+            md5.update(ring.tobytes())
+    return md5.hexdigest()
+
+
+def tiled_point_statistic(read_window, grid, x, y, radius, statistic, smooth_size=None,
+                          tile_size=FocalMean.DEFAULT_TILE_SIZE):
+    """
+    Finds a statistic of a raster's values within a radius of each point, as ReachFootprints.from_points() would, but
+    reads the raster a tile at a time and only reads tiles with points in them
+    :param read_window: Function taking a subgrid of grid and returning a 2d float array on it, with NaN for NoData
+    :param grid: RasterGrid of the whole raster
+    :param x: Array of X coordinates
+    :param y: Array of Y coordinates
+    :param radius: Distance from each point, in the grid's units
+    :param statistic: One of STATISTICS, or PERCENTILE_<n>
+    :param smooth_size: Width of a focal mean to smooth the raster with before sampling it (see FocalMean), or None
+    :param tile_size: Rows and columns in each tile
+    :return: Array with a value for each point, NaN where there is no data
+    """
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    u, v = grid.grid_coordinates(x, y)
+    num_tile_rows = (grid.num_rows + tile_size - 1) // tile_size
+    num_tile_cols = (grid.num_cols + tile_size - 1) // tile_size
+    tile = np.clip(np.floor(v).astype(np.int64) // tile_size, 0, num_tile_rows - 1) * num_tile_cols + \
+        np.clip(np.floor(u).astype(np.int64) // tile_size, 0, num_tile_cols - 1)
+    margin = int(np.ceil(float(radius) / grid.cell_size)) + 1
+    halo = int(smooth_size) // 2 if smooth_size else 0
+
+    values = np.full(len(x), np.nan)
+    order = np.argsort(tile, kind='mergesort')
+    tiles, first = np.unique(tile[order], return_index=True)
+    for t, points in zip(tiles, np.split(order, first[1:])):
+        tile_row, tile_col = divmod(int(t), num_tile_cols)
+        window = (max(tile_row * tile_size - margin, 0), min((tile_row + 1) * tile_size + margin, grid.num_rows),
+                  max(tile_col * tile_size - margin, 0), min((tile_col + 1) * tile_size + margin, grid.num_cols))
+        block, inner = FocalMean.read_with_halo(lambda *rows_cols: read_window(grid.subgrid(*rows_cols)), window,
+                                                halo, grid.num_rows, grid.num_cols)
+        if smooth_size:
+            block = FocalMean.focal_mean(block, smooth_size)
+        footprints = ReachFootprints.from_points(points, x[points], y[points], radius, grid.subgrid(*window))
+        values[points] = zonal_statistic(footprints, block[inner], statistic)
+    return values
+
+
+def zonal_statistic(footprints, raster, statistic):
+    """
+    Summarizes a raster's values in each footprint, ignoring NoData
+    :param footprints: ReachFootprints
+    :param raster: 2d float array on the footprints' grid, with NaN for NoData
+    :param statistic: One of STATISTICS, or PERCENTILE_<n> for the nth percentile
+    :return: Array with a value for each footprint, NaN where a footprint has no data
+    """
+    return zonal_statistics(footprints, [raster], [statistic])[0][statistic.upper()]
+
+
+def zonal_statistics(footprints, rasters, statistics):
+    """
+    Finds several statistics of several rasters in each footprint, ignoring NoData. The footprints' cells are listed
+    once, and each raster's values are gathered from them once
+    :param footprints: ReachFootprints
+    :param rasters: List of 2d float arrays on the footprints' grid, with NaN for NoData
+    :param statistics: List of names from STATISTICS, or PERCENTILE_<n> for the nth percentile
+    :return: List with a dictionary for each raster, from upper case statistic name to an array with a value for each
+             footprint. Values are NaN where a footprint has no data, except for COUNT, which is 0. If the footprints
+             have weights, WEIGHTED_STATISTICS weight each cell by the fraction of it covered
+    """
+    statistics = [statistic.upper() for statistic in statistics]
+    for statistic in statistics:
+        percentile_value(statistic)  # raises an exception for unknown statistics
+    reach_index = footprints.reach_index()
+    results = []
+    for raster in rasters:
+        values = footprints.gather(raster).astype(np.float64)
+        valid = ~np.isnan(values)
+        weights = None if footprints.weights is None else footprints.weights[valid]
+        results.append(summarize(values[valid], reach_index[valid], len(footprints.reach_ids), statistics, weights))
+    return results
+
+
+def class_histograms(footprints, classes, num_classes):
+    """
+    Counts the cells of each class in each footprint with one bincount over footprint and class
+    :param footprints: ReachFootprints
+    :param classes: 2d int array on the footprints' grid with the class of each cell (0 to num_classes - 1), or -1 for
+                    cells that aren't counted
+    :param num_classes: Number of classes
+    :return: 2d array with a row for each footprint and a column for each class. If the footprints have weights, each
+             cell counts by the fraction of it covered
+    """
+    cell_classes = footprints.gather(classes).astype(np.int64)
+    counted = cell_classes >= 0
+    weights = None if footprints.weights is None else footprints.weights[counted]
+    num_reaches = len(footprints.reach_ids)
+    index = footprints.reach_index()[counted] * num_classes + cell_classes[counted]
+    return np.bincount(index, weights, num_reaches * num_classes).reshape(num_reaches, num_classes)
+
+
+def summarize(values, reach_index, num_reaches, statistics, weights=None):
+    """
+    Finds statistics of values grouped by reach
+    :param values: 1d array of values, sorted by reach
+    :param reach_index: The reach each value belongs to
+    :param num_reaches: Number of reaches
+    :param statistics: List of upper case statistic names
+    :param weights: Weight of each value in WEIGHTED_STATISTICS, or None to weight them equally
+    :return: Dictionary from statistic name to an array with a value for each reach
+    """
+    counts = np.bincount(reach_index, minlength=num_reaches)
+    has_data = counts > 0
+    # values are grouped by reach, so each reach's values start where the previous reach's end
+    starts = (np.cumsum(counts) - counts)[has_data]
+    if weights is None:
+        total_weights = counts.astype(np.float64)
+        sums = np.bincount(reach_index, values, num_reaches)
+    else:
+        total_weights = np.bincount(reach_index, weights, num_reaches)
+        sums = np.bincount(reach_index, weights * values, num_reaches)
+    means = np.full(num_reaches, np.nan)
+    means[has_data] = sums[has_data] / total_weights[has_data]
+    sorted_values = None
+
+    results = {}
+    for statistic in statistics:
+        out = np.full(num_reaches, np.nan)
+        if statistic == 'COUNT':
+            out = total_weights.copy()
+        elif statistic == 'SUM':
+            out[has_data] = sums[has_data]
+        elif statistic == 'MEAN':
+            out = means.copy()
+        elif statistic == 'STD':
+            squares = (values - means[reach_index]) ** 2
+            if weights is not None:
+                squares *= weights
+            out[has_data] = np.sqrt(np.bincount(reach_index, squares, num_reaches)[has_data] /
+                                    total_weights[has_data])
+        elif statistic in ['MINIMUM', 'MAXIMUM', 'RANGE']:
+            if len(starts) > 0:
+                low = np.minimum.reduceat(values, starts)
+                high = np.maximum.reduceat(values, starts)
+                out[has_data] = {'MINIMUM': low, 'MAXIMUM': high, 'RANGE': high - low}[statistic]
+        else:
+            if sorted_values is None:
+                sorted_values = values[np.lexsort((values, reach_index))]
+            # linear interpolation between the closest ranks, as numpy.percentile does
+            position = starts + (counts[has_data] - 1) * percentile_value(statistic) / 100.0
+            below = np.floor(position).astype(np.int64)
+            above = np.ceil(position).astype(np.int64)
+            if len(below) > 0:
+                out[has_data] = sorted_values[below] + (sorted_values[above] - sorted_values[below]) * \
+                    (position - below)
+        results[statistic] = out
+    return results
+
+
+def percentile_value(statistic):
+    """
+    :param statistic: Upper case statistic name
+    :return: The percentile the statistic is, e.g. 50 for MEDIAN, or None if it isn't a percentile
+    """
+    if statistic == 'MEDIAN':
+        return 50.0
+    if statistic.startswith('PERCENTILE_'):
+        try:
+            percentile = float(statistic[len('PERCENTILE_'):])
+        except ValueError:
+            percentile = -1
+        if 0 <= percentile <= 100:
+            return percentile
+    elif statistic in STATISTICS:
+        return None
+    raise Exception("Unknown zonal statistic: " + str(statistic))
+
+
+def center_cells(polygons, grid):
+    """
+    Finds the cells whose centers fall in each polygon
+    :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices
+    :param grid: RasterGrid
+    :return: Tuple of (polygon index, flat cell index) arrays, sorted by polygon and then cell
+    """
+    polygon_index, u0, v0, u1, v1 = polygon_edges(polygons, grid)
+
+    # a row's center line v = row + 0.5 crosses an edge if it is in [min v, max v); counting the edge's bottom end
+    # but not its top end means a line through a vertex crosses exactly one of the two edges meeting there, or both
+    # or neither when the vertex is a peak
+    v_min = np.minimum(v0, v1)
+    v_max = np.maximum(v0, v1)
+    first_row = np.maximum(np.ceil(v_min - 0.5), 0).astype(np.int64)
+    last_row = np.minimum(np.ceil(v_max - 0.5) - 1, grid.num_rows - 1).astype(np.int64)
+    edge, row = expand_ranges(first_row, last_row)
+    v_center = row + 0.5
+    u_cross = u0[edge] + (v_center - v0[edge]) * (u1[edge] - u0[edge]) / (v1[edge] - v0[edge])
+
+    # every row of a polygon has an even number of crossings, and the cells between each pair are inside
+    line = polygon_index[edge] * grid.num_rows + row
+    order = np.lexsort((u_cross, line))
+    line = line[order][0::2]
+    row = row[order][0::2]
+    u_cross = u_cross[order]
+    first_col = np.maximum(np.ceil(u_cross[0::2] - 0.5), 0).astype(np.int64)
+    last_col = np.minimum(np.ceil(u_cross[1::2] - 0.5) - 1, grid.num_cols - 1).astype(np.int64)
+    pair, col = expand_ranges(first_col, last_col)
+    inside_polygon = line[pair] // grid.num_rows
+    inside_cell = row[pair] * grid.num_cols + col
+
+    # buffers too small to hold a cell center get the cell under their first vertex
+    empty = np.flatnonzero(np.bincount(inside_polygon, minlength=len(polygons)) == 0)
+    extra_polygon = []
+    extra_cell = []
+    for p in empty:
+        if len(polygons[p]) > 0 and len(polygons[p][0]) > 0:
+            u, v = grid.grid_coordinates(polygons[p][0][0][0], polygons[p][0][0][1])
+            if 0 <= u < grid.num_cols and 0 <= v < grid.num_rows:
+                extra_polygon.append(p)
+                extra_cell.append(int(v) * grid.num_cols + int(u))
+    polygon_index = np.concatenate([inside_polygon, np.array(extra_polygon, np.int64)])
+    cells = np.concatenate([inside_cell, np.array(extra_cell, np.int64)])
+
+    order = np.lexsort((cells, polygon_index))
+    return polygon_index[order], cells[order]
+
+
+def coverage_cells(polygons, grid):
+    """
+    Finds the fraction of each cell covered by each polygon, exactly
+    :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices. Holes must wind the
+                     opposite way to outer rings, as they do in shapefiles
+    :param grid: RasterGrid
+    :return: Tuple of (polygon index, flat cell index, covered fraction) arrays, sorted by polygon and then cell
+    """
+    polygon_index, u0, v0, u1, v1 = polygon_edges(polygons, grid)
+    du = u1 - u0
+    dv = v1 - v0
+
+    # split every edge where it crosses a column or row line, so that each piece lies in one cell
+    col_edge, col_line = expand_ranges(np.floor(np.minimum(u0, u1)).astype(np.int64) + 1,
+                                       np.ceil(np.maximum(u0, u1)).astype(np.int64) - 1)
+    row_edge, row_line = expand_ranges(np.floor(np.minimum(v0, v1)).astype(np.int64) + 1,
+                                       np.ceil(np.maximum(v0, v1)).astype(np.int64) - 1)
+    num_edges = len(u0)
+    edge = np.concatenate([np.arange(num_edges), np.arange(num_edges), col_edge, row_edge])
+    t = np.concatenate([np.zeros(num_edges), np.ones(num_edges), (col_line - u0[col_edge]) / du[col_edge],
+                        (row_line - v0[row_edge]) / dv[row_edge]])
+    order = np.lexsort((t, edge))
+    edge = edge[order]
+    t = t[order]
+    same_edge = np.flatnonzero(edge[:-1] == edge[1:])
+    edge = edge[same_edge]
+    ua = u0[edge] + t[same_edge] * du[edge]
+    va = v0[edge] + t[same_edge] * dv[edge]
+    ub = u0[edge] + t[same_edge + 1] * du[edge]
+    vb = v0[edge] + t[same_edge + 1] * dv[edge]
+    piece_dv = vb - va
+    keep = piece_dv != 0
+    edge, ua, ub, piece_dv = edge[keep], ua[keep], ub[keep], piece_dv[keep]
+    piece_polygon = polygon_index[edge]
+    piece_col = np.floor((ua + ub) / 2).astype(np.int64)
+    piece_row = np.floor((va[keep] + vb[keep]) / 2).astype(np.int64)
+
+    # By Green's theorem the area of a polygon within cell (col, row) is the integral of (u - col) dv along the
+    # polygon's edges in that cell, plus the length of the cell's right side that is inside the polygon. That length
+    # is the sum of dv along every edge piece in the same row to the right of the cell.
+    local = ((ua + ub) / 2 - piece_col) * piece_dv
+    order = np.lexsort((piece_col, piece_row, piece_polygon))
+    piece_polygon, piece_row, piece_col = piece_polygon[order], piece_row[order], piece_col[order]
+    local, piece_dv = local[order], piece_dv[order]
+    new_span = np.concatenate([[True], (piece_polygon[1:] != piece_polygon[:-1]) | (piece_row[1:] != piece_row[:-1])])
+    span_of_piece = np.cumsum(new_span) - 1
+    span_first = np.flatnonzero(new_span)
+    span_last = np.concatenate([span_first[1:], [len(piece_col)]]) - 1
+    first_col = piece_col[span_first]
+    span, col = expand_ranges(first_col, piece_col[span_last])
+    span_length = piece_col[span_last] - first_col + 1
+    span_end = np.cumsum(span_length) - 1
+    position = span_end[span_of_piece] - span_length[span_of_piece] + 1 + piece_col - first_col[span_of_piece]
+    area = np.bincount(position, local, len(span))
+    running_dv = np.cumsum(np.bincount(position, piece_dv, len(span)))
+    area += running_dv[span_end][span] - running_dv
+
+    # edges wind one way or the other depending on the polygon, so areas take the sign of the polygon's total area
+    signed_area = np.bincount(polygon_index, (u0 + u1) / 2 * dv, len(polygons))
+    cell_polygon = piece_polygon[span_first][span]
+    row = piece_row[span_first][span]
+    fraction = np.clip(np.where(signed_area < 0, -1.0, 1.0)[cell_polygon] * area, 0, 1)
+    inside = (fraction > 1e-9) & (row >= 0) & (row < grid.num_rows) & (col >= 0) & (col < grid.num_cols)
+    cell_polygon, cells, fraction = cell_polygon[inside], row[inside] * grid.num_cols + col[inside], fraction[inside]
+    order = np.lexsort((cells, cell_polygon))
+    return cell_polygon[order], cells[order], fraction[order]
+
+
+def polygon_edges(polygons, grid):
+    """
+    Lists every edge of every ring, in grid coordinates
+    :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices
+    :param grid: RasterGrid
+    :return: Tuple of (polygon index, start column, start row, end column, end row) arrays, without horizontal edges
+    """
+    starts = []
+    ends = []
+    polygon_index = []
+    for p, rings in enumerate(polygons):
+        for ring in rings:
+            ring = np.asarray(ring, np.float64)
+            if len(ring) < 3:
+                continue
+            if ring[0, 0] != ring[-1, 0] or ring[0, 1] != ring[-1, 1]:
+                ring = np.vstack([ring, ring[:1]])
+            starts.append(ring[:-1])
+            ends.append(ring[1:])
+            polygon_index.append(np.full(len(ring) - 1, p, np.int64))
+    if not starts:
+        empty = np.zeros(0)
+        return np.zeros(0, np.int64), empty, empty, empty, empty
+
+    starts = np.vstack(starts)
+    ends = np.vstack(ends)
+    polygon_index = np.concatenate(polygon_index)
+    u0, v0 = grid.grid_coordinates(starts[:, 0], starts[:, 1])
+    u1, v1 = grid.grid_coordinates(ends[:, 0], ends[:, 1])
+    sloped = v0 != v1
+    return polygon_index[sloped], u0[sloped], v0[sloped], u1[sloped], v1[sloped]
+
+
+def polygon_areas(polygons):
+    """
+    :param polygons: List with the rings of each polygon, each ring an array of (x, y) vertices. Holes must wind the
+                     opposite way to outer rings, as they do in shapefiles
+    :return: Area of each polygon
+    """
+    areas = np.zeros(len(polygons))
+    for p, rings in enumerate(polygons):
+        for ring in rings:
+            ring = np.asarray(ring, np.float64)
+            if len(ring) >= 3:
+                x = ring[:, 0] - ring[0, 0]
+                y = ring[:, 1] - ring[0, 1]
+                areas[p] += (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2.0
+    return np.abs(areas)
+
+
+def expand_ranges(first, last):
+    """
+    Lists every integer in a set of inclusive ranges, along with the range it came from
+    :param first: First integer of each range
+    :param last: Last integer of each range. Ranges where last < first are empty
+    :return: Tuple of (range index, integer) arrays
+    """
+    lengths = np.maximum(np.asarray(last) - np.asarray(first) + 1, 0)
+    index = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    return index, first[index] + np.arange(len(index)) - starts[index]
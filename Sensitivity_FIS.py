@@ -0,0 +1,182 @@
+# -------------------------------------------------------------------------------
+# Name:        Sensitivity FIS
+# Purpose:     Reports how sensitive existing combined capacity (oCC_EX) is to each membership function breakpoint of
+#              the combined FIS, for every reach and for the whole network
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import os
+import arcpy
+import numpy as np
+import BRATCapacity
+import FISCalibration
+import FISRuleTable
+import FISSensitivity
+from SupportingFunctions import find_folder, make_folder, find_available_num_prefix, find_available_num_suffix
+reload(BRATCapacity)
+reload(FISCalibration)
+reload(FISRuleTable)
+reload(FISSensitivity)
+
+
+def main(in_network, max_DA_thresh, inputs_to_perturb=None, rule_table=None, num_samples=None, perturbation=None,
+         num_workers=None, seed=None):
+    """
+    Perturbs the breakpoints of the combined FIS, and saves a copy of the network with the mean and variance of each
+    reach's capacity, along with tables of sensitivity indices, in a new Sensitivity folder in 02_Analyses
+    :param in_network: The output of the combined FIS
+    :param max_DA_thresh: The maximum drainage area threshold used for the combined FIS
+    :param inputs_to_perturb: Semicolon separated names of the inputs whose breakpoints are perturbed. Defaults to all
+    :param rule_table: Rule table of the combined FIS. Defaults to the standard model
+    :param num_samples: Number of perturbed models to run
+    :param perturbation: How far breakpoints can move, as a fraction of their starting value
+    :param num_workers: Number of processes to run reaches in. 0 uses one per CPU core
+    :param seed: Seed for the samples, so that runs are repeatable
+    :return:
+    """
+    arcpy.env.overwriteOutput = True
+    if rule_table is None:
+        rule_table = FISRuleTable.default_rule_table('comb_fis')
+    num_samples = int(num_samples) if num_samples else FISSensitivity.DEFAULT_NUM_SAMPLES
+    perturbation = float(perturbation) if perturbation else FISSensitivity.DEFAULT_PERTURBATION
+    seed = int(seed) if seed else 0
+
+    system = FISRuleTable.load_system(rule_table)
+    if inputs_to_perturb:
+        input_names = [name.strip().strip("'") for name in inputs_to_perturb.split(';')]
+        unknown = [name for name in input_names if name not in [var.name for var in system.inputs]]
+        if unknown:
+            raise Exception(rule_table + " has no inputs called " + ", ".join(unknown))
+    else:
+        input_names = None
+    breakpoints = FISCalibration.BreakpointSet(system, input_names)
+
+    reach_ids, model = read_reaches(in_network, max_DA_thresh, system)
+    arcpy.AddMessage("Running " + str(num_samples) + " perturbed models of " + str(len(breakpoints.initial)) +
+                     " breakpoints over " + str(len(reach_ids)) + " reaches...")
+    mean, variance, explained = FISSensitivity.sensitivity(model, breakpoints, num_samples, perturbation,
+                                                           num_workers=num_workers, seed=seed, report=arcpy.AddMessage)
+    first_order = FISSensitivity.reach_indices(variance, explained)
+    indices = FISSensitivity.network_indices(variance, explained)
+
+    labels = breakpoints.labels()
+    arcpy.AddMessage("Share of the network's capacity variance caused by each breakpoint on its own:")
+    for j in np.argsort(-indices)[:5]:
+        arcpy.AddMessage("    " + labels[j] + ": " + str(round(indices[j], 3)))
+    arcpy.AddMessage("    All breakpoints: " + str(round(np.sum(indices), 3)) +
+                     " (the rest comes from breakpoints acting together)")
+
+    output_folder = make_sensitivity_folder(in_network)
+    lower, upper = FISSensitivity.sample_bounds(breakpoints, perturbation)
+    write_network_indices(os.path.join(output_folder, "Sensitivity_Indices.csv"), labels, breakpoints.initial,
+                          lower, upper, indices)
+    write_reach_indices(os.path.join(output_folder, "Reach_Sensitivity.csv"), labels, reach_ids, mean, variance,
+                        first_order)
+    out_network = os.path.join(output_folder, "FIS_Sensitivity.shp")
+    arcpy.CopyFeatures_management(in_network, out_network)
+    add_sensitivity_fields(out_network, labels, reach_ids, mean, variance, first_order)
+    arcpy.AddMessage("Sensitivity results saved in " + output_folder)
+
+    if not FISSensitivity.index_sum_ok(indices):
+        arcpy.AddWarning("The first-order indices sum to " + str(round(np.sum(indices), 3)) + ", but they can't sum "
+                         "to more than 1 if the breakpoints are sampled independently, so they are mostly sampling "
+                         "noise. Run more samples to get reliable indices")
+
+
+def read_reaches(in_network, max_DA_thresh, system):
+    """
+    Reads the combined FIS inputs of every reach
+    :param in_network: The output of the combined FIS
+    :param max_DA_thresh: The maximum drainage area threshold used for the combined FIS
+    :param system: The combined FIS
+    :return: Tuple of (array of ReachID, FISCalibration.CapacityModel)
+    """
+    fields = ['ReachID', 'oVC_EX', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope', 'iGeo_DA']
+    network_fields = [f.name for f in arcpy.ListFields(in_network)]
+    missing = [field for field in fields if field not in network_fields]
+    if missing:
+        raise Exception(in_network + " is missing the fields " + ", ".join(missing) +
+                        ". Sensitivity analysis needs the output of the combined FIS")
+
+    data = arcpy.da.FeatureClassToNumPyArray(in_network, fields)
+    comb_inputs = BRATCapacity.comb_inputs_in_range(*[np.asarray(data[field], np.float64) for field in
+                                                      ['oVC_EX', 'iHyd_SP2', 'iHyd_SPLow', 'iGeo_Slope']])
+    model = FISCalibration.CapacityModel(system, comb_inputs, np.asarray(data['iGeo_DA'], np.float64), max_DA_thresh)
+    return np.asarray(data['ReachID'], np.int64), model
+
+
+def make_sensitivity_folder(in_network):
+    """
+    Makes a new numbered folder for this sensitivity run in 02_Analyses
+    :param in_network: The output of the combined FIS
+    :return: Path to the new folder
+    """
+    analysis_folder = os.path.dirname(in_network)
+    sensitivity_folder = find_folder(analysis_folder, "FIS_Sensitivity")
+    if sensitivity_folder is None:
+        sensitivity_folder = make_folder(analysis_folder, find_available_num_prefix(analysis_folder) +
+                                         "_FIS_Sensitivity")
+    return make_folder(sensitivity_folder, "Sensitivity" + find_available_num_suffix(sensitivity_folder))
+
+
+def write_network_indices(table_file, labels, initial, lower, upper, indices):
+    """
+    Writes the range each breakpoint was perturbed over and its first-order index for the whole network
+    :param table_file: Path to the CSV file to write
+    :param labels: Label of each breakpoint
+    :param initial: Starting value of each breakpoint
+    :param lower: Lowest value of each breakpoint
+    :param upper: Highest value of each breakpoint
+    :param indices: First-order index of each breakpoint
+    :return:
+    """
+    with open(table_file, 'w') as f:
+        f.write("Breakpoint,Start,Low,High,First_Order\n")
+        for j in np.argsort(-indices):
+            f.write(','.join([labels[j]] + [repr(float(v[j])) for v in [initial, lower, upper, indices]]) + '\n')
+
+
+def write_reach_indices(table_file, labels, reach_ids, mean, variance, first_order):
+    """
+    Writes the mean and variance of each reach's capacity and the first-order index of every breakpoint for it
+    :param table_file: Path to the CSV file to write
+    :param labels: Label of each breakpoint
+    :param reach_ids: ReachID of each reach
+    :param mean: Mean capacity of each reach
+    :param variance: Capacity variance of each reach
+    :param first_order: First-order indices, with one row per breakpoint and one column per reach
+    :return:
+    """
+    columns = np.column_stack([reach_ids, mean, variance, first_order.T])
+    np.savetxt(table_file, columns, delimiter=",", fmt=['%d'] + ['%.6g'] * (columns.shape[1] - 1),
+               header=','.join(['ReachID', 'oCC_Mean', 'oCC_Var'] + labels), comments="")
+
+
+def add_sensitivity_fields(out_network, labels, reach_ids, mean, variance, first_order):
+    """
+    Adds the mean and variance of each reach's capacity to the network, along with the breakpoint with the largest
+    first-order index for that reach
+    :param out_network: The network to add fields to
+    :param labels: Label of each breakpoint
+    :param reach_ids: ReachID of each reach
+    :param mean: Mean capacity of each reach
+    :param variance: Capacity variance of each reach
+    :param first_order: First-order indices, with one row per breakpoint and one column per reach
+    :return:
+    """
+    top = np.argmax(first_order, axis=0)
+    tblDict = {}
+    for i, reach_id in enumerate(reach_ids):
+        top_label = labels[top[i]] if variance[i] > 0 else "None"
+        tblDict[reach_id] = (float(mean[i]), float(variance[i]), top_label, float(first_order[top[i], i]))
+
+    for field, field_type in [('oCC_Mean', 'DOUBLE'), ('oCC_Var', 'DOUBLE'), ('oCC_TopBP', 'TEXT'),
+                              ('oCC_TopSI', 'DOUBLE')]:
+        arcpy.AddField_management(out_network, field, field_type)
+    with arcpy.da.UpdateCursor(out_network, ['ReachID', 'oCC_Mean', 'oCC_Var', 'oCC_TopBP', 'oCC_TopSI']) as cursor:
+        for row in cursor:
+            if row[0] in tblDict:
+                row[1:] = tblDict[row[0]]
+                cursor.updateRow(row)
+    tblDict.clear()
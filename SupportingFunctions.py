@@ -10,6 +10,7 @@
 import os
 import arcpy
 import uuid
+import numpy as np
 
 
 def find_folder(folder_location, folder_name):
@@ -168,3 +169,66 @@ def write_xml_element_with_path(xml_file, base_element, xml_element_name, item_n
     xml_file.add_sub_element(new_element, "Name", item_name)
     relative_path = find_relative_path(path, project_root)
     xml_file.add_sub_element(new_element, "Path", relative_path)
+
+
+def read_lines(line_fc, fields=None):
+    """
+    Reads the vertices of every line, or the rings of every polygon, along with the values of any other fields
+    :param line_fc: Lines or polygons to read
+    :param fields: Other fields to read for each feature, e.g. ['ReachID']
+    :return: Tuple of (list with a tuple of the other fields' values for each feature, list with a list of (x, y)
+             vertex arrays for each feature, one per part or ring)
+    """
+    if fields is None:
+        fields = []
+    rows = []
+    lines = []
+    with arcpy.da.SearchCursor(line_fc, list(fields) + ['SHAPE@']) as cursor:
+        for row in cursor:
+            rows.append(tuple(row[:-1]))
+            lines.append(shape_parts(row[-1]))
+    return rows, lines
+
+
+def read_feature_parts(feature_fc):
+    """
+    Reads the vertices of every part of every feature, without keeping track of which feature they came from. Each
+    point of point and multipoint features is its own part
+    :param feature_fc: Point, multipoint, line or polygon features
+    :return: List of (x, y) vertex arrays
+    """
+    shape_type = arcpy.Describe(feature_fc).shapeType
+    parts = []
+    with arcpy.da.SearchCursor(feature_fc, ['SHAPE@']) as cursor:
+        for row in cursor:
+            shape = row[0]
+            if shape is None:
+                continue
+            if shape_type == 'Point':
+                parts.append(np.array([(shape.firstPoint.X, shape.firstPoint.Y)]))
+            elif shape_type == 'Multipoint':
+                parts.extend(np.array([(point.X, point.Y)]) for point in shape)
+            else:
+                parts.extend(shape_parts(shape))
+    return parts
+
+
+def shape_parts(shape):
+    """
+    Reads the vertices of each part of a line or polygon. Polygon parts hold their interior rings after a None, and
+    are split there
+    :param shape: A line or polygon geometry, or None
+    :return: List of (x, y) vertex arrays, one per part or ring
+    """
+    parts = []
+    if shape is not None:
+        for part in shape:
+            ring = []
+            for point in part:
+                if point is None:
+                    parts.append(np.array(ring))
+                    ring = []
+                else:
+                    ring.append((point.X, point.Y))
+            parts.append(np.array(ring))
+    return parts
@@ -1,6 +1,11 @@
 import arcpy
 import os
+import sys
+import math
 import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import NetworkGeometry
+from SupportingFunctions import read_lines
 
 
 input_stream = None
@@ -35,41 +40,16 @@ def addReachDist(given_stream):
             row[1] = row[0]
             cursor.updateRow(row)
 
-    # get distance along route (LineID) for segment midpoints
-    midpoints = arcpy.FeatureVerticesToPoints_management(given_stream, 'in_memory/midpoints', "MID")
+    # get distance along each stream (StreamID) to segment midpoints
+    rows, lines = read_lines(given_stream, ['StreamID'])
+    reach_dists = NetworkGeometry.reach_distances([row[0] for row in rows], lines)
 
-    seg_network_dissolve = arcpy.Dissolve_management(given_stream, 'in_memory/seg_network_dissolve', 'StreamID', '',
-                                                     'SINGLE_PART', 'UNSPLIT_LINES')
-
-    arcpy.AddField_management(seg_network_dissolve, 'From_', 'DOUBLE')
-    arcpy.AddField_management(seg_network_dissolve, 'To_', 'DOUBLE')
-    with arcpy.da.UpdateCursor(seg_network_dissolve, ['SHAPE@Length', 'From_', 'To_']) as cursor:
-        for row in cursor:
-            row[1] = 0.0
-            row[2] = row[0]
-            cursor.updateRow(row)
-
-    arcpy.CreateRoutes_lr(seg_network_dissolve, 'StreamID', 'in_memory/flowline_route', 'TWO_FIELDS', 'From_', 'To_')
-    routeTbl = arcpy.LocateFeaturesAlongRoutes_lr(midpoints, 'in_memory/flowline_route', 'StreamID',
-                                                  1.0,
-                                                  os.path.join(os.path.dirname(given_stream), 'tbl_Routes.dbf'),
-                                                  'RID POINT MEAS')
-
-    distDict = {}
-    # add reach id distance values to dictionary
-    with arcpy.da.SearchCursor(routeTbl, ['ReachID', 'MEAS']) as cursor:
-        for row in cursor:
-            distDict[row[0]] = row[1]
-
-    # populate dictionary value to output field by ReachID
     arcpy.AddField_management(given_stream, 'ReachDist', 'DOUBLE')
-    with arcpy.da.UpdateCursor(given_stream, ['ReachID', 'ReachDist']) as cursor:
-        for row in cursor:
-            aKey = row[0]
-            row[1] = distDict[aKey]
-            cursor.updateRow(row)
-
-    arcpy.Delete_management('in_memory')
+    with arcpy.da.UpdateCursor(given_stream, ['ReachDist']) as cursor:
+        for row, reach_dist in zip(cursor, reach_dists.tolist()):
+            if not math.isnan(reach_dist):  # reaches without a line don't get one
+                row[0] = reach_dist
+                cursor.updateRow(row)
 
 
 if __name__ == '__main__':
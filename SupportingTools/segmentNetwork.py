@@ -13,7 +13,12 @@
 # -------------------------------------------------------------------------------
 
 import os
+import sys
+import math
 import arcpy
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import NetworkGeometry
+from SupportingFunctions import read_lines
 
 # User defined arguments:
 
@@ -141,35 +146,16 @@ def main(nhd_flowline_path, outpath):
             ct += 1
             cursor.updateRow(row)
 
-    # get distance along route (LineID) for segment midpoints
-    midpoints =  arcpy.FeatureVerticesToPoints_management(flowline_seg, 'in_memory/midpoints', "MID")
+    # get distance along each stream (StreamID) to segment midpoints
+    rows, lines = read_lines(flowline_seg, ['StreamID'])
+    reach_dists = NetworkGeometry.reach_distances([row[0] for row in rows], lines)
 
-    arcpy.AddField_management(flowline_network, 'From_', 'DOUBLE')
-    arcpy.AddField_management(flowline_network, 'To_', 'DOUBLE')
-    with arcpy.da.UpdateCursor(flowline_network, ['StreamLen', 'From_', 'To_']) as cursor:
-        for row in cursor:
-            row[1] = 0.0
-            row[2] = row[0]
-            cursor.updateRow(row)
-
-    arcpy.CreateRoutes_lr(flowline_network, 'StreamID', 'in_memory/flowline_route', 'TWO_FIELDS', 'From_', 'To_')
-    routeTbl = arcpy.LocateFeaturesAlongRoutes_lr(midpoints, 'in_memory/flowline_route', 'StreamID',
-                                                   1.0, os.path.join(os.path.dirname(outpath), 'tbl_Routes.dbf'),
-                                                   'RID POINT MEAS')
-
-    distDict = {}
-    # add reach id distance values to dictionary
-    with arcpy.da.SearchCursor(routeTbl, ['ReachID', 'MEAS']) as cursor:
-        for row in cursor:
-            distDict[row[0]] = row[1]
-
-    # populate dictionary value to output field by ReachID
     arcpy.AddField_management(flowline_seg, 'ReachDist', 'DOUBLE')
-    with arcpy.da.UpdateCursor(flowline_seg, ['ReachID', 'ReachDist']) as cursor:
-        for row in cursor:
-            aKey = row[0]
-            row[1] = distDict[aKey]
-            cursor.updateRow(row)
+    with arcpy.da.UpdateCursor(flowline_seg, ['ReachDist']) as cursor:
+        for row, reach_dist in zip(cursor, reach_dists.tolist()):
+            if not math.isnan(reach_dist):  # reaches without a line don't get one
+                row[0] = reach_dist
+                cursor.updateRow(row)
 
     # save flowline segment output
     arcpy.CopyFeatures_management(flowline_seg, outpath)
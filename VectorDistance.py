@@ -0,0 +1,307 @@
+# -------------------------------------------------------------------------------
+# Name:        Vector Distance
+# Purpose:     Finds the distance from points along each reach to the nearest infrastructure feature straight from the
+#              features' geometry, without a distance raster over the whole network
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+#
+# Each reach is sampled every DEFAULT_SPACING meters, including both of its ends, and each sample point gets the
+# distance to the nearest segment of the features (points, like road crossings, are segments of length 0). A reach's
+# mean distance weights each point by the length of line it stands for, so unevenly spaced points at the ends of
+# parts don't skew it, and its minimum is the smallest distance of any of its points. Memory grows with the number of
+# points and segments, not with the area the network covers.
+#
+# Nearest segments are found with a shapely STRtree when shapely 2 is installed. ArcMap's Python doesn't have shapely,
+# so SegmentIndex falls back to a pyramid of grids in plain NumPy: each point looks for segments in the 3x3 cells
+# around it, starting with small cells, and moves up to cells twice the size until the nearest segment it finds is
+# closer than any segment outside those cells could be. Both give the exact distance to the nearest segment.
+
+import numpy as np
+
+try:
+    import shapely
+    HAVE_SHAPELY = hasattr(shapely, 'STRtree') and hasattr(shapely.STRtree, 'query_nearest')
+except ImportError:
+    shapely = None
+    HAVE_SHAPELY = False
+
+
+DEFAULT_SPACING = 5.0  # meters between points sampled along each reach, the cell size EucDistance was run with
+CHUNK_PAIRS = 2000000  # most point and segment pairs compared at once by the NumPy index
+
+
+def sample_lines(lines, spacing=DEFAULT_SPACING):
+    """
+    Places points along lines, evenly spaced along each part, including both ends
+    :param lines: List with a list of (x, y) vertex arrays for each line, one array per part
+    :param spacing: Largest distance between points along a part
+    :return: Tuple of (index of the line each point is on, X coordinates, Y coordinates, length of line each point
+             stands for), with the points of each line together
+    """
+    line_index = []
+    xs = []
+    ys = []
+    weights = []
+    for i, parts in enumerate(lines):
+        for part in parts:
+            part = np.asarray(part, np.float64).reshape(-1, 2)
+            if len(part) == 0:
+                continue
+            lengths = np.hypot(np.diff(part[:, 0]), np.diff(part[:, 1]))
+            along = np.concatenate([[0.0], np.cumsum(lengths)])
+            num_pieces = max(int(np.ceil(along[-1] / spacing)), 1)
+            distance = np.linspace(0.0, along[-1], num_pieces + 1)
+            weight = np.full(num_pieces + 1, along[-1] / num_pieces)
+            weight[[0, -1]] /= 2.0
+            line_index.append(np.full(num_pieces + 1, i, np.int64))
+            xs.append(np.interp(distance, along, part[:, 0]))
+            ys.append(np.interp(distance, along, part[:, 1]))
+            weights.append(weight)
+    if not line_index:
+        return np.zeros(0, np.int64), np.zeros(0), np.zeros(0), np.zeros(0)
+    line_index = np.concatenate(line_index)
+    weights = np.concatenate(weights)
+    # lines of length 0 weight their points equally instead
+    weights[np.bincount(line_index, weights, len(lines))[line_index] == 0] = 1.0
+    return line_index, np.concatenate(xs), np.concatenate(ys), weights
+
+
+def line_segments(lines):
+    """
+    Splits lines into their segments, and points into segments of length 0
+    :param lines: List of (x, y) vertex arrays, one per part of each feature
+    :return: Tuple of (start X, start Y, end X, end Y) arrays
+    """
+    starts = []
+    ends = []
+    for part in lines:
+        part = np.asarray(part, np.float64).reshape(-1, 2)
+        if len(part) == 1:
+            starts.append(part)
+            ends.append(part)
+        elif len(part) > 1:
+            starts.append(part[:-1])
+            ends.append(part[1:])
+    if not starts:
+        return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0)
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def point_segment_distance(x, y, x0, y0, x1, y1):
+    """
+    :return: Distance from each point to the segment paired with it
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    length_sq = dx * dx + dy * dy
+    t = np.zeros(np.broadcast(x, x0).shape)
+    np.divide((x - x0) * dx + (y - y0) * dy, length_sq, out=t, where=length_sq > 0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(x - (x0 + t * dx), y - (y0 + t * dy))
+
+
+def cell_pieces(x0, y0, x1, y1, left, bottom, cell, margin=0.0):
+    """
+    Splits segments into pieces no longer than a cell and lists the cells each piece's bounding box covers, which is at
+    most 2 cells across and 2 down when there is no margin
+    :param left: X coordinate of the left edge of the cells
+    :param bottom: Y coordinate of the bottom edge of the cells
+    :param cell: Width of each cell
+    :param margin: Distance to grow each piece's bounding box by on every side
+    :return: Tuple of (segment index, piece start X, start Y, end X, end Y, cell row, cell column) arrays, with an
+             entry for each cell of each piece. Rows count up from bottom
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    num_pieces = np.maximum(np.ceil(np.hypot(dx, dy) / cell), 1).astype(np.int64)
+    segment = np.repeat(np.arange(len(x0)), num_pieces)
+    piece = np.arange(len(segment)) - (np.cumsum(num_pieces) - num_pieces)[segment]
+    t0 = piece / num_pieces[segment].astype(np.float64)
+    t1 = (piece + 1) / num_pieces[segment].astype(np.float64)
+    px0 = x0[segment] + t0 * dx[segment]
+    py0 = y0[segment] + t0 * dy[segment]
+    px1 = x0[segment] + t1 * dx[segment]
+    py1 = y0[segment] + t1 * dy[segment]
+
+    first_col = np.floor((np.minimum(px0, px1) - margin - left) / cell).astype(np.int64)
+    last_col = np.floor((np.maximum(px0, px1) + margin - left) / cell).astype(np.int64)
+    first_row = np.floor((np.minimum(py0, py1) - margin - bottom) / cell).astype(np.int64)
+    last_row = np.floor((np.maximum(py0, py1) + margin - bottom) / cell).astype(np.int64)
+    steps = range(2 + int(np.ceil(2.0 * margin / cell)))
+    pieces = []
+    rows = []
+    cols = []
+    for row_step in steps:
+        for col_step in steps:
+            inside = np.flatnonzero((first_row + row_step <= last_row) & (first_col + col_step <= last_col))
+            pieces.append(inside)
+            rows.append(first_row[inside] + row_step)
+            cols.append(first_col[inside] + col_step)
+    pieces = np.concatenate(pieces)
+    return (segment[pieces], px0[pieces], py0[pieces], px1[pieces], py1[pieces], np.concatenate(rows),
+            np.concatenate(cols))
+
+
+class SegmentIndex(object):
+    """
+    Finds the nearest of a set of segments to each of many points
+    """
+    def __init__(self, x0, y0, x1, y1, use_shapely=None):
+        """
+        :param x0: X coordinate of the start of each segment
+        :param y0: Y coordinate of the start of each segment
+        :param x1: X coordinate of the end of each segment
+        :param y1: Y coordinate of the end of each segment
+        :param use_shapely: True to use a shapely STRtree, False for the NumPy grids. Defaults to shapely if it is
+                            installed
+        """
+        self.x0, self.y0, self.x1, self.y1 = [np.asarray(v, np.float64) for v in (x0, y0, x1, y1)]
+        self.use_shapely = HAVE_SHAPELY if use_shapely is None else use_shapely
+        self.tree = None
+        self.levels = {}
+        if len(self.x0) == 0:
+            return
+        if self.use_shapely:
+            self.tree = shapely.STRtree(shapely.linestrings(np.stack([np.column_stack([self.x0, self.y0]),
+                                                                      np.column_stack([self.x1, self.y1])], axis=1)))
+        else:
+            self.left = min(self.x0.min(), self.x1.min())
+            self.bottom = min(self.y0.min(), self.y1.min())
+            # the smallest cells are about a segment long, or for points, about as wide as the space around each
+            lengths = np.hypot(self.x1 - self.x0, self.y1 - self.y0)
+            area = (max(self.x0.max(), self.x1.max()) - self.left) * (max(self.y0.max(), self.y1.max()) - self.bottom)
+            self.base_cell = max(float(np.median(lengths)), np.sqrt(area / len(self.x0)),
+                                 1e-6 * max(np.abs([self.left, self.bottom]).max(), 1.0))
+
+    def distance(self, x, y):
+        """
+        :param x: X coordinate of each point
+        :param y: Y coordinate of each point
+        :return: Distance from each point to the nearest segment, or infinity if there are no segments
+        """
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        best = np.full(len(x), np.inf)
+        if len(self.x0) == 0 or len(x) == 0:
+            return best
+        if self.use_shapely:
+            (point_index, segment_index), distance = self.tree.query_nearest(shapely.points(x, y),
+                                                                             return_distance=True)
+            np.minimum.at(best, point_index, distance)
+            return best
+
+        # the 3x3 cells around a point hold every segment within one cell size of it, so once the nearest segment in
+        # them is that close, no segment further out can be nearer
+        span = max(x.max(), self.x0.max(), self.x1.max()) - min(x.min(), self.left)
+        span = max(span, max(y.max(), self.y0.max(), self.y1.max()) - min(y.min(), self.bottom))
+        todo = np.arange(len(x))
+        level = 0
+        while len(todo) > 0:
+            cell = self.base_cell * 2 ** level
+            found = self._nearest_in_cells(x[todo], y[todo], level)
+            best[todo] = found
+            if cell >= span:
+                break
+            todo = todo[~(found <= cell)]
+            level += 1
+        return best
+
+    def _grid(self, level):
+        """
+        Splits the segments into pieces no longer than the cell size of a level and lists the cells each covers
+        :return: Tuple of (cell size, number of columns, number of rows, sorted cell keys, first piece in each cell,
+                 piece start X, start Y, end X, end Y and segment index ordered by cell)
+        """
+        if level in self.levels:
+            return self.levels[level]
+        cell = self.base_cell * 2 ** level
+        segment, px0, py0, px1, py1, row, col = cell_pieces(self.x0, self.y0, self.x1, self.y1, self.left,
+                                                            self.bottom, cell)
+        num_cols = int(col.max()) + 1
+        keys = row * num_cols + col
+        order = np.argsort(keys, kind='mergesort')
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+        starts = np.append(starts, len(keys))
+        grid = (cell, num_cols, int(row.max()) + 1, cell_keys, starts,
+                px0[order], py0[order], px1[order], py1[order], segment[order])
+        self.levels[level] = grid
+        return grid
+
+    def candidate_pairs(self, x0, y0, x1, y1, distance=0.0):
+        """
+        Finds pairs of query segments and indexed segments that might be within a distance of each other, or intersect.
+        With shapely these are exactly the pairs that are; otherwise they are the pairs that pass through the same grid
+        cell, and include them all
+        :param x0: X coordinate of the start of each query segment
+        :param y0: Y coordinate of the start of each query segment
+        :param x1: X coordinate of the end of each query segment
+        :param y1: Y coordinate of the end of each query segment
+        :param distance: Largest distance between the segments of a pair
+        :return: Tuple of (query segment index, indexed segment index) arrays, without repeats
+        """
+        x0, y0, x1, y1 = [np.asarray(v, np.float64) for v in (x0, y0, x1, y1)]
+        if len(self.x0) == 0 or len(x0) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        if self.use_shapely:
+            lines = shapely.linestrings(np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y1])], axis=1))
+            if distance > 0:
+                query, indexed = self.tree.query(lines, predicate='dwithin', distance=distance)
+            else:
+                query, indexed = self.tree.query(lines, predicate='intersects')
+            return query.astype(np.int64), indexed.astype(np.int64)
+
+        cell, num_cols, num_rows, cell_keys, starts = self._grid(0)[:5]
+        indexed_segment = self._grid(0)[-1]
+        query, qx0, qy0, qx1, qy1, row, col = cell_pieces(x0, y0, x1, y1, self.left, self.bottom, cell, distance)
+        on_grid = (row >= 0) & (row < num_rows) & (col >= 0) & (col < num_cols)
+        query, keys = query[on_grid], row[on_grid] * num_cols + col[on_grid]
+        position = np.minimum(np.searchsorted(cell_keys, keys), len(cell_keys) - 1)
+        has_pieces = cell_keys[position] == keys
+        query, position = query[has_pieces], position[has_pieces]
+        counts = starts[position + 1] - starts[position]
+        pair_query = np.repeat(query, counts)
+        pair_piece = np.repeat(starts[position] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        pairs = np.unique(pair_query * len(self.x0) + indexed_segment[pair_piece])
+        return pairs // len(self.x0), pairs % len(self.x0)
+
+    def _nearest_in_cells(self, x, y, level):
+        """
+        :return: Distance from each point to the nearest segment in the 3x3 cells around it at a level, or infinity
+        """
+        cell, num_cols, num_rows, cell_keys, starts, px0, py0, px1, py1 = self._grid(level)[:9]
+        col = np.floor((x - self.left) / cell).astype(np.int64)
+        row = np.floor((y - self.bottom) / cell).astype(np.int64)
+        point_index = []
+        first_piece = []
+        num_in_cell = []
+        for row_step in [-1, 0, 1]:
+            for col_step in [-1, 0, 1]:
+                r = row + row_step
+                c = col + col_step
+                on_grid = np.flatnonzero((r >= 0) & (r < num_rows) & (c >= 0) & (c < num_cols))
+                keys = r[on_grid] * num_cols + c[on_grid]
+                position = np.minimum(np.searchsorted(cell_keys, keys), len(cell_keys) - 1)
+                has_pieces = cell_keys[position] == keys
+                point_index.append(on_grid[has_pieces])
+                first_piece.append(starts[position[has_pieces]])
+                num_in_cell.append(starts[position[has_pieces] + 1] - starts[position[has_pieces]])
+        point_index = np.concatenate(point_index)
+        first_piece = np.concatenate(first_piece)
+        num_in_cell = np.concatenate(num_in_cell)
+
+        best = np.full(len(x), np.inf)
+        # compare points with the pieces in their cells a chunk at a time, so the pairs fit in memory
+        pairs_before = np.concatenate([[0], np.cumsum(num_in_cell)])
+        chunk_starts = np.searchsorted(pairs_before, np.arange(0, pairs_before[-1], CHUNK_PAIRS), side='right') - 1
+        for start, end in zip(chunk_starts, np.append(chunk_starts[1:], len(point_index))):
+            counts = num_in_cell[start:end]
+            pair_point = np.repeat(point_index[start:end], counts)
+            pair_piece = (np.repeat(first_piece[start:end] - (np.cumsum(counts) - counts), counts) +
+                          np.arange(counts.sum()))
+            distance = point_segment_distance(x[pair_point], y[pair_point], px0[pair_piece], py0[pair_piece],
+                                              px1[pair_piece], py1[pair_piece])
+            np.minimum.at(best, pair_point, distance)
+        return best
@@ -15,10 +15,41 @@ from skfuzzy import control as ctrl
 import numpy as np
 import os
 import sys
+import BatchFIS
+import FISCache
+import FISLookup
+import FISRuleTable
+import ParallelFIS
 from SupportingFunctions import make_folder, make_layer, find_available_num_prefix
+reload(BatchFIS)
+reload(FISCache)
+reload(FISLookup)
+reload(FISRuleTable)
+reload(ParallelFIS)
 
 
-def main(in_network):
+def main(in_network, fis_method=None, rule_table=None, num_workers=None, use_cache=None):
+    """
+    Runs the vegetation FIS for historic and existing vegetation
+    :param in_network: The network we want to add vegetation capacity to
+    :param fis_method: "batch" (the default) evaluates every reach at once with BatchFIS, "lut" interpolates a
+                       precomputed response surface from FISLookup, and "skfuzzy" runs the original reach-by-reach
+                       skfuzzy loop as a reference
+    :param rule_table: FIS rule table file to use instead of FISRules/veg_fis.csv, e.g. a regional variant. The
+                       skfuzzy reference always runs the standard model
+    :param num_workers: Number of processes to split batch evaluation across. None or 1 runs in this process, and 0
+                        uses one process per CPU core
+    :param use_cache: True to look up batch results in the FISCache before evaluating
+    :return:
+    """
+    fis_method = BatchFIS.parse_fis_method(fis_method)
+    use_cache = FISCache.parse_use_cache(use_cache)
+    if rule_table is None:
+        rule_table = FISRuleTable.default_rule_table('veg_fis')
+    elif fis_method == 'skfuzzy':
+        arcpy.AddWarning("The skfuzzy reference runs the standard vegetation FIS, not " + rule_table)
+    veg_system = FISRuleTable.load_system(rule_table)
+    num_workers = ParallelFIS.resolve_num_workers(num_workers)
 
     scratch = 'in_memory'
 
@@ -65,69 +96,9 @@ def main(in_network):
         for item in items:
             del item
 
-        # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-        riparian = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input1')
-        streamside = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input2')
-        density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
-
-        # build membership functions for each antecedent and consequent object
-        riparian['unsuitable'] = fuzz.trapmf(riparian.universe, [0, 0, 0.1, 1])
-        riparian['barely'] = fuzz.trimf(riparian.universe, [0.1, 1, 2])
-        riparian['moderately'] = fuzz.trimf(riparian.universe, [1, 2, 3])
-        riparian['suitable'] = fuzz.trimf(riparian.universe, [2, 3, 4])
-        riparian['preferred'] = fuzz.trimf(riparian.universe, [3, 4, 4])
-
-        streamside['unsuitable'] = fuzz.trapmf(streamside.universe, [0, 0, 0.1, 1])
-        streamside['barely'] = fuzz.trimf(streamside.universe, [0.1, 1, 2])
-        streamside['moderately'] = fuzz.trimf(streamside.universe, [1, 2, 3])
-        streamside['suitable'] = fuzz.trimf(streamside.universe, [2, 3, 4])
-        streamside['preferred'] = fuzz.trimf(streamside.universe, [3, 4, 4])
-
-        density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-        density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-        density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-        density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-        density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
-
-        # build fis rule table
-        rule1 = ctrl.Rule(riparian['unsuitable'] & streamside['unsuitable'], density['none'])
-        rule2 = ctrl.Rule(riparian['barely'] & streamside['unsuitable'], density['rare'])
-        rule3 = ctrl.Rule(riparian['moderately'] & streamside['unsuitable'], density['rare'])
-        rule4 = ctrl.Rule(riparian['suitable'] & streamside['unsuitable'], density['occasional'])
-        rule5 = ctrl.Rule(riparian['preferred'] & streamside['unsuitable'], density['occasional'])
-        rule6 = ctrl.Rule(riparian['unsuitable'] & streamside['barely'], density['rare'])
-        rule7 = ctrl.Rule(riparian['barely'] & streamside['barely'], density['rare']) # matBRAT has consequnt as 'occasional'
-        rule8 = ctrl.Rule(riparian['moderately'] & streamside['barely'], density['occasional'])
-        rule9 = ctrl.Rule(riparian['suitable'] & streamside['barely'], density['occasional'])
-        rule10 = ctrl.Rule(riparian['preferred'] & streamside['barely'], density['occasional'])
-        rule11 = ctrl.Rule(riparian['unsuitable'] & streamside['moderately'], density['rare'])
-        rule12 = ctrl.Rule(riparian['barely'] & streamside['moderately'], density['occasional'])
-        rule13 = ctrl.Rule(riparian['moderately'] & streamside['moderately'], density['occasional'])
-        rule14 = ctrl.Rule(riparian['suitable'] & streamside['moderately'], density['frequent'])
-        rule15 = ctrl.Rule(riparian['preferred'] & streamside['moderately'], density['frequent'])
-        rule16 = ctrl.Rule(riparian['unsuitable'] & streamside['suitable'], density['occasional'])
-        rule17 = ctrl.Rule(riparian['barely'] & streamside['suitable'], density['occasional'])
-        rule18 = ctrl.Rule(riparian['moderately'] & streamside['suitable'], density['frequent'])
-        rule19 = ctrl.Rule(riparian['suitable'] & streamside['suitable'], density['frequent'])
-        rule20 = ctrl.Rule(riparian['preferred'] & streamside['suitable'], density['pervasive'])
-        rule21 = ctrl.Rule(riparian['unsuitable'] & streamside['preferred'], density['occasional'])
-        rule22 = ctrl.Rule(riparian['barely'] & streamside['preferred'], density['frequent'])
-        rule23 = ctrl.Rule(riparian['moderately'] & streamside['preferred'], density['pervasive'])
-        rule24 = ctrl.Rule(riparian['suitable'] & streamside['preferred'], density['pervasive'])
-        rule25 = ctrl.Rule(riparian['preferred'] & streamside['preferred'], density['pervasive'])
-
-        # FIS
-        veg_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10, rule11,
-                                       rule12, rule13, rule14, rule15, rule16, rule17, rule18, rule19, rule20, rule21, rule22, rule23, rule24, rule25])
-        veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
-
         # run fuzzy inference system on inputs and defuzzify output
-        out = np.zeros(len(riparian_array))
-        for i in range(len(out)):
-            veg_fis.input['input1'] = riparian_array[i]
-            veg_fis.input['input2'] = streamside_array[i]
-            veg_fis.compute()
-            out[i] = veg_fis.output['result']
+        out = evaluate_veg_fis(veg_system, rule_table, [riparian_array, streamside_array], fis_method, num_workers,
+                               use_cache)
 
         # save fuzzy inference system output as table
         columns = np.column_stack((segid_array, out))
@@ -186,6 +157,120 @@ def main(in_network):
     makeLayers(in_network)
 
 
+def evaluate_veg_fis(veg_system, rule_table, input_arrays, fis_method='batch', num_workers=1, use_cache=False):
+    """
+    Runs the vegetation FIS for every reach with the chosen evaluation method
+    :param veg_system: The BatchFIS.MamdaniSystem compiled from the rule table
+    :param rule_table: The FISRuleTable file that defines the model
+    :param input_arrays: Riparian and streamside vegetation arrays, already put in range
+    :param fis_method: "batch", "lut" or "skfuzzy" (see BatchFIS.parse_fis_method)
+    :param num_workers: Number of processes to split batch evaluation across
+    :param use_cache: True to look up batch results in the FISCache, and only evaluate inputs that aren't in it
+    :return: Array of defuzzified vegetation capacities
+    """
+    if fis_method == 'skfuzzy':
+        return run_skfuzzy_fis(input_arrays[0], input_arrays[1])
+    elif fis_method == 'lut':
+        surface_name = os.path.splitext(os.path.basename(rule_table))[0]
+        surface = FISLookup.get_surface(veg_system, surface_name)
+        out = surface.evaluate(input_arrays, veg_system)
+        max_error, mean_error = FISLookup.compare_to_direct(veg_system, surface, input_arrays)
+        arcpy.AddMessage("Using the vegetation FIS lookup table (error for sampled reaches compared with direct "
+                         "evaluation: max " + str(round(max_error, 4)) + ", mean " + str(round(mean_error, 4)) +
+                         " dams/km)")
+        if max_error > FISLookup.CELL_TOLERANCE:
+            arcpy.AddWarning("The vegetation FIS lookup table was off by up to " + str(round(max_error, 4)) +
+                             " dams/km for the sampled reaches. Use the batch method instead")
+        return out
+
+    def evaluate(arrays):
+        if num_workers > 1:
+            return ParallelFIS.evaluate(rule_table, arrays, num_workers)
+        return veg_system.evaluate(arrays)
+
+    if use_cache:
+        cache = FISCache.FISCache(veg_system, os.path.splitext(os.path.basename(rule_table))[0])
+        out = cache.evaluate(input_arrays, evaluate)
+        cache.save()
+        arcpy.AddMessage("Vegetation FIS cache: " + cache.summary())
+        return out
+    return evaluate(input_arrays)
+
+
+def run_skfuzzy_fis(riparian_array, streamside_array):
+    """
+    Runs the vegetation FIS one reach at a time with skfuzzy. Kept as the reference the batch evaluator is checked against
+    :param riparian_array: Array of riparian (100 m buffer) vegetation values
+    :param streamside_array: Array of streamside (30 m buffer) vegetation values
+    :return: Array of defuzzified vegetation capacities
+    """
+    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
+    riparian = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input1')
+    streamside = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input2')
+    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
+
+    # build membership functions for each antecedent and consequent object
+    riparian['unsuitable'] = fuzz.trapmf(riparian.universe, [0, 0, 0.1, 1])
+    riparian['barely'] = fuzz.trimf(riparian.universe, [0.1, 1, 2])
+    riparian['moderately'] = fuzz.trimf(riparian.universe, [1, 2, 3])
+    riparian['suitable'] = fuzz.trimf(riparian.universe, [2, 3, 4])
+    riparian['preferred'] = fuzz.trimf(riparian.universe, [3, 4, 4])
+
+    streamside['unsuitable'] = fuzz.trapmf(streamside.universe, [0, 0, 0.1, 1])
+    streamside['barely'] = fuzz.trimf(streamside.universe, [0.1, 1, 2])
+    streamside['moderately'] = fuzz.trimf(streamside.universe, [1, 2, 3])
+    streamside['suitable'] = fuzz.trimf(streamside.universe, [2, 3, 4])
+    streamside['preferred'] = fuzz.trimf(streamside.universe, [3, 4, 4])
+
+    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
+    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
+    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
+    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
+    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
+
+    # build fis rule table
+    rule1 = ctrl.Rule(riparian['unsuitable'] & streamside['unsuitable'], density['none'])
+    rule2 = ctrl.Rule(riparian['barely'] & streamside['unsuitable'], density['rare'])
+    rule3 = ctrl.Rule(riparian['moderately'] & streamside['unsuitable'], density['rare'])
+    rule4 = ctrl.Rule(riparian['suitable'] & streamside['unsuitable'], density['occasional'])
+    rule5 = ctrl.Rule(riparian['preferred'] & streamside['unsuitable'], density['occasional'])
+    rule6 = ctrl.Rule(riparian['unsuitable'] & streamside['barely'], density['rare'])
+    rule7 = ctrl.Rule(riparian['barely'] & streamside['barely'], density['rare']) # matBRAT has consequnt as 'occasional'
+    rule8 = ctrl.Rule(riparian['moderately'] & streamside['barely'], density['occasional'])
+    rule9 = ctrl.Rule(riparian['suitable'] & streamside['barely'], density['occasional'])
+    rule10 = ctrl.Rule(riparian['preferred'] & streamside['barely'], density['occasional'])
+    rule11 = ctrl.Rule(riparian['unsuitable'] & streamside['moderately'], density['rare'])
+    rule12 = ctrl.Rule(riparian['barely'] & streamside['moderately'], density['occasional'])
+    rule13 = ctrl.Rule(riparian['moderately'] & streamside['moderately'], density['occasional'])
+    rule14 = ctrl.Rule(riparian['suitable'] & streamside['moderately'], density['frequent'])
+    rule15 = ctrl.Rule(riparian['preferred'] & streamside['moderately'], density['frequent'])
+    rule16 = ctrl.Rule(riparian['unsuitable'] & streamside['suitable'], density['occasional'])
+    rule17 = ctrl.Rule(riparian['barely'] & streamside['suitable'], density['occasional'])
+    rule18 = ctrl.Rule(riparian['moderately'] & streamside['suitable'], density['frequent'])
+    rule19 = ctrl.Rule(riparian['suitable'] & streamside['suitable'], density['frequent'])
+    rule20 = ctrl.Rule(riparian['preferred'] & streamside['suitable'], density['pervasive'])
+    rule21 = ctrl.Rule(riparian['unsuitable'] & streamside['preferred'], density['occasional'])
+    rule22 = ctrl.Rule(riparian['barely'] & streamside['preferred'], density['frequent'])
+    rule23 = ctrl.Rule(riparian['moderately'] & streamside['preferred'], density['pervasive'])
+    rule24 = ctrl.Rule(riparian['suitable'] & streamside['preferred'], density['pervasive'])
+    rule25 = ctrl.Rule(riparian['preferred'] & streamside['preferred'], density['pervasive'])
+
+    # FIS
+    veg_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10, rule11,
+                                   rule12, rule13, rule14, rule15, rule16, rule17, rule18, rule19, rule20, rule21, rule22, rule23, rule24, rule25])
+    veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
+
+    # run fuzzy inference system on inputs and defuzzify output
+    out = np.zeros(len(riparian_array))
+    for i in range(len(out)):
+        veg_fis.input['input1'] = riparian_array[i]
+        veg_fis.input['input2'] = streamside_array[i]
+        veg_fis.compute()
+        out[i] = veg_fis.output['result']
+
+    return out
+
+
 def makeLayers(inputNetwork):
     """
     Makes the layers for the modified output
@@ -2,6 +2,7 @@ from osgeo import gdal, ogr
 import numpy as np
 import os
 import math
+import FastKernels
 
 class BDLoG:
     def __init__(self, brat, dem , fac, outDir, bratCap, stat = None):
@@ -577,7 +578,8 @@ class BDSWEA:
 
     def backwardHAND(self, startX, startY, startE, pondID):
         """
-        Recursively identify all cells draining to a dam location and the height of each cell above the dam.
+        Identify all cells draining to a dam location and the height of each cell above the dam (see
+        FastKernels.backward_hand, which is compiled when Numba is installed).
 
         :param startX: Column of dam location.
         :param startY: Row of dam location.
@@ -586,25 +588,9 @@ class BDSWEA:
 
         :return: None
         """
-        if startX > 0 and startY > 0 and startX < self.demDS.RasterXSize-1 and startY < self.demDS.RasterYSize-1:
-            demWin = self.dem[startY - 1:startY + 2, startX - 1:startX + 2].reshape(1, 9)
-            fdirWin = self.fdir[startY - 1:startY + 2, startX - 1:startX + 2].reshape(1, 9)
-            for i in range(0,9):
-                newX = startX
-                newY = startY
-                htAbove = demWin[0, i] - startE
-
-                if (self.drainsToMe(i, fdirWin[0,i]) and htAbove < self.MAX_HEIGHT and htAbove > -10.0) and self.count < self.MAX_COUNT:
-                    newX += self.COL_OFFSET[i]
-                    newY += self.ROW_OFFSET[i]
-                    htOld = self.htOut[newY, newX]
-
-                    if (htOld >= htAbove or htOld == -9999.0):
-                        self.idOut[newY, newX] = pondID
-                        self.htOut[newY, newX] = htAbove
-                        self.count += 1
-
-                        self.backwardHAND(newX, newY, startE, pondID)
+        self.count = FastKernels.backward_hand(self.dem, self.fdir, self.htOut, self.idOut, startX, startY, startE,
+                                               pondID, self.FLOW_DIR, self.ROW_OFFSET, self.COL_OFFSET,
+                                               self.MAX_HEIGHT, self.MAX_COUNT, self.count)
 
     def heightAboveDams(self):
         """
@@ -612,14 +598,8 @@ class BDSWEA:
 
         :return: None
         """
-        for i in range(1, self.fdir.shape[0]):
-            for j in range(1, self.fdir.shape[1]):
-                idVal = self.id[i,j]
-
-                if idVal >= 0:
-                    demVal = self.dem[i,j]
-                    self.count = 0
-                    self.backwardHAND(j, i, demVal, idVal)
+        FastKernels.height_above_dams(self.dem, self.fdir, self.id, self.htOut, self.idOut, self.FLOW_DIR,
+                                      self.ROW_OFFSET, self.COL_OFFSET, self.MAX_HEIGHT, self.MAX_COUNT)
 
     def calculateWaterDepth(self):
         """